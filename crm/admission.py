@@ -0,0 +1,194 @@
+"""Per-process admission control for the /graphql endpoint.
+
+Requests are sorted into priority lanes: mutations first, then ordinary
+queries, then reporting queries (root fields listed in
+``ADMISSION_REPORT_FIELDS``). The controller runs at most
+``ADMISSION_MAX_CONCURRENT`` requests at once, keeping
+``ADMISSION_RESERVED_FOR_MUTATIONS`` of those slots for mutations, so reports
+cannot starve writes. Up to ``ADMISSION_QUEUE_SIZE`` requests wait, highest
+lane first. A request that cannot start within ``ADMISSION_MAX_WAIT`` seconds,
+or that finds the queue full, is turned away.
+
+Each client also has a token bucket (``ADMISSION_CLIENT_RATE`` requests per
+second, bursting to ``ADMISSION_CLIENT_BURST``). It is checked before a
+request may queue.
+"""
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache
+
+from django.conf import settings
+from graphql import GraphQLSyntaxError, OperationDefinitionNode, OperationType, parse
+
+MUTATION = "mutation"
+QUERY = "query"
+REPORT = "report"
+LANES = (MUTATION, QUERY, REPORT)
+
+MAX_CONCURRENT = getattr(settings, "ADMISSION_MAX_CONCURRENT", 16)
+RESERVED_FOR_MUTATIONS = getattr(settings, "ADMISSION_RESERVED_FOR_MUTATIONS", 4)
+QUEUE_SIZE = getattr(settings, "ADMISSION_QUEUE_SIZE", 64)
+MAX_WAIT = getattr(settings, "ADMISSION_MAX_WAIT", 2.0)
+CLIENT_RATE = getattr(settings, "ADMISSION_CLIENT_RATE", 20.0)
+CLIENT_BURST = getattr(settings, "ADMISSION_CLIENT_BURST", 40)
+MAX_TRACKED_CLIENTS = getattr(settings, "ADMISSION_MAX_TRACKED_CLIENTS", 10000)
+REPORT_FIELDS = frozenset(getattr(settings, "ADMISSION_REPORT_FIELDS", ("topProducts", "allOrders")))
+
+
+class Rejected(Exception):
+    """Raised when a request is not admitted; ``retry_after`` is in seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@lru_cache(maxsize=256)
+def classify(query):
+    """Return the lane for a GraphQL document; unparseable documents count as queries."""
+    try:
+        document = parse(query)
+    except GraphQLSyntaxError:
+        return QUERY
+    lane = QUERY
+    for definition in document.definitions:
+        if not isinstance(definition, OperationDefinitionNode):
+            continue
+        if definition.operation == OperationType.MUTATION:
+            return MUTATION
+        if any(getattr(selection, "name", None) and selection.name.value in REPORT_FIELDS
+               for selection in definition.selection_set.selections):
+            lane = REPORT
+    return lane
+
+
+# ----------------------
+# Per-client rate limits
+# ----------------------
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Spend a token; return 0, or the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class ClientBuckets:
+    """Token buckets keyed by client, forgetting the least recently seen beyond a cap."""
+
+    def __init__(self, rate=CLIENT_RATE, burst=CLIENT_BURST, max_clients=MAX_TRACKED_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.rejected = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        with self._lock:
+            bucket = self._buckets.pop(client, None) or TokenBucket(self.rate, self.burst)
+            self._buckets[client] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            wait = bucket.take()
+            if wait:
+                self.rejected += 1
+            return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# ----------------------
+# Concurrency limiter
+# ----------------------
+class AdmissionController:
+    def __init__(self, max_concurrent=MAX_CONCURRENT, queue_size=QUEUE_SIZE, max_wait=MAX_WAIT,
+                 reserved_for_mutations=RESERVED_FOR_MUTATIONS):
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.reserved_for_mutations = min(reserved_for_mutations, max_concurrent - 1)
+        self.in_flight = Counter()
+        self.waiting = {lane: deque() for lane in LANES}
+        self.stats = Counter()
+        self._condition = threading.Condition()
+
+    def _capacity(self, lane):
+        if lane == MUTATION:
+            return self.max_concurrent
+        return self.max_concurrent - self.reserved_for_mutations
+
+    def _can_start(self, lane, ticket=None):
+        if sum(self.in_flight.values()) >= self._capacity(lane):
+            return False
+        # Waiters in higher lanes that could run now go first; FIFO within a lane
+        for higher in LANES[:LANES.index(lane)]:
+            if self.waiting[higher] and sum(self.in_flight.values()) < self._capacity(higher):
+                return False
+        queue = self.waiting[lane]
+        return not queue if ticket is None else queue[0] is ticket
+
+    def acquire(self, lane):
+        with self._condition:
+            if not self._can_start(lane):
+                if sum(len(queue) for queue in self.waiting.values()) >= self.queue_size:
+                    self.stats[f"rejected_queue_full_{lane}"] += 1
+                    raise Rejected("queue full", self.max_wait)
+
+                ticket = object()
+                self.waiting[lane].append(ticket)
+                deadline = time.monotonic() + self.max_wait
+                try:
+                    while not self._can_start(lane, ticket):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.stats[f"rejected_timeout_{lane}"] += 1
+                            raise Rejected("timed out waiting for a slot", self.max_wait)
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting[lane].remove(ticket)
+                    # The head of the queue may have changed; let the next waiter re-check
+                    self._condition.notify_all()
+            self.in_flight[lane] += 1
+            self.stats[f"admitted_{lane}"] += 1
+
+    def release(self, lane):
+        with self._condition:
+            self.in_flight[lane] -= 1
+            self._condition.notify_all()
+
+    def snapshot(self):
+        with self._condition:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "reserved_for_mutations": self.reserved_for_mutations,
+                "queue_size": self.queue_size,
+                "in_flight": {lane: self.in_flight[lane] for lane in LANES},
+                "waiting": {lane: len(self.waiting[lane]) for lane in LANES},
+                "stats": dict(self.stats),
+            }
+
+
+controller = AdmissionController()
+client_buckets = ClientBuckets()
+
+
+def get_state():
+    """Observable limiter state for this process."""
+    state = controller.snapshot()
+    state["tracked_clients"] = len(client_buckets)
+    state["stats"]["rejected_rate_limited"] = client_buckets.rejected
+    return state
@@ -0,0 +1,232 @@
+"""Hot/archive split for orders.
+
+Orders older than ``ORDER_ARCHIVE_AFTER_DAYS`` are moved in batches from
+``Order`` into ``ArchivedOrder`` (keeping their ids). Reads only touch the
+archive when an ``allOrders`` date window, or an ``order`` node id missing
+from the hot table, reaches into it.
+"""
+import datetime
+import heapq
+from functools import total_ordering
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .counting import adjust_row_count
+from .models import ArchivedOrder, Order
+from .routers import read_from_primary
+
+ARCHIVE_AFTER_DAYS = getattr(settings, "ORDER_ARCHIVE_AFTER_DAYS", 365)
+ARCHIVE_BATCH_SIZE = getattr(settings, "ORDER_ARCHIVE_BATCH_SIZE", 1000)
+
+
+def archive_cutoff():
+    """Orders placed before this moment belong in the archive."""
+    return timezone.now() - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def _before_cutoff(value, cutoff):
+    if not isinstance(value, datetime.datetime):
+        return value < cutoff.date()
+    return value < cutoff
+
+
+def reaches_archive(order_date__gte=None, order_date__lte=None):
+    """Whether an order date window can contain archived orders.
+
+    Archived orders are all older than the cutoff, so a window starting at
+    or after it cannot, and neither can an empty one (``lte`` before ``gte``).
+    """
+    if order_date__gte is not None and order_date__lte is not None and order_date__lte < order_date__gte:
+        return False
+    return order_date__gte is None or _before_cutoff(order_date__gte, archive_cutoff())
+
+
+def archive_orders(cutoff=None, batch_size=None):
+    """Move orders older than ``cutoff`` into the archive; return how many moved.
+
+    Each batch is copied and deleted in its own transaction, so the job can be
+    interrupted and resumed without losing or duplicating orders.
+    """
+    from .rankings import bump_orders_version
+
+    cutoff = cutoff or archive_cutoff()
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    OrderProducts = Order.products.through
+    ArchivedOrderProducts = ArchivedOrder.products.through
+    moved = 0
+
+    with read_from_primary():
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    Order.objects.filter(order_date__lt=cutoff)
+                    .order_by("pk")
+                    .values("id", "customer_id", "order_date", "total_amount")[:batch_size]
+                )
+                if not rows:
+                    break
+                ids = [row["id"] for row in rows]
+
+                ArchivedOrder.objects.bulk_create(
+                    [ArchivedOrder(**row) for row in rows], ignore_conflicts=True,
+                )
+                ArchivedOrderProducts.objects.bulk_create(
+                    [
+                        ArchivedOrderProducts(archivedorder_id=order_id, product_id=product_id)
+                        for order_id, product_id in OrderProducts.objects.filter(order_id__in=ids)
+                        .values_list("order_id", "product_id")
+                    ],
+                    ignore_conflicts=True,
+                )
+                # One DELETE per table: Order's post_delete receivers would make
+                # QuerySet.delete() load every row and update the counter per row.
+                # Nothing else references orders, and the counters and rankings
+                # those receivers maintain are adjusted once per batch instead.
+                OrderProducts.objects.filter(order_id__in=ids).delete()
+                deleted = Order.objects.filter(pk__in=ids)._raw_delete(Order.objects.db)
+                adjust_row_count(Order, -deleted)
+                adjust_row_count(ArchivedOrder, len(rows))
+                bump_orders_version()
+            moved += len(rows)
+    return moved
+
+
+@total_ordering
+class SortKey:
+    """Row position under an ordering with per-field directions; NULLs sort lowest."""
+
+    __slots__ = ("values", "descending")
+
+    def __init__(self, values, descending):
+        self.values = values
+        self.descending = descending
+
+    def __eq__(self, other):
+        return self.values == other.values
+
+    def __lt__(self, other):
+        for value, other_value, descending in zip(self.values, other.values, self.descending):
+            if value == other_value:
+                continue
+            if value is None or other_value is None:
+                less = value is None
+            else:
+                less = value < other_value
+            return less != descending
+        return False
+
+
+class OrderHistory:
+    """Hot and archived order querysets read as one lazily sliced sequence.
+
+    Both partitions are sorted by ``ordering`` (with ``pk`` as the final
+    tiebreak) and merged row by row, so the sequence is in global order
+    whichever fields it is sorted on. Slices fetch at most ``stop`` rows from
+    each partition and never count them.
+    """
+
+    def __init__(self, hot, archive, ordering=(), start=0, stop=None):
+        self.ordering = tuple(ordering)
+        fields = [field.lstrip("-") for field in self.ordering]
+        if "pk" not in fields and "id" not in fields:
+            self.ordering += ("pk",)
+        self.paths, related = [], set()
+        for field in self.ordering:
+            path = self._path(hot.model, field.lstrip("-"))
+            self.paths.append(path)
+            related.update("__".join(path[:i]) for i in range(1, len(path)))
+        self.descending = tuple(field.startswith("-") for field in self.ordering)
+        expressions = [
+            F(field[1:]).desc(nulls_last=True) if field.startswith("-") else F(field).asc(nulls_first=True)
+            for field in self.ordering
+        ]
+        self.hot = hot.select_related(*related).order_by(*expressions) if related else hot.order_by(*expressions)
+        self.archive = (
+            archive.select_related(*related).order_by(*expressions) if related else archive.order_by(*expressions)
+        )
+        self.start = start
+        self.stop = stop
+
+    @staticmethod
+    def _path(model, field):
+        """Attribute path of an ordering field, following forward foreign keys only."""
+        path = field.split("__")
+        for i, name in enumerate(path):
+            if name == "pk" and i == len(path) - 1:
+                break
+            try:
+                model_field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise ValueError(f"Cannot order orders by '{field}'.")
+            if model_field.many_to_many or model_field.one_to_many:
+                raise ValueError(f"Cannot order orders by '{field}': it has many values per order.")
+            if i < len(path) - 1:
+                if not model_field.is_relation:
+                    raise ValueError(f"Cannot order orders by '{field}'.")
+                model = model_field.related_model
+            elif model_field.is_relation:
+                path[i] = model_field.attname
+        return path
+
+    def sort_key(self, order):
+        values = []
+        for path in self.paths:
+            value = order
+            for name in path:
+                value = getattr(value, name) if value is not None else None
+            values.append(value)
+        return SortKey(values, self.descending)
+
+    @property
+    def parts(self):
+        return self.hot, self.archive
+
+    def map(self, func):
+        """Return a new history with ``func`` applied to both querysets."""
+        return OrderHistory(func(self.hot), func(self.archive), self.ordering, self.start, self.stop)
+
+    def count(self):
+        """Exact length; runs COUNT(*) on both partitions."""
+        total = sum(part.count() for part in self.parts)
+        stop = total if self.stop is None else min(self.stop, total)
+        return max(stop - self.start, 0)
+
+    def counted(self):
+        """This history with ``len()`` support, for paging that needs the total."""
+        return CountedOrderHistory(self.hot, self.archive, self.ordering, self.start, self.stop)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            if item.step not in (None, 1):
+                raise ValueError("OrderHistory does not support slice steps.")
+            start = self.start + (item.start or 0)
+            stop = self.stop
+            if item.stop is not None:
+                stop = self.start + item.stop if stop is None else min(stop, self.start + item.stop)
+            return OrderHistory(self.hot, self.archive, self.ordering, start, stop)
+        return next(islice(iter(self), item, None))
+
+    def __iter__(self):
+        if self.stop is None:
+            return self.iterator()
+        if self.stop <= self.start:
+            return iter(())
+        # The first ``stop`` rows of the merge come from the first ``stop`` of each partition
+        parts = [list(part[:self.stop]) for part in self.parts]
+        return islice(heapq.merge(*parts, key=self.sort_key), self.start, self.stop)
+
+    def iterator(self, chunk_size=2000):
+        """Stream the merged sequence with one server-side cursor per partition."""
+        parts = [part.iterator(chunk_size=chunk_size) for part in self.parts]
+        return islice(heapq.merge(*parts, key=self.sort_key), self.start, self.stop)
+
+
+class CountedOrderHistory(OrderHistory):
+    # Kept out of OrderHistory itself: list() asks for len() as a size hint
+    def __len__(self):
+        return self.count()
@@ -0,0 +1,113 @@
+"""Pluggable broadcast backends feeding GraphQL subscriptions.
+
+Model signals publish small events (a channel name plus a JSON-able payload)
+and every subscription running in this process reads them from its own
+bounded queue. The backend class is chosen with ``CRM_BROADCAST_BACKEND``;
+``InMemoryBroadcast`` serves single-node deployments and tests, and a
+cross-process backend only has to implement ``publish`` and call
+``deliver`` for the events it receives.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+ORDER_CREATED = "orderCreated"
+PRODUCT_STOCK_CHANGED = "productStockChanged"
+LOW_STOCK_ALERT = "lowStockAlert"
+
+
+class Event:
+    """One published event, shared by every local subscriber of its channel.
+
+    Subscribers running the same subscription document reuse work through
+    ``cache``, so an event costs one model load and one execution per
+    distinct query rather than one per subscriber.
+    """
+
+    def __init__(self, channel, payload):
+        self.channel = channel
+        self.payload = payload
+        self.cache = {}
+        self._lock = threading.Lock()
+
+    def load(self, key, loader):
+        """Return ``loader()`` once per event and key, memoised across subscribers."""
+        with self._lock:
+            if key not in self.cache:
+                self.cache[key] = loader()
+            return self.cache[key]
+
+
+class BaseBroadcast:
+    """Local fan-out from published events to subscriber queues."""
+
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or getattr(settings, "CRM_BROADCAST_QUEUE_SIZE", 100)
+        self._subscribers = defaultdict(set)
+        self._loop = None
+
+    def publish(self, channel, payload):
+        raise NotImplementedError
+
+    def subscriber_count(self, channel=None):
+        if channel is not None:
+            return len(self._subscribers.get(channel, ()))
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def deliver(self, event):
+        """Hand an event to every local subscriber; must run on the event loop."""
+        for queue in tuple(self._subscribers.get(event.channel, ())):
+            if queue.full():
+                # Slow consumers lose their oldest event instead of stalling the rest
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def deliver_threadsafe(self, event):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self.deliver(event)
+        else:
+            loop.call_soon_threadsafe(self.deliver, event)
+
+    async def subscribe(self, channel):
+        """Async iterator over the events published on ``channel``."""
+        self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[channel].add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers[channel].discard(queue)
+            if not self._subscribers[channel]:
+                del self._subscribers[channel]
+
+
+class InMemoryBroadcast(BaseBroadcast):
+    """Single-process backend: publishing delivers straight to local queues."""
+
+    def publish(self, channel, payload):
+        if not self._subscribers.get(channel):
+            return
+        self.deliver_threadsafe(Event(channel, payload))
+
+
+_broadcast = None
+
+
+def get_broadcast():
+    """Return the process-wide broadcast backend."""
+    global _broadcast
+    if _broadcast is None:
+        backend = getattr(settings, "CRM_BROADCAST_BACKEND", "crm.broadcast.InMemoryBroadcast")
+        _broadcast = import_string(backend)()
+    return _broadcast
@@ -0,0 +1,91 @@
+"""Per-process product catalog cache.
+
+The catalog is small and changes far less often than orders are placed, so
+each process keeps a snapshot of every product's name, price and stock keyed
+by id. Snapshots are tagged with a version number held in the Django cache,
+which must be shared by every process (``CACHES`` points at Redis).
+``Product`` saves and deletes bump it on commit (see ``crm.signals``), as do
+the bulk writes that skip those signals, and the next read in any process
+rebuilds its snapshot with one query.
+"""
+import time
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Product
+
+VERSION_KEY = "crm:catalog:version"
+
+CatalogEntry = namedtuple("CatalogEntry", ("id", "name", "price", "stock"))
+
+
+class Catalog:
+    """Immutable snapshot of the product table, keyed by id."""
+
+    def __init__(self, version, entries):
+        self.version = version
+        self.entries = entries
+
+    def get(self, product_id):
+        try:
+            return self.entries.get(int(product_id))
+        except (TypeError, ValueError):
+            return None
+
+    def get_many(self, product_ids):
+        """Return the entries for the distinct known ids, in first-seen order."""
+        found = {}
+        for product_id in product_ids:
+            entry = self.get(product_id)
+            if entry is not None:
+                found.setdefault(entry.id, entry)
+        return list(found.values())
+
+    def get_product(self, product_id):
+        """Return an unsaved Product built from the snapshot, or None."""
+        entry = self.get(product_id)
+        if entry is None:
+            return None
+        return Product(id=entry.id, name=entry.name, price=entry.price, stock=entry.stock)
+
+
+_catalog = None
+
+
+def initial_version():
+    # Versions start from the clock rather than 1: if the key is ever evicted,
+    # the new version cannot match a snapshot some process still holds
+    return time.time_ns()
+
+
+def get_catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, initial_version(), timeout=None)
+        version = cache.get(VERSION_KEY, 0)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate every process's snapshot once the current transaction commits."""
+    def bump():
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, initial_version(), timeout=None)
+    transaction.on_commit(bump)
+
+
+def get_catalog():
+    """Return the current snapshot, rebuilding it if the version moved on."""
+    global _catalog
+    version = get_catalog_version()
+    if _catalog is None or _catalog.version != version:
+        entries = {
+            row[0]: CatalogEntry(*row)
+            for row in Product.objects.values_list("id", "name", "price", "stock")
+        }
+        _catalog = Catalog(version, entries)
+    return _catalog
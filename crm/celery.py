@@ -1,6 +1,7 @@
 from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
+from celery.signals import before_task_publish, task_postrun, task_prerun
 
 # Set default Django settings module
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "crm.settings")
@@ -12,6 +13,59 @@ app = Celery("crm", broker="redis://localhost:6379/0")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
 
+# On-demand profiling of single task runs (see crm.profiling)
+@task_prerun.connect
+def start_task_profile(**kwargs):
+    from crm.profiling import start_task_profile
+
+    start_task_profile(**kwargs)
+
+
+@task_postrun.connect
+def stop_task_profile(**kwargs):
+    from crm.profiling import stop_task_profile
+
+    stop_task_profile(**kwargs)
+
+
+# Trace spans for tasks, continuing the publisher's trace (see crm.tracing)
+@before_task_publish.connect
+def inject_trace_headers(**kwargs):
+    from crm.tracing import inject_task_headers
+
+    inject_task_headers(**kwargs)
+
+
+@task_prerun.connect
+def start_task_span(**kwargs):
+    from crm.tracing import start_task_span
+
+    start_task_span(**kwargs)
+
+
+@task_postrun.connect
+def stop_task_span(**kwargs):
+    from crm.tracing import stop_task_span
+
+    stop_task_span(**kwargs)
+
+
 @app.task(bind=True)
 def debug_task(self):
     print(f"Celery task {self.request.id} executed")
+
+
+@app.task
+def drain_outbox():
+    """Hand pending outbox events to their handlers, in batches."""
+    from crm.outbox import drain
+
+    return drain()
+
+
+@app.task
+def compact_outbox():
+    """Drop superseded and long-processed outbox events."""
+    from crm.outbox import compact
+
+    return compact()
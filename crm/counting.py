@@ -0,0 +1,107 @@
+"""Counting strategies behind the ``totalCount`` field of connections.
+
+* Unfiltered querysets read the ``RowCounter`` shards maintained by signals.
+* Filtered querysets are counted up to ``TOTAL_COUNT_CAP`` rows
+  (``TOTAL_COUNT_STRATEGY = "capped"``), or use the query planner's row
+  estimate where the backend has one (``"estimate"``, PostgreSQL).
+* ``totalCount(exact: true)`` always runs a full ``COUNT(*)``.
+
+Counts are returned as ``(value, is_exact)``.
+"""
+import json
+import random
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Sum
+
+from .models import RowCounter
+from .routers import read_from_primary
+
+TOTAL_COUNT_CAP = getattr(settings, "TOTAL_COUNT_CAP", 10000)
+TOTAL_COUNT_STRATEGY = getattr(settings, "TOTAL_COUNT_STRATEGY", "capped")
+ROW_COUNTER_SHARDS = getattr(settings, "ROW_COUNTER_SHARDS", 8)
+
+
+# ----------------------
+# Maintained counters
+# ----------------------
+def adjust_row_count(model, delta):
+    """Apply ``delta`` to a random shard of a model's counter, inside the caller's transaction."""
+    if not delta:
+        return
+    counters = RowCounter.objects.filter(table=model._meta.label)
+    if not counters.filter(shard=random.randrange(ROW_COUNTER_SHARDS)).update(rows=F("rows") + delta):
+        # Shards are created by reset_row_count; shard 0 exists once the counter does
+        counters.filter(shard=0).update(rows=F("rows") + delta)
+
+
+def reset_row_count(model):
+    """Set a model's counter to an exact COUNT(*), creating its shards as needed."""
+    label = model._meta.label
+    with read_from_primary(), transaction.atomic():
+        rows = model._default_manager.count()
+        RowCounter.objects.bulk_create(
+            [RowCounter(table=label, shard=shard) for shard in range(ROW_COUNTER_SHARDS)],
+            ignore_conflicts=True,
+        )
+        RowCounter.objects.filter(table=label, shard=0).update(rows=rows)
+        RowCounter.objects.filter(table=label, shard__gt=0).update(rows=0)
+    return rows
+
+
+def get_row_count(model):
+    counter = RowCounter.objects.filter(table=model._meta.label).aggregate(rows=Sum("rows"), shards=Count("pk"))
+    if not counter["shards"]:
+        return reset_row_count(model)
+    return counter["rows"]
+
+
+def refresh_row_counts(models):
+    """Recount every table exactly, correcting drift from signal-less bulk writes."""
+    for model in models:
+        reset_row_count(model)
+
+
+# ----------------------
+# Strategies
+# ----------------------
+def is_unfiltered(queryset):
+    query = queryset.query
+    return not query.where and not query.distinct and not query.is_sliced
+
+
+def capped_count(queryset, cap=None):
+    cap = TOTAL_COUNT_CAP if cap is None else cap
+    value = queryset[:cap + 1].count()
+    return (cap, False) if value > cap else (value, True)
+
+
+def estimated_count(queryset):
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return capped_count(queryset)
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"]), False
+
+
+def count_rows(iterable, exact=False):
+    """Return ``(count, is_exact)`` for a connection's resolved iterable."""
+    if hasattr(iterable, "parts"):
+        # crm.archive.OrderHistory: hot and archived orders counted separately
+        parts = [count_rows(part, exact) for part in iterable.parts]
+        return sum(value for value, _ in parts), all(is_exact for _, is_exact in parts)
+    if not hasattr(iterable, "query"):
+        return len(iterable), True
+    if exact:
+        return iterable.count(), True
+    if is_unfiltered(iterable):
+        return get_row_count(iterable.model), True
+    if TOTAL_COUNT_STRATEGY == "estimate":
+        return estimated_count(iterable)
+    return capped_count(iterable)
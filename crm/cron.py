@@ -1,77 +1,58 @@
-import datetime
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+import uuid
+
+from django.conf import settings
+
+from . import tracing
+from .graphql_client import get_client, gql
+from .joblog import get_job_logger, job_run
 
 LOG_FILE = "/tmp/crm_heartbeat_log.txt"
 LOW_STOCK_LOG_FILE = "/tmp/low_stock_updates_log.txt"
-GRAPHQL_ENDPOINT = "http://localhost:8000/graphql"
+READINESS_URL = getattr(settings, "READINESS_URL", "http://localhost:8000/readyz")
 
 def log_crm_heartbeat():
-    # Timestamp
-    timestamp = datetime.datetime.now().strftime("%d/%m/%Y-%H:%M:%S")
-    message = f"{timestamp} CRM is alive"
-
-    # Optional GraphQL check using gql
-    try:
-        transport = RequestsHTTPTransport(
-            url=GRAPHQL_ENDPOINT,
-            verify=True,
-            retries=3,
-        )
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-
-        query = gql("{ hello }")
-        result = client.execute(query)
-        hello_msg = result.get("hello")
-        if hello_msg:
-            message += f" | GraphQL hello: {hello_msg}"
-    except Exception as e:
-        message += f" | GraphQL check failed: {e}"
-
-    # Append log
-    with open(LOG_FILE, "a") as f:
-        f.write(message + "\n")
+    with job_run(get_job_logger(LOG_FILE), "crm_heartbeat") as log:
+        # /readyz checks the server's dependencies without touching the GraphQL schema
+        try:
+            import requests
+
+            response = requests.get(READINESS_URL, headers=tracing.inject(), timeout=5)
+            body = response.json()
+            failing = sorted(name for name, check in body.get("checks", {}).items() if not check["ok"])
+            if response.status_code == 200:
+                log.info("CRM is alive", extra={"ready": True})
+            else:
+                log.warning("CRM is alive", extra={"ready": False, "failing_checks": failing, "checks": body.get("checks")})
+        except Exception as e:
+            log.warning("CRM is alive", extra={"health_error": str(e)})
 
 def update_low_stock():
     """Execute UpdateLowStockProducts mutation and log updated products."""
-    timestamp = datetime.datetime.now().strftime("%d/%m/%Y-%H:%M:%S")
-    message_header = f"{timestamp} Low stock update executed\n"
-
-    # Setup GraphQL client
-    transport = RequestsHTTPTransport(
-        url=GRAPHQL_ENDPOINT,
-        verify=True,
-        retries=3,
-    )
-    client = Client(transport=transport, fetch_schema_from_transport=True)
-
-    # GraphQL mutation
-    mutation = gql("""
-        mutation {
-            updateLowStockProducts {
-                success
-                message
-                updatedProducts {
-                    name
-                    stock
+    with job_run(get_job_logger(LOW_STOCK_LOG_FILE), "update_low_stock") as log:
+        # Setup GraphQL client; one key per run, so transport retries cannot restock twice
+        client = get_client(idempotency_key=f"update-low-stock-{uuid.uuid4()}")
+
+        # GraphQL mutation
+        mutation = gql("""
+            mutation {
+                updateLowStockProducts {
+                    success
+                    message
+                    updatedProducts {
+                        name
+                        stock
+                    }
                 }
             }
-        }
-    """)
+        """)
 
-    try:
-        result = client.execute(mutation)
-        updated_products = result.get("updateLowStockProducts", {}).get("updatedProducts", [])
-        
-        # Prepare log entries
-        log_entries = [message_header]
-        for product in updated_products:
-            log_entries.append(f"Product: {product['name']}, New Stock: {product['stock']}\n")
+        try:
+            result = client.execute(mutation)
+            updated_products = result.get("updateLowStockProducts", {}).get("updatedProducts", [])
 
-        # Append to log file
-        with open(LOW_STOCK_LOG_FILE, "a") as f:
-            f.writelines(log_entries)
+            for product in updated_products:
+                log.info("Product restocked", extra={"product": product["name"], "stock": product["stock"]})
+            log.info("Low stock update executed", extra={"updated": len(updated_products)})
 
-    except Exception as e:
-        with open(LOW_STOCK_LOG_FILE, "a") as f:
-            f.write(f"{timestamp} Error updating low stock: {e}\n")
\ No newline at end of file
+        except Exception as e:
+            log.error("Error updating low stock", extra={"error": str(e)})
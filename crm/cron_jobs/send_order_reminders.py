@@ -1,52 +1,59 @@
 #!/usr/bin/env python3
+"""Log a reminder for every order of the last 7 days.
+
+Run from the project root so ``crm`` is importable:
+``python3 -m crm.cron_jobs.send_order_reminders``.
+"""
+import os
 import sys
 import datetime
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
 
-LOG_FILE = "/tmp/order_reminders_log.txt"
-GRAPHQL_ENDPOINT = "http://localhost:8000/graphql"
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "crm.settings")
 
-def main():
-    # Setup GraphQL client
-    transport = RequestsHTTPTransport(
-        url=GRAPHQL_ENDPOINT,
-        verify=True,
-        retries=3,
-    )
-    client = Client(transport=transport, fetch_schema_from_transport=True)
+from crm.graphql_client import get_client, gql
+from crm.joblog import get_job_logger, job_run
 
-    # Calculate date 7 days ago
-    seven_days_ago = (datetime.datetime.now() - datetime.timedelta(days=7)).isoformat()
-
-    # GraphQL query (adjust field names if needed)
-    query = gql("""
-        query GetRecentOrders($date: DateTime!) {
-            orders(orderDate_Gte: $date) {
-                id
-                customer {
-                    email
+LOG_FILE = "/tmp/order_reminders_log.txt"
+
+RECENT_ORDERS_QUERY = """
+    query GetRecentOrders($date: Date!) {
+        allOrders(orderDate_Gte: $date) {
+            edges {
+                node {
+                    id
+                    customer {
+                        email
+                    }
                 }
             }
         }
-    """)
+    }
+"""
+
+def main():
+    # Calculate date 7 days ago
+    seven_days_ago = (datetime.date.today() - datetime.timedelta(days=7)).isoformat()
+
+    query = gql(RECENT_ORDERS_QUERY)
 
-    try:
-        result = client.execute(query, variable_values={"date": seven_days_ago})
-        orders = result.get("orders", [])
+    with job_run(get_job_logger(LOG_FILE), "send_order_reminders") as log:
+        try:
+            # Created inside the run, so its requests join the run's trace
+            client = get_client()
+            result = client.execute(query, variable_values={"date": seven_days_ago})
+            orders = [edge["node"] for edge in result["allOrders"]["edges"]]
 
-        with open(LOG_FILE, "a") as f:
+            # Records are queued in memory and written in batches by the logger's thread
             for order in orders:
-                order_id = order["id"]
-                email = order["customer"]["email"]
-                log_entry = f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} - Order ID: {order_id}, Customer Email: {email}\n"
-                f.write(log_entry)
+                log.info("Order reminder", extra={"order_id": order["id"], "customer_email": order["customer"]["email"]})
+            log.info("Order reminders processed", extra={"reminders": len(orders)})
 
-        print("Order reminders processed!")
+            print("Order reminders processed!")
 
-    except Exception as e:
-        print(f"Error processing order reminders: {e}", file=sys.stderr)
-        sys.exit(1)
+        except Exception as e:
+            log.error("Error processing order reminders", extra={"error": str(e)})
+            print(f"Error processing order reminders: {e}", file=sys.stderr)
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
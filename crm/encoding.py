@@ -0,0 +1,71 @@
+"""JSON encoding for GraphQL responses.
+
+By the time a result reaches the encoder, graphene has already turned
+Decimal, DateTime and relay global IDs into strings, so encoding is mostly
+copying strings and dicts. The stock view does that with ``json.dumps``,
+which builds a ``str`` that Django then encodes to UTF-8 again.
+
+``encode`` uses orjson when it is installed (``GRAPHQL_JSON_ENCODER =
+"auto"``). orjson writes UTF-8 bytes straight into the response body and
+handles datetimes itself. Without orjson it falls back to one shared stdlib
+encoder with the C accelerator and ``ensure_ascii`` off. Values that skip
+scalar serialization (e.g. inside a ``GenericScalar``) are converted the same
+way on both paths: Decimal becomes a string, matching graphene's Decimal
+scalar, and dates become ISO 8601.
+"""
+import datetime
+import json
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils.functional import Promise
+
+try:
+    import orjson
+except ImportError:  # optional
+    orjson = None
+
+AUTO = "auto"
+ORJSON = "orjson"
+STDLIB = "stdlib"
+
+JSON_ENCODER = getattr(settings, "GRAPHQL_JSON_ENCODER", AUTO)
+
+
+def default(value):
+    """Convert the non-JSON types a resolver may hand back unserialized."""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (uuid.UUID, Promise)):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+_stdlib_encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=default)
+
+
+def encode_stdlib(data):
+    return _stdlib_encoder.encode(data).encode("utf-8")
+
+
+def encode_orjson(data):
+    return orjson.dumps(data, default=default)
+
+
+def get_encoder(name=JSON_ENCODER):
+    """Return ``(name, encode)`` for ``name``; ``auto`` prefers orjson when available."""
+    if name == AUTO:
+        name = ORJSON if orjson is not None else STDLIB
+    if name == ORJSON:
+        if orjson is None:
+            raise ImportError("GRAPHQL_JSON_ENCODER is 'orjson' but orjson is not installed.")
+        return name, encode_orjson
+    if name == STDLIB:
+        return name, encode_stdlib
+    raise ValueError(f"Unknown JSON encoder {name!r}.")
+
+
+ENCODER_NAME, encode = get_encoder()
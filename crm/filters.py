@@ -1,5 +1,5 @@
 import django_filters
-from .models import Customer, Product, Order
+from .models import Customer, CustomerSegment, Product, Order, normalize_phone
 
 
 class CustomerFilter(django_filters.FilterSet):
@@ -11,12 +11,21 @@ class CustomerFilter(django_filters.FilterSet):
     # Challenge: phone pattern (e.g., starts with +1)
     phone_pattern = django_filters.CharFilter(method="filter_phone_pattern")
 
+    # RFM segment from the last refresh (see crm.segments)
+    segment = django_filters.ChoiceFilter(field_name="rfm__segment", choices=CustomerSegment.SEGMENTS)
+
     def filter_phone_pattern(self, queryset, name, value):
-        return queryset.filter(phone__startswith=value)
+        # Prefix match as an indexed range scan over the normalized E.164 column,
+        # so "+1234" and "123-4" find the same customers
+        prefix = normalize_phone(value)
+        if not prefix:
+            return queryset
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return queryset.filter(phone_normalized__gte=prefix, phone_normalized__lt=upper)
 
     class Meta:
         model = Customer
-        fields = ["name", "email", "created_at__gte", "created_at__lte", "phone_pattern"]
+        fields = ["name", "email", "created_at__gte", "created_at__lte", "phone_pattern", "segment"]
 
 
 class ProductFilter(django_filters.FilterSet):
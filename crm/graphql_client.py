@@ -0,0 +1,56 @@
+"""GraphQL client shared by the cron jobs and Celery tasks.
+
+``gql`` and ``requests`` are imported on first use, so worker processes that
+never run a reporting job do not pay for them at startup. When the schema
+artifact written by ``manage.py build_schema_artifact`` exists, clients
+validate against it instead of introspecting the server on every run.
+Requests carry the current trace context, see ``crm.tracing``.
+"""
+from pathlib import Path
+
+from django.conf import settings
+
+from . import tracing
+
+GRAPHQL_ENDPOINT = getattr(settings, "GRAPHQL_ENDPOINT", "http://localhost:8000/graphql")
+SCHEMA_ARTIFACT = getattr(settings, "GRAPHQL_SCHEMA_ARTIFACT", None)
+
+_schema_sdl = None
+
+
+def load_schema_sdl():
+    """Return the prebuilt SDL, or None when no artifact has been built."""
+    global _schema_sdl
+    if _schema_sdl is None and SCHEMA_ARTIFACT and Path(SCHEMA_ARTIFACT).exists():
+        _schema_sdl = Path(SCHEMA_ARTIFACT).read_text()
+    return _schema_sdl
+
+
+def get_client(url=GRAPHQL_ENDPOINT, idempotency_key=None):
+    """Return a gql client; pass ``idempotency_key`` when it will run a mutation.
+
+    The transport retries failed POSTs, and every retry carries the same key,
+    so the server executes the mutation at most once.
+    """
+    from gql import Client
+    from gql.transport.requests import RequestsHTTPTransport
+
+    headers = tracing.inject()
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+    transport = RequestsHTTPTransport(
+        url=url,
+        headers=headers or None,
+        verify=True,
+        retries=3,
+    )
+    sdl = load_schema_sdl()
+    if sdl:
+        return Client(transport=transport, schema=sdl)
+    return Client(transport=transport, fetch_schema_from_transport=True)
+
+
+def gql(source):
+    from gql import gql as parse_document
+
+    return parse_document(source)
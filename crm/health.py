@@ -0,0 +1,194 @@
+"""Liveness and readiness checks behind /healthz and /readyz.
+
+/healthz only shows that the process serves requests. It touches no
+dependency, so a slow database never gets a healthy process restarted.
+
+/readyz runs the checks in ``READINESS_CHECKS``:
+
+* ``database``: ``SELECT 1`` on the primary;
+* ``cache``: a set and get round trip through the default cache, which
+  must be shared by every process: a LocMem or dummy cache fails the check;
+* ``broker``: a connection to the Celery broker;
+* ``replica_lag``: for each of ``DATABASE_REPLICAS``, a ping and, on MySQL
+  and PostgreSQL, the replication delay, which must stay under
+  ``HEALTH_MAX_REPLICA_LAG`` seconds. Skipped when no replicas are configured.
+
+The checks run in parallel on a small thread pool, and a check that has not
+finished within ``HEALTH_CHECK_TIMEOUT`` seconds fails, so a hung database
+cannot hang the probe. The outcome is kept in memory for ``HEALTH_CACHE_TTL``
+seconds. Only one probe at a time refreshes it; the others get the last
+outcome meanwhile, so frequent probes from load balancers and the heartbeat
+job cost at most one round of checks per process per TTL.
+"""
+import threading
+import time
+import uuid
+from concurrent import futures
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+
+from .routers import PRIMARY_DB, get_replicas
+
+READINESS_CHECKS = tuple(getattr(settings, "READINESS_CHECKS", ("database", "cache", "broker", "replica_lag")))
+HEALTH_CACHE_TTL = getattr(settings, "HEALTH_CACHE_TTL", 5)
+HEALTH_CHECK_TIMEOUT = getattr(settings, "HEALTH_CHECK_TIMEOUT", 2)
+HEALTH_MAX_REPLICA_LAG = getattr(settings, "HEALTH_MAX_REPLICA_LAG", 30)
+
+CACHE_PROBE_KEY = "crm:health:probe"
+
+
+class CheckFailed(Exception):
+    pass
+
+
+# ----------------------
+# Checks
+# ----------------------
+def ping(alias):
+    with connections[alias].cursor() as cursor:
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+
+
+def check_database():
+    ping(PRIMARY_DB)
+
+
+def check_cache():
+    cache = caches[DEFAULT_CACHE_ALIAS]
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        raise CheckFailed(f"{type(cache).__name__} is not shared between processes")
+    token = uuid.uuid4().hex
+    cache.set(CACHE_PROBE_KEY, token, timeout=HEALTH_CACHE_TTL + 10)
+    if cache.get(CACHE_PROBE_KEY) != token:
+        raise CheckFailed("cache did not return the value just written")
+
+
+def check_broker():
+    from .celery import app
+
+    with app.connection_for_write() as connection:
+        connection.ensure_connection(max_retries=1, timeout=HEALTH_CHECK_TIMEOUT)
+
+
+def replica_lag(alias):
+    """Seconds the replica is behind, or None where the backend cannot tell."""
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+            )
+            lag = cursor.fetchone()[0]
+        elif connection.vendor == "mysql":
+            cursor.execute("SHOW REPLICA STATUS")
+            row = cursor.fetchone()
+            if row is None:
+                raise CheckFailed("replication is not configured")
+            status = dict(zip((column[0] for column in cursor.description), row))
+            lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+            if lag is None:
+                raise CheckFailed("replication is not running")
+        else:
+            cursor.execute("SELECT 1")
+            return None
+    return float(lag) if lag is not None else 0.0
+
+
+def check_replica_lag():
+    lags = {}
+    for alias in get_replicas():
+        lag = lags[alias] = replica_lag(alias)
+        if lag is not None and lag > HEALTH_MAX_REPLICA_LAG:
+            raise CheckFailed(f"{alias} is {lag:.0f}s behind (limit {HEALTH_MAX_REPLICA_LAG}s)")
+    return lags or None
+
+
+CHECKS = {
+    "database": check_database,
+    "cache": check_cache,
+    "broker": check_broker,
+    "replica_lag": check_replica_lag,
+}
+
+
+# ----------------------
+# Readiness
+# ----------------------
+# Room for a second round while a timed-out one still holds its threads
+_pool = futures.ThreadPoolExecutor(max_workers=2 * len(CHECKS), thread_name_prefix="crm-health")
+
+
+def run_check(name):
+    """Run one check on a pool thread; returns its result entry."""
+    started = time.monotonic()
+    try:
+        detail = CHECKS[name]()
+    except Exception as e:
+        result = {"ok": False, "error": str(e) or type(e).__name__}
+    else:
+        result = {"ok": True}
+        if detail is not None:
+            result["detail"] = detail
+    finally:
+        # Pool threads outlive the check; do not leave their connections open
+        connections.close_all()
+    result["ms"] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+
+def run_checks(names=READINESS_CHECKS):
+    """Run the named checks in parallel; returns ``(ready, results)``."""
+    pending = {name: _pool.submit(run_check, name) for name in names}
+    deadline = time.monotonic() + HEALTH_CHECK_TIMEOUT
+    results = {}
+    for name, future in pending.items():
+        try:
+            results[name] = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except futures.TimeoutError:
+            future.cancel()
+            results[name] = {"ok": False, "error": f"timed out after {HEALTH_CHECK_TIMEOUT}s",
+                             "ms": HEALTH_CHECK_TIMEOUT * 1000}
+    return all(result["ok"] for result in results.values()), results
+
+
+_last = None
+_refreshing = False
+_lock = threading.Lock()
+_refreshed = threading.Condition(_lock)
+
+
+def get_readiness():
+    """Readiness for this process, re-checked at most every HEALTH_CACHE_TTL seconds."""
+    global _last, _refreshing
+    with _lock:
+        stale = _last is None or time.monotonic() - _last[0] >= HEALTH_CACHE_TTL
+        refresh = stale and not _refreshing
+        if refresh:
+            _refreshing = True
+        elif _last is None:
+            # First round still running elsewhere: there is no earlier outcome to give
+            _refreshed.wait_for(lambda: _last is not None, timeout=HEALTH_CHECK_TIMEOUT + 1)
+
+    if refresh:
+        # Outside the lock, so probes arriving meanwhile answer at once
+        outcome = None
+        try:
+            outcome = run_checks()
+        finally:
+            with _lock:
+                if outcome is not None:
+                    _last = (time.monotonic(), *outcome)
+                _refreshing = False
+                _refreshed.notify_all()
+
+    with _lock:
+        if _last is None:
+            return False, {}, 0.0
+        checked, ready, results = _last
+    return ready, results, round(time.monotonic() - checked, 1)
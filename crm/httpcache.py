@@ -0,0 +1,174 @@
+"""HTTP caching for read-only GraphQL requests.
+
+Queries may be sent as GET, and persisted by hash the way Apollo's automatic
+persisted queries do it: ``extensions={"persistedQuery": {"version": 1,
+"sha256Hash": ...}}``. A hash the server has not seen yet gets a
+``PersistedQueryNotFound`` error. The client then resends the hash together
+with the query text, which registers it for ``PERSISTED_QUERY_TTL`` seconds
+in the ``PERSISTED_QUERY_CACHE`` cache. That cache must be shared by every
+process (the default one is Redis), or a hash registered on one worker would
+be unknown to the next.
+
+A GET query whose root fields all appear in ``HTTP_CACHE_FIELDS`` gets a
+strong ETag. The ETag is derived from the query, its variables and the data
+version of every model those fields read, e.g. the catalog version for
+products, which lives in the shared default cache so every process tags a
+response the same way. The versions are read before the query runs, so a response is
+never tagged as newer than it is. ``If-None-Match`` is answered with a 304
+before any resolver runs.
+
+Non-streaming responses of at least ``HTTP_COMPRESS_MIN_BYTES`` are gzipped
+for clients that accept it. The compressed variant gets its own ETag suffix,
+so the tags stay strong.
+"""
+import gzip
+import hashlib
+import json
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from graphql import FieldNode, OperationType, get_operation_ast
+
+from .catalog import get_catalog_version
+
+HTTP_CACHE_FIELDS = getattr(settings, "HTTP_CACHE_FIELDS", {
+    "allProducts": ("crm.Product",),
+    "product": ("crm.Product",),
+    "hello": (),
+})
+HTTP_CACHE_CONTROL = getattr(settings, "HTTP_CACHE_CONTROL", "public, max-age=0, must-revalidate")
+COMPRESS_MIN_BYTES = getattr(settings, "HTTP_COMPRESS_MIN_BYTES", 1024)
+PERSISTED_QUERY_TTL = getattr(settings, "PERSISTED_QUERY_TTL", 7 * 24 * 60 * 60)
+PERSISTED_QUERY_CACHE = getattr(settings, "PERSISTED_QUERY_CACHE", "default")
+
+PERSISTED_QUERY_PREFIX = "crm:persisted-query:"
+GZIP_SUFFIX = "-gzip"
+
+# Where each model's data version comes from; fields reading a model missing
+# here are never cached
+DATA_VERSIONS = {
+    "crm.Product": get_catalog_version,
+}
+
+_accepts_gzip = re.compile(r"\bgzip\b")
+
+
+# ----------------------
+# Persisted queries
+# ----------------------
+class PersistedQueryNotFound(Exception):
+    pass
+
+
+def _store():
+    return caches[PERSISTED_QUERY_CACHE]
+
+
+def resolve_persisted_query(query, extensions):
+    """Return the query text for a request, registering or looking up its hash."""
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise ValueError("Extensions are invalid JSON.")
+    persisted = (extensions or {}).get("persistedQuery") if isinstance(extensions, dict) else None
+    if not isinstance(persisted, dict) or not persisted.get("sha256Hash"):
+        return query
+
+    query_hash = str(persisted["sha256Hash"]).lower()
+    key = PERSISTED_QUERY_PREFIX + query_hash
+    if query:
+        if hashlib.sha256(query.encode("utf-8")).hexdigest() != query_hash:
+            raise ValueError("provided sha does not match query")
+        _store().set(key, query, PERSISTED_QUERY_TTL)
+        return query
+    query = _store().get(key)
+    if query is None:
+        raise PersistedQueryNotFound("PersistedQueryNotFound")
+    return query
+
+
+# ----------------------
+# ETags
+# ----------------------
+def cached_models(operation_ast):
+    """Model labels a cacheable query reads, or None if the query cannot be cached."""
+    if operation_ast is None or operation_ast.operation != OperationType.QUERY:
+        return None
+    labels = set()
+    for selection in operation_ast.selection_set.selections:
+        if not isinstance(selection, FieldNode):
+            return None
+        name = selection.name.value
+        if name == "__typename":
+            continue
+        if name not in HTTP_CACHE_FIELDS:
+            return None
+        labels.update(HTTP_CACHE_FIELDS[name])
+    if any(label not in DATA_VERSIONS for label in labels):
+        return None
+    return sorted(labels)
+
+
+def make_etag(document, query, variables, operation_name):
+    """Strong ETag for a GET query, or None if it is not cacheable."""
+    labels = cached_models(get_operation_ast(document, operation_name))
+    if labels is None:
+        return None
+    versions = [(label, DATA_VERSIONS[label]()) for label in labels]
+    key = json.dumps([query, variables or {}, operation_name, versions], sort_keys=True, default=str)
+    return f'"{hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]}"'
+
+
+def matching_etag(request, etag):
+    """The If-None-Match tag still current for ``etag``, if any.
+
+    Comparison is weak, as RFC 9110 asks for If-None-Match, and the gzip
+    variant of a tag matches too; the client's own tag is what a 304 repeats.
+    """
+    for tag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        if tag == "*":
+            return etag
+        base = tag.removeprefix("W/")
+        if base.endswith(GZIP_SUFFIX + '"'):
+            base = base[:-len(GZIP_SUFFIX) - 1] + '"'
+        if base == etag:
+            return tag
+    return None
+
+
+def not_modified(etag):
+    response = HttpResponseNotModified()
+    response["ETag"] = etag
+    response["Cache-Control"] = HTTP_CACHE_CONTROL
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
+# ----------------------
+# Compression
+# ----------------------
+def compress(request, response):
+    """Gzip a large response in place if the client accepts it."""
+    if response.streaming or response.has_header("Content-Encoding") or response.status_code != 200:
+        return response
+    if len(response.content) < COMPRESS_MIN_BYTES:
+        return response
+    patch_vary_headers(response, ("Accept-Encoding",))
+    if not _accepts_gzip.search(request.META.get("HTTP_ACCEPT_ENCODING", "")):
+        return response
+
+    compressed = gzip.compress(response.content, compresslevel=6, mtime=0)
+    if len(compressed) >= len(response.content):
+        return response
+    response.content = compressed
+    response["Content-Length"] = str(len(compressed))
+    response["Content-Encoding"] = "gzip"
+    etag = response.get("ETag")
+    if etag and not etag.startswith("W/"):
+        response["ETag"] = etag[:-1] + GZIP_SUFFIX + '"'
+    return response
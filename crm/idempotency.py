@@ -0,0 +1,152 @@
+"""Idempotency-Key support for GraphQL mutations.
+
+A POST carrying an ``Idempotency-Key`` header claims the key in the
+``IDEMPOTENCY_CACHE`` cache before it runs. That cache must be shared by
+every process (the default one is Redis), or retries landing on another
+worker would run again. When the request executed a mutation, its response
+(status, content type and zlib-compressed body) is kept for
+``IDEMPOTENCY_TTL`` seconds. A retry with the same key and body gets that
+response back without executing anything. A retry that arrives while the
+original is still running gets 409; reusing the key for a different body
+gets 422.
+
+A claim expires after ``IDEMPOTENCY_PENDING_TTL`` seconds, so a worker that
+dies mid-request does not block the key for long. While the request is
+still running, a background thread renews its claim every third of that.
+"""
+import hashlib
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+IDEMPOTENCY_CACHE = getattr(settings, "IDEMPOTENCY_CACHE", "default")
+IDEMPOTENCY_TTL = getattr(settings, "IDEMPOTENCY_TTL", 24 * 60 * 60)
+# How long an in-progress claim blocks retries if its worker dies mid-request
+IDEMPOTENCY_PENDING_TTL = getattr(settings, "IDEMPOTENCY_PENDING_TTL", 60)
+MAX_KEY_LENGTH = 255
+
+KEY_PREFIX = "crm:idempotency:"
+PENDING = 0
+DONE = 1
+
+
+class IdempotencyError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def _store():
+    return caches[IDEMPOTENCY_CACHE]
+
+
+# ----------------------
+# Claim renewal
+# ----------------------
+_held = set()
+_held_lock = threading.Lock()
+_renewer = None
+# Keys completed while a renewal pass was running, and whether one is
+_completed = set()
+_renewing = False
+
+
+def renew_claims():
+    """Extend the pending TTL of every claim this process is still working on.
+
+    The cache is only called outside ``_held_lock``, so a slow cache cannot
+    block claims in request threads. A key completed during the pass may have
+    had its full TTL cut back to the pending one by the touch; those keys get
+    their full TTL back at the end.
+    """
+    global _renewing, _completed
+    with _held_lock:
+        keys = list(_held)
+        _renewing = True
+    try:
+        for cache_key in keys:
+            _store().touch(cache_key, IDEMPOTENCY_PENDING_TTL)
+    finally:
+        with _held_lock:
+            completed, _completed = _completed, set()
+            _renewing = False
+    for cache_key in completed:
+        _store().touch(cache_key, IDEMPOTENCY_TTL)
+
+
+def _renew_claims_forever():
+    while True:
+        time.sleep(IDEMPOTENCY_PENDING_TTL / 3)
+        renew_claims()
+
+
+def _hold(cache_key):
+    global _renewer
+    with _held_lock:
+        _held.add(cache_key)
+        if _renewer is None:
+            _renewer = threading.Thread(target=_renew_claims_forever, name="idempotency-renewer", daemon=True)
+            _renewer.start()
+
+
+def _unhold(cache_key, completed=False):
+    with _held_lock:
+        _held.discard(cache_key)
+        if completed and _renewing:
+            _completed.add(cache_key)
+
+
+def _cache_key(key):
+    return KEY_PREFIX + hashlib.sha256(key.encode()).hexdigest()
+
+
+def fingerprint(body):
+    return hashlib.sha256(body).digest()[:16]
+
+
+def claim(key, body_fingerprint):
+    """Claim ``key`` for this request.
+
+    Returns ``None`` when the caller should execute the request, or a stored
+    ``(status, content_type, content)`` to replay.
+    """
+    if len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyError(f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters.", 400)
+    cache_key = _cache_key(key)
+    if _store().add(cache_key, (PENDING, body_fingerprint), IDEMPOTENCY_PENDING_TTL):
+        _hold(cache_key)
+        return None
+
+    entry = _store().get(cache_key)
+    if entry is None:
+        # Expired between add() and get(); claim it again
+        return claim(key, body_fingerprint)
+    state, stored_fingerprint = entry[:2]
+    if stored_fingerprint != body_fingerprint:
+        raise IdempotencyError("Idempotency-Key was already used for a different request.", 422)
+    if state == PENDING:
+        raise IdempotencyError("A request with this Idempotency-Key is still in progress.", 409)
+    status, content_type, compressed = entry[2:]
+    return status, content_type, zlib.decompress(compressed)
+
+
+def complete(key, body_fingerprint, status, content_type, content):
+    cache_key = _cache_key(key)
+    # Unheld before the response is stored: a renewal touch landing after the
+    # set then always sees the key in _completed
+    _unhold(cache_key, completed=True)
+    _store().set(
+        cache_key,
+        (DONE, body_fingerprint, status, content_type, zlib.compress(content)),
+        IDEMPOTENCY_TTL,
+    )
+
+
+def release(key):
+    """Drop a claim without storing a response, so the client may retry."""
+    cache_key = _cache_key(key)
+    _unhold(cache_key)
+    _store().delete(cache_key)
@@ -0,0 +1,333 @@
+"""Streaming bulk import of customers, products and orders.
+
+Input (CSV with a header row, or NDJSON) is read row by row and handled in
+chunks. Each row is validated with the model's own rules (``full_clean``).
+Validation can run in worker processes. Each chunk is then deduplicated
+against the database with one ``IN`` lookup per key and written with a
+single ``bulk_create`` in its own transaction. Nothing but the current chunks
+is held in memory.
+
+Columns:
+
+* customers: ``name``, ``email``, ``phone``; deduplicated by email, and
+  phones must not belong to another customer.
+* products: ``name``, ``price``, ``stock`` and optionally ``id``; rows
+  with an existing id are skipped or updated.
+* orders: ``customer_id`` or ``customer_email``, ``product_ids`` (a list,
+  or ``;``-separated in CSV), optional ``id``, ``order_date`` and
+  ``total_amount``. The total defaults to the sum of current product prices,
+  and rows with an existing id are skipped.
+"""
+import csv
+import json
+import multiprocessing
+import re
+import sys
+from collections import deque
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .catalog import bump_catalog_version, get_catalog
+from .counting import refresh_row_counts
+from .models import ArchivedOrder, Customer, Order, Product, normalize_phone
+from .rankings import bump_orders_version
+
+SKIP = "skip"
+UPDATE = "update"
+
+
+def read_rows(path, fmt):
+    """Yield ``(line_number, row)``; CSV rows are dicts, NDJSON rows raw text."""
+    handle = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+    try:
+        if fmt == "csv":
+            yield from enumerate(csv.DictReader(handle), start=2)
+        else:
+            for line, text in enumerate(handle, start=1):
+                if text.strip():
+                    yield line, text
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def bulk_create_sets_pks(model):
+    """Whether ``bulk_create`` fills in auto-generated primary keys for ``model``.
+
+    Backends that cannot return rows from a bulk insert (MySQL) leave them
+    unset, so through-table rows cannot be built from the inserted objects.
+    """
+    return connections[router.db_for_write(model)].features.can_return_rows_from_bulk_insert
+
+
+# ----------------------
+# Validation (runs in worker processes when --workers > 1)
+# ----------------------
+def _text(row, name):
+    value = row.get(name)
+    return str(value).strip() if value not in (None, "") else ""
+
+
+def _optional_int(row, name):
+    value = _text(row, name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError(f"{name} must be an integer.")
+
+
+def _messages(error):
+    if hasattr(error, "message_dict"):
+        return "; ".join(f"{field}: {' '.join(msgs)}" for field, msgs in error.message_dict.items())
+    return " ".join(error.messages)
+
+
+def validate_customer(row):
+    customer = Customer(name=_text(row, "name"), email=_text(row, "email"), phone=_text(row, "phone") or None)
+    customer.full_clean(validate_unique=False)
+    return {"name": customer.name, "email": customer.email, "phone": customer.phone}
+
+
+def validate_product(row):
+    try:
+        price = Decimal(_text(row, "price"))
+    except InvalidOperation:
+        raise ValidationError("price must be a number.")
+    product = Product(
+        id=_optional_int(row, "id"), name=_text(row, "name"), price=price, stock=_optional_int(row, "stock") or 0,
+    )
+    product.full_clean(validate_unique=False)
+    return {"id": product.id, "name": product.name, "price": product.price, "stock": product.stock}
+
+
+def validate_order(row):
+    product_ids = row.get("product_ids") or []
+    if isinstance(product_ids, str):
+        product_ids = [pid for pid in re.split(r"[;\s]+", product_ids) if pid]
+    try:
+        product_ids = [int(pid) for pid in product_ids]
+    except (TypeError, ValueError):
+        raise ValidationError("product_ids must be integers.")
+    if not product_ids:
+        raise ValidationError("At least one product must be selected.")
+
+    customer_id = _optional_int(row, "customer_id")
+    customer_email = _text(row, "customer_email")
+    if customer_id is None and not customer_email:
+        raise ValidationError("customer_id or customer_email is required.")
+
+    order_date = None
+    if _text(row, "order_date"):
+        order_date = parse_datetime(_text(row, "order_date"))
+        if order_date is None:
+            raise ValidationError("order_date must be an ISO 8601 datetime.")
+        if timezone.is_naive(order_date):
+            order_date = timezone.make_aware(order_date)
+
+    total_amount = None
+    if _text(row, "total_amount"):
+        try:
+            total_amount = Decimal(_text(row, "total_amount"))
+        except InvalidOperation:
+            raise ValidationError("total_amount must be a number.")
+
+    return {
+        "id": _optional_int(row, "id"),
+        "customer_id": customer_id,
+        "customer_email": customer_email,
+        "product_ids": list(dict.fromkeys(product_ids)),
+        "order_date": order_date,
+        "total_amount": total_amount,
+    }
+
+
+VALIDATORS = {
+    "customers": validate_customer,
+    "products": validate_product,
+    "orders": validate_order,
+}
+
+
+def validate_chunk(kind, chunk):
+    """Return ``(valid, errors)``: lists of ``(line, values)`` and ``(line, message)``."""
+    validator = VALIDATORS[kind]
+    valid, errors = [], []
+    for line, row in chunk:
+        try:
+            if isinstance(row, str):
+                row = json.loads(row)
+            if not isinstance(row, dict):
+                raise ValidationError("Expected a JSON object.")
+            valid.append((line, validator(row)))
+        except ValueError:
+            errors.append((line, "Invalid JSON."))
+        except ValidationError as e:
+            errors.append((line, _messages(e)))
+    return valid, errors
+
+
+def _init_worker():
+    import django
+
+    django.setup()
+
+
+def validated_chunks(kind, chunks, workers=1):
+    """Validate chunks in order, with at most ``2 * workers`` chunks in flight."""
+    if workers <= 1:
+        for chunk in chunks:
+            yield validate_chunk(kind, chunk)
+        return
+
+    # Forked workers must not share the parent's DB connections
+    connections.close_all()
+    with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(validate_chunk, (kind, chunk)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+# ----------------------
+# Writers: dedupe against the database and bulk insert one chunk
+# ----------------------
+def write_customers(valid, on_conflict):
+    """Return ``(written, skipped, errors)`` for a chunk of validated customers."""
+    errors = []
+    # Later rows win within a chunk, as they would with one-by-one upserts
+    by_email = {}
+    for line, values in valid:
+        by_email.pop(values["email"], None)
+        by_email[values["email"]] = (line, values)
+
+    emails = list(by_email)
+    phones = [values["phone"] for _, values in by_email.values() if values["phone"]]
+    existing = set(Customer.objects.filter(email__in=emails).values_list("email", flat=True))
+    phone_owners = dict(Customer.objects.filter(phone__in=phones).values_list("phone", "email"))
+
+    customers, skipped = [], 0
+    for line, values in by_email.values():
+        if values["email"] in existing and on_conflict == SKIP:
+            skipped += 1
+            continue
+        phone = values["phone"]
+        if phone and phone_owners.setdefault(phone, values["email"]) != values["email"]:
+            errors.append((line, f"phone: {phone} belongs to another customer."))
+            continue
+        customers.append(Customer(phone_normalized=normalize_phone(phone), **values))
+
+    Customer.objects.bulk_create(
+        customers,
+        update_conflicts=on_conflict == UPDATE,
+        unique_fields=["email"] if on_conflict == UPDATE else None,
+        update_fields=["name", "phone", "phone_normalized"] if on_conflict == UPDATE else None,
+    )
+    return len(customers), skipped, errors
+
+
+def write_products(valid, on_conflict):
+    by_id = {values["id"]: values for _, values in valid if values["id"] is not None}
+    existing = set(Product.objects.filter(pk__in=by_id).values_list("pk", flat=True))
+
+    new = [Product(**values) for _, values in valid if values["id"] is None]
+    keyed = [Product(**values) for values in by_id.values() if on_conflict == UPDATE or values["id"] not in existing]
+    Product.objects.bulk_create(new)
+    Product.objects.bulk_create(
+        keyed,
+        update_conflicts=on_conflict == UPDATE,
+        unique_fields=["id"] if on_conflict == UPDATE else None,
+        update_fields=["name", "price", "stock"] if on_conflict == UPDATE else None,
+    )
+    return len(new) + len(keyed), len(by_id) - len(keyed), []
+
+
+def write_orders(valid, on_conflict):
+    errors = []
+    emails = {values["customer_email"] for _, values in valid if values["customer_id"] is None}
+    ids = {values["customer_id"] for _, values in valid if values["customer_id"] is not None}
+    known_ids = set(Customer.objects.filter(pk__in=ids).values_list("pk", flat=True))
+    id_by_email = dict(Customer.objects.filter(email__in=emails).values_list("email", "pk"))
+    order_ids = [values["id"] for _, values in valid if values["id"] is not None]
+    # Archived orders keep their ids, so an id found in either table already exists
+    existing_orders = set(Order.objects.filter(pk__in=order_ids).values_list("pk", flat=True))
+    existing_orders.update(ArchivedOrder.objects.filter(pk__in=order_ids).values_list("pk", flat=True))
+    catalog = get_catalog()
+
+    rows, skipped, seen = [], 0, set()
+    for line, values in valid:
+        if values["id"] is not None and (values["id"] in existing_orders or values["id"] in seen):
+            skipped += 1
+            continue
+        customer_id = values["customer_id"] if values["customer_id"] in known_ids else id_by_email.get(values["customer_email"])
+        if customer_id is None:
+            errors.append((line, "customer: no such customer."))
+            continue
+        products = catalog.get_many(values["product_ids"])
+        if len(products) != len(values["product_ids"]):
+            errors.append((line, "product_ids: one or more product IDs are invalid."))
+            continue
+        seen.add(values["id"])
+        order = Order(
+            id=values["id"],
+            customer_id=customer_id,
+            order_date=values["order_date"] or timezone.now(),
+            total_amount=values["total_amount"] if values["total_amount"] is not None else sum(p.price for p in products),
+        )
+        rows.append((order, products))
+
+    orders = [order for order, _ in rows]
+    if bulk_create_sets_pks(Order):
+        Order.objects.bulk_create(orders)
+    else:
+        # Rows without an id would come back without one; save() sets it (and sends post_save)
+        Order.objects.bulk_create([order for order in orders if order.pk is not None])
+        for order in orders:
+            if order._state.adding:
+                order.save(force_insert=True)
+    OrderProducts = Order.products.through
+    OrderProducts.objects.bulk_create([
+        OrderProducts(order_id=order.pk, product_id=product.id) for order, products in rows for product in products
+    ])
+    return len(rows), skipped, errors
+
+
+WRITERS = {
+    "customers": (write_customers, Customer),
+    "products": (write_products, Product),
+    "orders": (write_orders, Order),
+}
+
+
+def import_rows(kind, rows, chunk_size=5000, workers=1, on_conflict=SKIP):
+    """Validate and write ``rows``; yields ``(read, written, skipped, errors)`` per chunk."""
+    writer, model = WRITERS[kind]
+    try:
+        for valid, errors in validated_chunks(kind, chunked(rows, chunk_size), workers):
+            with transaction.atomic():
+                written, skipped, write_errors = writer(valid, on_conflict)
+                # bulk_create skips the signals that invalidate these; each
+                # chunk is visible as soon as it commits, so bump per chunk
+                if written and kind == "products":
+                    bump_catalog_version()
+                elif written and kind == "orders":
+                    bump_orders_version()
+            yield len(valid) + len(errors), written, skipped, sorted(errors + write_errors)
+    finally:
+        # ... and the row counters
+        refresh_row_counts([model])
@@ -0,0 +1,186 @@
+"""Buffered JSON logging shared by the cron jobs, Celery tasks and scripts.
+
+``get_job_logger(path)`` returns a logger whose records go onto an
+in-memory queue. Logging calls never touch the disk. A background listener
+formats each record as one JSON line and writes them in batches: every
+``JOB_LOG_BATCH_SIZE`` records, or after ``JOB_LOG_FLUSH_INTERVAL`` seconds
+of quiet. Each batch is a single append, so runs sharing a file do not
+interleave within a line. Files rotate at ``JOB_LOG_MAX_BYTES``.
+
+``job_run(logger, job)`` tags every record with the job name and a run id,
+and logs how long the run took and whether it failed. The run is also a
+trace span (see ``crm.tracing``); sampled runs log their ``trace_id``.
+"""
+import atexit
+import copy
+import datetime
+import json
+import logging
+import queue
+import time
+import uuid
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+
+from django.conf import settings
+
+from . import tracing
+
+JOB_LOG_MAX_BYTES = getattr(settings, "JOB_LOG_MAX_BYTES", 10 * 1024 * 1024)
+JOB_LOG_BACKUP_COUNT = getattr(settings, "JOB_LOG_BACKUP_COUNT", 5)
+JOB_LOG_BATCH_SIZE = getattr(settings, "JOB_LOG_BATCH_SIZE", 200)
+JOB_LOG_FLUSH_INTERVAL = getattr(settings, "JOB_LOG_FLUSH_INTERVAL", 1.0)
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        return json.dumps(entry, default=str)
+
+
+class BatchingRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that buffers formatted lines and writes them in one go."""
+
+    def __init__(self, filename, batch_size=JOB_LOG_BATCH_SIZE, **kwargs):
+        super().__init__(filename, delay=True, **kwargs)
+        self.batch_size = batch_size
+        self.buffer = []
+        self.buffered_bytes = 0
+
+    def emit(self, record):
+        try:
+            line = self.format(record) + self.terminator
+        except Exception:
+            self.handleError(record)
+            return
+        self.buffer.append(line)
+        self.buffered_bytes += len(line)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if not self.buffer:
+                return
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes and self.stream.tell() + self.buffered_bytes >= self.maxBytes:
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+            self.stream.write("".join(self.buffer))
+            self.stream.flush()
+            self.buffer = []
+            self.buffered_bytes = 0
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class StructuredQueueHandler(QueueHandler):
+    """QueueHandler that keeps ``extra`` fields and tracebacks apart from the message."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exception = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+            record.exc_text = None
+        return record
+
+
+class FlushingQueueListener(QueueListener):
+    """QueueListener that flushes its handlers at least every JOB_LOG_FLUSH_INTERVAL."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush()
+        self.last_flush = time.monotonic()
+
+    def dequeue(self, block):
+        while True:
+            if time.monotonic() - self.last_flush >= JOB_LOG_FLUSH_INTERVAL:
+                self.flush()
+            try:
+                return self.queue.get(block, timeout=JOB_LOG_FLUSH_INTERVAL)
+            except queue.Empty:
+                self.flush()
+
+
+class JobRun(logging.LoggerAdapter):
+    """Adapter adding the run's fields to every record, alongside per-call ``extra``."""
+
+    def process(self, msg, kwargs):
+        kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return msg, kwargs
+
+
+_listeners = {}
+
+
+def get_job_logger(path, name=None):
+    """Return a non-blocking JSON logger writing to ``path`` (one listener per file)."""
+    path = str(path)
+    logger = logging.getLogger(name or f"crm.jobs.{Path(path).stem}")
+    if path not in _listeners:
+        handler = BatchingRotatingFileHandler(
+            path, maxBytes=JOB_LOG_MAX_BYTES, backupCount=JOB_LOG_BACKUP_COUNT, encoding="utf-8",
+        )
+        handler.setFormatter(JSONFormatter())
+        records = queue.SimpleQueue()
+        listener = FlushingQueueListener(records, handler)
+        listener.start()
+        _listeners[path] = (listener, StructuredQueueHandler(records))
+    queue_handler = _listeners[path][1]
+    if queue_handler not in logger.handlers:
+        logger.addHandler(queue_handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+@atexit.register
+def flush_job_logs():
+    """Write out everything still queued; runs at interpreter exit."""
+    for listener, _ in _listeners.values():
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+    _listeners.clear()
+
+
+@contextmanager
+def job_run(logger, job, **fields):
+    """Log the start and end of one job run; yields a logger adapter tagged with its run id."""
+    with tracing.span(f"job {job}", attributes={"crm.job": job}) as span:
+        if span is not None and span.sampled:
+            fields.setdefault("trace_id", span.context.trace_id)
+        run = JobRun(logger, {"job": job, "run_id": uuid.uuid4().hex[:12], **fields})
+        started = time.monotonic()
+        run.info("started")
+        try:
+            yield run
+        except Exception:
+            run.exception("failed", extra={"duration_ms": round((time.monotonic() - started) * 1000, 1)})
+            raise
+        run.info("finished", extra={"duration_ms": round((time.monotonic() - started) * 1000, 1)})
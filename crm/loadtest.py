@@ -0,0 +1,264 @@
+"""Open-loop load generator for the /graphql endpoint.
+
+Requests are sent on a fixed schedule (``rate`` per second), whether or not
+earlier requests have finished. Each latency is measured from the request's
+*scheduled* start, so time spent queued behind a slow server counts against
+the server instead of silently lowering the offered load (coordinated
+omission). Run it through ``manage.py loadtest``.
+
+Every operation in the mix exists in the served schema (``graphql_crm.schema``).
+Admission control rate-limits per client, so one generator would look like
+a single abusive client. With ``clients`` set, requests carry an
+``X-Client-Id`` header spread over that many synthetic clients. Point the
+server's ``ADMISSION_CLIENT_KEY`` at ``HTTP_X_CLIENT_ID`` for the run. 429
+(rate-limited) and 503 (shed) answers are counted separately.
+"""
+import datetime
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from graphql_relay import from_global_id
+
+RATE_LIMITED_STATUS = 429
+SHED_STATUS = 503
+CLIENT_HEADER = "X-Client-Id"
+
+
+# ----------------------
+# Operation mix
+# ----------------------
+def all_orders(rng, ctx):
+    filters = rng.choice([
+        {"gte": str(rng.choice([10, 50, 100]))},
+        {"since": (datetime.date.today() - datetime.timedelta(days=rng.choice([7, 30, 365]))).isoformat()},
+        {"customerName": rng.choice("aeiou")},
+        {},
+    ])
+    return """
+        query LoadAllOrders($first: Int, $gte: Decimal, $since: Date, $customerName: String) {
+            allOrders(first: $first, totalAmount_Gte: $gte, orderDate_Gte: $since, customerName: $customerName) {
+                edges { node { id totalAmount orderDate customer { name } } }
+            }
+        }
+    """, {"first": rng.choice([10, 20, 50]), **filters}
+
+
+def all_products(rng, ctx):
+    return """
+        query LoadAllProducts($first: Int, $lowStock: Boolean) {
+            allProducts(first: $first, lowStock: $lowStock) {
+                totalCount
+                edges { node { id name price stock } }
+            }
+        }
+    """, {"first": rng.choice([10, 50]), "lowStock": rng.choice([True, None])}
+
+
+def top_products(rng, ctx):
+    return """
+        query LoadTopProducts($by: TopProductsBy, $first: Int) {
+            topProducts(by: $by, first: $first) { product { name } units revenue }
+        }
+    """, {"by": rng.choice(["REVENUE", "UNITS"]), "first": rng.choice([5, 10, 20])}
+
+
+def bulk_create_orders(rng, ctx):
+    return """
+        mutation LoadBulkCreateOrders($orders: [OrderInput]!) {
+            bulkCreateOrders(orders: $orders) { createdOrders { id totalAmount } errors }
+        }
+    """, {"orders": [
+        {
+            "customerId": rng.choice(ctx["customer_ids"]),
+            "productIds": rng.sample(ctx["product_ids"], min(len(ctx["product_ids"]), rng.randint(1, 3))),
+        }
+        for _ in range(rng.randint(1, 5))
+    ]}
+
+
+def heartbeat(rng, ctx):
+    return "query LoadHeartbeat { hello }", {}
+
+
+def update_low_stock(rng, ctx):
+    return "mutation LoadUpdateLowStock { updateLowStockProducts { success message } }", {}
+
+
+OPERATIONS = {
+    "all_orders": all_orders,
+    "all_products": all_products,
+    "top_products": top_products,
+    "bulk_create_orders": bulk_create_orders,
+    "heartbeat": heartbeat,
+    "update_low_stock": update_low_stock,
+}
+DEFAULT_MIX = {
+    "all_orders": 40, "heartbeat": 20, "all_products": 15, "bulk_create_orders": 13, "top_products": 10,
+    "update_low_stock": 2,
+}
+
+
+def parse_mix(text):
+    """Parse ``name=weight,name=weight`` into a mix dict."""
+    mix = {}
+    for part in filter(None, (part.strip() for part in text.split(","))):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}; choose from {', '.join(OPERATIONS)}.")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# ----------------------
+# Runner
+# ----------------------
+class LoadTest:
+    def __init__(self, url, mix=None, workers=64, timeout=30, seed=None, clients=None):
+        import requests
+
+        self.url = url
+        self.mix = dict(mix or DEFAULT_MIX)
+        self.workers = workers
+        self.clients = clients
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.requests = requests
+        self._local = threading.local()
+        self.context = {}
+
+    def session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = self.requests.Session()
+        return self._local.session
+
+    def _local_rng(self):
+        if not hasattr(self._local, "rng"):
+            self._local.rng = random.Random(self.rng.random())
+        return self._local.rng
+
+    def headers(self):
+        if not self.clients:
+            return None
+        return {CLIENT_HEADER: f"loadtest-{self._local_rng().randrange(self.clients)}"}
+
+    def post(self, query, variables):
+        response = self.session().post(
+            self.url, json={"query": query, "variables": variables}, headers=self.headers(), timeout=self.timeout,
+        )
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return response.status_code, body
+
+    def prepare(self):
+        """Fetch customer and product ids for the write operations; drop those that cannot run."""
+        _, body = self.post(
+            "{ allCustomers(first: 100) { edges { node { id } } } allProducts(first: 100) { edges { node { id } } } }",
+            {},
+        )
+        data = body.get("data") or {}
+        self.context = {
+            key: [from_global_id(edge["node"]["id"])[1] for edge in (data.get(field) or {}).get("edges", [])]
+            for key, field in (("customer_ids", "allCustomers"), ("product_ids", "allProducts"))
+        }
+        skipped = []
+        if not (self.context["customer_ids"] and self.context["product_ids"]):
+            skipped.append("bulk_create_orders")
+        for name in skipped:
+            self.mix.pop(name, None)
+        return skipped
+
+    def run_one(self, name, scheduled):
+        query, variables = OPERATIONS[name](self._local_rng(), self.context)
+        try:
+            status, body = self.post(query, variables)
+            if status == RATE_LIMITED_STATUS:
+                outcome = "rate_limited"
+            elif status == SHED_STATUS:
+                outcome = "shed"
+            else:
+                outcome = "error" if status != 200 or body.get("errors") else "ok"
+        except self.requests.RequestException:
+            outcome = "error"
+        return name, outcome, time.monotonic() - scheduled
+
+    def run(self, rate, duration):
+        """Offer ``rate`` requests/second for ``duration`` seconds; return a Step."""
+        names, weights = zip(*self.mix.items())
+        total = int(rate * duration)
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            start = time.monotonic()
+            for i in range(total):
+                scheduled = start + i / rate
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(pool.submit(self.run_one, self.rng.choices(names, weights)[0], scheduled))
+            results = [future.result() for future in futures]
+            elapsed = time.monotonic() - start
+        return Step(rate, elapsed, results)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+class Step:
+    """Results of one offered rate."""
+
+    def __init__(self, rate, elapsed, results):
+        self.rate = rate
+        self.elapsed = elapsed
+        self.results = results
+
+    def summarize(self, results):
+        latencies = sorted(latency for _, outcome, latency in results if outcome == "ok")
+        outcomes = defaultdict(int)
+        for _, outcome, _ in results:
+            outcomes[outcome] += 1
+        return {
+            "requests": len(results),
+            "ok": outcomes["ok"],
+            "errors": outcomes["error"],
+            "rate_limited": outcomes["rate_limited"],
+            "shed": outcomes["shed"],
+            "throughput": round(outcomes["ok"] / self.elapsed, 1) if self.elapsed else 0,
+            **{
+                f"p{int(q * 100)}_ms": None if percentile(latencies, q) is None else round(percentile(latencies, q) * 1000, 1)
+                for q in (0.5, 0.95, 0.99)
+            },
+        }
+
+    def overall(self):
+        return {"rate": self.rate, **self.summarize(self.results)}
+
+    def by_operation(self):
+        grouped = defaultdict(list)
+        for result in self.results:
+            grouped[result[0]].append(result)
+        return {name: self.summarize(results) for name, results in sorted(grouped.items())}
+
+    def saturated(self, slo_ms, max_error_rate=0.01):
+        """Past the knee: p99 over the SLO, too many failures, or completions falling behind the offered rate."""
+        summary = self.overall()
+        failed = (summary["errors"] + summary["rate_limited"] + summary["shed"]) / max(summary["requests"], 1)
+        return (
+            summary["p99_ms"] is None
+            or summary["p99_ms"] > slo_ms
+            or failed > max_error_rate
+            or summary["requests"] / self.elapsed < 0.9 * self.rate
+        )
+
+
+def to_json(steps, slo_ms):
+    return json.dumps([
+        {**step.overall(), "saturated": step.saturated(slo_ms), "operations": step.by_operation()} for step in steps
+    ], indent=2)
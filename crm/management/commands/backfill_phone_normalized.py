@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from crm.models import Customer, normalize_phone
+from crm.routers import read_from_primary
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Customer.phone_normalized in primary-key batches. Migration 0003 "
+        "backfills it on deploy; run this after changing PHONE_DEFAULT_COUNTRY_CODE."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--all", action="store_true",
+            help="Recompute every row, not only rows whose normalized phone is missing.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        queryset = Customer.objects.exclude(phone__isnull=True).exclude(phone="")
+        if not options["all"]:
+            queryset = queryset.filter(phone_normalized__isnull=True)
+
+        last_pk = 0
+        updated = 0
+        with read_from_primary():
+            while True:
+                batch = list(
+                    queryset.filter(pk__gt=last_pk).order_by("pk").only("pk", "phone")[:batch_size]
+                )
+                if not batch:
+                    break
+                for customer in batch:
+                    customer.phone_normalized = normalize_phone(customer.phone)
+                with transaction.atomic():
+                    Customer.objects.bulk_update(batch, ["phone_normalized"])
+                last_pk = batch[-1].pk
+                updated += len(batch)
+                self.stdout.write(f"Backfilled {updated} customers (last id {last_pk})")
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {updated} customers backfilled."))
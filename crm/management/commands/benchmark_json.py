@@ -0,0 +1,66 @@
+import datetime
+import json
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from graphql_relay import to_global_id
+
+from crm.encoding import encode_orjson, encode_stdlib, orjson
+
+
+def orders_response(edges):
+    """An allOrders result with ``edges`` orders, shaped like the serialized GraphQL response."""
+    start = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    return {"data": {"allOrders": {
+        "edges": [
+            {"node": {
+                "id": to_global_id("OrderNode", i),
+                "orderDate": (start + datetime.timedelta(minutes=i)).isoformat(),
+                "totalAmount": str(Decimal(i % 500) + Decimal("0.99")),
+                "customer": {"id": to_global_id("CustomerNode", i % 97), "name": f"Customer {i % 97}",
+                             "email": f"customer{i % 97}@example.com"},
+                "products": {"edges": [
+                    {"node": {"id": to_global_id("ProductNode", p), "name": f"Product {p}",
+                              "price": str(Decimal(p) + Decimal("0.50"))}}
+                    for p in range(i % 3 + 1)
+                ]},
+            }, "cursor": to_global_id("arrayconnection", i)}
+            for i in range(edges)
+        ],
+        "pageInfo": {"hasNextPage": False, "endCursor": to_global_id("arrayconnection", edges - 1)},
+    }}}
+
+
+def encode_stock(data):
+    # What GraphQLView.json_encode plus HttpResponse do with the result
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+class Command(BaseCommand):
+    help = "Compare GraphQL response encoders on large allOrders-shaped results."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--edges", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=200)
+
+    def handle(self, *args, **options):
+        data = orders_response(options["edges"])
+        encoders = [("stock json.dumps", encode_stock), ("crm stdlib", encode_stdlib)]
+        if orjson is not None:
+            encoders.append(("crm orjson", encode_orjson))
+        else:
+            self.stderr.write("orjson is not installed; skipping it.")
+
+        baseline = None
+        self.stdout.write(f"{options['edges']} edges, {options['repeat']} runs each")
+        for name, encode in encoders:
+            size = len(encode(data))
+            started = time.perf_counter()
+            for _ in range(options["repeat"]):
+                encode(data)
+            per_call = (time.perf_counter() - started) / options["repeat"]
+            baseline = baseline or per_call
+            self.stdout.write(
+                f"{name:<18}{per_call * 1000:>8.2f} ms{size / 1024:>9.0f} KiB{baseline / per_call:>7.1f}x"
+            )
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from graphene_django.settings import graphene_settings
+from graphql import print_schema
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the GraphQL schema as SDL to GRAPHQL_SCHEMA_ARTIFACT, so cron and "
+        "task clients can skip introspecting the server at startup."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--schema", help="Dotted path to the schema (defaults to GRAPHENE['SCHEMA']).")
+        parser.add_argument("--output", help="File to write (defaults to GRAPHQL_SCHEMA_ARTIFACT).")
+
+    def handle(self, *args, **options):
+        output = options["output"] or getattr(settings, "GRAPHQL_SCHEMA_ARTIFACT", None)
+        if not output:
+            raise CommandError("Set GRAPHQL_SCHEMA_ARTIFACT or pass --output.")
+
+        schema = import_string(options["schema"]) if options["schema"] else graphene_settings.SCHEMA
+        if schema is None:
+            raise CommandError("No schema configured; pass --schema.")
+
+        sdl = print_schema(schema.graphql_schema)
+        Path(output).write_text(sdl + "\n")
+        self.stdout.write(self.style.SUCCESS(f"Wrote schema artifact to {output}"))
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.importing import SKIP, UPDATE, WRITERS, import_rows, read_rows
+
+
+class Command(BaseCommand):
+    help = "Stream customers, products or orders from a CSV or NDJSON file into the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(WRITERS))
+        parser.add_argument("path", help="Input file, or - for stdin.")
+        parser.add_argument("--format", choices=("csv", "ndjson"), help="Default: from the file extension.")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument("--workers", type=int, default=1, help="Processes used to validate rows.")
+        parser.add_argument(
+            "--on-conflict", choices=(SKIP, UPDATE), default=SKIP,
+            help="What to do with rows matching an existing customer email or product id.",
+        )
+        parser.add_argument("--max-errors", type=int, default=20, help="Rejected rows to print individually.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("csv" if path.lower().endswith(".csv") else "ndjson" if path != "-" else None)
+        if fmt is None:
+            raise CommandError("Pass --format when reading from stdin.")
+        rows = read_rows(path, fmt)
+        started = time.monotonic()
+        read = written = skipped = rejected = 0
+        try:
+            for chunk_read, chunk_written, chunk_skipped, errors in import_rows(
+                options["kind"], rows, options["chunk_size"], options["workers"], options["on_conflict"],
+            ):
+                read += chunk_read
+                written += chunk_written
+                skipped += chunk_skipped
+                for line, message in errors:
+                    if rejected < options["max_errors"]:
+                        self.stderr.write(f"Line {line}: {message}")
+                    rejected += 1
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"{read} read, {written} written, {skipped} skipped, {rejected} rejected "
+                    f"({read / elapsed if elapsed else 0:,.0f} rows/s)"
+                )
+        except OSError as e:
+            raise CommandError(str(e))
+
+        if rejected > options["max_errors"]:
+            self.stderr.write(f"... {rejected - options['max_errors']} more rejected rows not shown")
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {written} {options['kind']} written in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_MODULES = ["crm.tasks", "crm.cron", "crm.schema"]
+
+
+class Command(BaseCommand):
+    help = "Report the per-module import cost of django.setup() plus the given modules."
+
+    def add_arguments(self, parser):
+        parser.add_argument("modules", nargs="*", help=f"Modules to import (default: {' '.join(DEFAULT_MODULES)}).")
+        parser.add_argument("--top", type=int, default=25, help="Number of modules to list.")
+
+    def handle(self, *args, **options):
+        modules = options["modules"] or DEFAULT_MODULES
+        code = "import django; django.setup(); " + "; ".join(f"import {name}" for name in modules)
+
+        # -X importtime writes one line per imported module to stderr, in microseconds
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True,
+            text=True,
+            env={**os.environ, "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE},
+        )
+        if process.returncode != 0:
+            raise CommandError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "Import failed.")
+
+        rows = []
+        total_us = 0
+        for line in process.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            name = name.rstrip()
+            # Nested imports are indented; top-level cumulative times add up to the total
+            if not name.startswith("  "):
+                total_us += int(cumulative_us)
+            rows.append((int(cumulative_us), int(self_us), name.strip()))
+
+        self.stdout.write(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for cumulative_us, self_us, name in sorted(rows, reverse=True)[:options["top"]]:
+            self.stdout.write(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+        self.stdout.write(f"Total import time: {total_us / 1000:.1f} ms across {len(rows)} modules")
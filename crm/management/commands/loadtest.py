@@ -0,0 +1,101 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.loadtest import DEFAULT_MIX, OPERATIONS, LoadTest, parse_mix, to_json
+
+
+class Command(BaseCommand):
+    help = "Drive a running server with an open-loop GraphQL operation mix and report latency percentiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://localhost:8000/graphql")
+        parser.add_argument("--rate", type=float, default=20, help="Requests per second to offer.")
+        parser.add_argument(
+            "--rates", help="Comma-separated rates to step through for a saturation curve, e.g. 10,20,40,80.",
+        )
+        parser.add_argument("--duration", type=float, default=30, help="Seconds per rate.")
+        parser.add_argument(
+            "--mix", default=",".join(f"{name}={weight}" for name, weight in DEFAULT_MIX.items()),
+            help=f"Weighted operations, name=weight; choose from {', '.join(OPERATIONS)}.",
+        )
+        parser.add_argument("--workers", type=int, default=64, help="Maximum requests in flight.")
+        parser.add_argument(
+            "--clients", type=int,
+            help="Spread requests over this many X-Client-Id values; set the server's "
+                 "ADMISSION_CLIENT_KEY to HTTP_X_CLIENT_ID so each gets its own rate limit.",
+        )
+        parser.add_argument("--slo-ms", type=float, default=500, help="p99 above this marks a rate as saturated.")
+        parser.add_argument("--seed", type=int)
+        parser.add_argument("--json", dest="json_path", help="Also write the results to this file.")
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options["mix"])
+            rates = [float(rate) for rate in options["rates"].split(",")] if options["rates"] else [options["rate"]]
+        except ValueError as e:
+            raise CommandError(str(e))
+        if any(rate <= 0 for rate in rates):
+            raise CommandError("Rates must be positive.")
+        if options["clients"] is not None and options["clients"] < 1:
+            raise CommandError("--clients must be at least 1.")
+
+        test = LoadTest(
+            options["url"], mix, workers=options["workers"], seed=options["seed"], clients=options["clients"],
+        )
+        try:
+            skipped = test.prepare()
+        except test.requests.RequestException as e:
+            raise CommandError(f"Could not reach {options['url']}: {e}")
+        for name in skipped:
+            self.stderr.write(f"Skipping {name}: no customers or products to order.")
+        if not options["clients"]:
+            self.stderr.write(
+                "Every request comes from one client; expect 429s past ADMISSION_CLIENT_RATE (see --clients)."
+            )
+        if not test.mix:
+            raise CommandError("Nothing left in the operation mix.")
+
+        steps = []
+        for rate in rates:
+            self.stdout.write(f"Offering {rate:g} req/s for {options['duration']:g}s...")
+            step = test.run(rate, options["duration"])
+            steps.append(step)
+            self.write_step(step, options["slo_ms"])
+
+        if len(steps) > 1:
+            self.write_curve(steps, options["slo_ms"])
+        if options["json_path"]:
+            with open(options["json_path"], "w") as f:
+                f.write(to_json(steps, options["slo_ms"]))
+
+    def write_step(self, step, slo_ms):
+        header = (
+            f"{'operation':<24}{'requests':>9}{'ok':>7}{'errors':>8}{'429':>6}{'503':>6}"
+            f"{'ok/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}"
+        )
+        self.stdout.write(header)
+        rows = list(step.by_operation().items()) + [("all", step.overall())]
+        for name, summary in rows:
+            self.stdout.write(
+                f"{name:<24}{summary['requests']:>9}{summary['ok']:>7}{summary['errors']:>8}"
+                f"{summary['rate_limited']:>6}{summary['shed']:>6}"
+                f"{summary['throughput']:>8}" + "".join(_ms(summary[key]) for key in ("p50_ms", "p95_ms", "p99_ms"))
+            )
+        if step.saturated(slo_ms):
+            self.stdout.write(self.style.WARNING(f"Saturated at {step.rate:g} req/s."))
+        self.stdout.write("")
+
+    def write_curve(self, steps, slo_ms):
+        self.stdout.write("Saturation curve")
+        self.stdout.write(f"{'offered':>9}{'ok/s':>9}{'failed %':>10}{'p50':>9}{'p99':>9}")
+        for step in steps:
+            summary = step.overall()
+            failed = 100 * (summary["errors"] + summary["rate_limited"] + summary["shed"]) / max(summary["requests"], 1)
+            line = (
+                f"{step.rate:>9g}{summary['throughput']:>9}{failed:>10.1f}"
+                f"{_ms(summary['p50_ms'])}{_ms(summary['p99_ms'])}"
+            )
+            self.stdout.write(self.style.WARNING(line + "  saturated") if step.saturated(slo_ms) else line)
+
+
+def _ms(value):
+    return f"{'-' if value is None else f'{value:g}ms':>9}"
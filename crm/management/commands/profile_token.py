@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from crm.profiling import MODES, PROFILE_TOKEN_MAX_AGE, PROFILING_ENABLED, SAMPLE, make_profile_token
+
+
+class Command(BaseCommand):
+    help = "Print an X-CRM-Profile header value that profiles GraphQL requests for a few minutes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=MODES, default=SAMPLE)
+
+    def handle(self, *args, **options):
+        if not PROFILING_ENABLED:
+            self.stderr.write("CRM_PROFILING_ENABLED is off; the header will be ignored.")
+        self.stdout.write(f"X-CRM-Profile: {make_profile_token(options['mode'])}")
+        self.stdout.write(f"Valid for {PROFILE_TOKEN_MAX_AGE} seconds.")
@@ -0,0 +1,245 @@
+import json
+import math
+from functools import partial
+
+from django.conf import settings
+from django.http import JsonResponse
+from graphql import OperationType, get_named_type, is_leaf_type
+
+from . import admission, httpcache, tracing
+from .routers import begin_request, end_request, pin_primary, resume_request
+
+# Seconds a client keeps reading from the primary after it wrote something
+REPLICA_PIN_SECONDS = getattr(settings, "REPLICA_PIN_SECONDS", 5)
+REPLICA_PIN_COOKIE = "crm_read_primary"
+
+# Paths guarded by AdmissionControlMiddleware, and the request.META key naming
+# the client for rate limiting (e.g. "HTTP_X_CLIENT_ID" behind a trusted proxy)
+ADMISSION_PATHS = tuple(getattr(settings, "ADMISSION_PATHS", ("/graphql",)))
+ADMISSION_CLIENT_KEY = getattr(settings, "ADMISSION_CLIENT_KEY", "REMOTE_ADDR")
+
+
+class ReleasingContent:
+    """Streaming response content that calls ``release`` once, when exhausted or closed."""
+
+    def __init__(self, content, release):
+        self.content = content
+        self._release = release
+
+    def __iter__(self):
+        try:
+            yield from self.content
+        finally:
+            self.close()
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+
+class AsyncReleasingContent(ReleasingContent):
+    async def __aiter__(self):
+        try:
+            async for chunk in self.content:
+                yield chunk
+        finally:
+            self.close()
+
+
+class RoutedContent:
+    """Streaming response content produced under the routing state of its request.
+
+    Streaming responses are iterated after the middleware has returned, so the
+    state is made current again around every chunk: the queries run then still
+    see the request's pin and its one replica.
+    """
+
+    def __init__(self, content, state):
+        self.content = content
+        self.state = state
+
+    def __iter__(self):
+        chunks = iter(self.content)
+        while True:
+            token = resume_request(self.state)
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                end_request(token)
+            yield chunk
+
+
+class AsyncRoutedContent(RoutedContent):
+    async def __aiter__(self):
+        chunks = aiter(self.content)
+        while True:
+            token = resume_request(self.state)
+            try:
+                chunk = await anext(chunks)
+            except StopAsyncIteration:
+                return
+            finally:
+                end_request(token)
+            yield chunk
+
+
+# ----------------------
+# Django middleware
+# ----------------------
+class ReadYourWritesMiddleware:
+    """Pin a client to the primary database for a short window after it writes.
+
+    The window is carried in a short-lived signed cookie, so it holds across
+    processes and nodes without any shared server-side state.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = request.get_signed_cookie(REPLICA_PIN_COOKIE, default=None, max_age=REPLICA_PIN_SECONDS) is not None
+        state, token = begin_request(pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+
+        if response.streaming:
+            content = AsyncRoutedContent if response.is_async else RoutedContent
+            response.streaming_content = content(response.streaming_content, state)
+        if state.wrote:
+            response.set_signed_cookie(
+                REPLICA_PIN_COOKIE, "1", max_age=REPLICA_PIN_SECONDS, httponly=True, samesite="Lax",
+            )
+        return response
+
+
+class AdmissionControlMiddleware:
+    """Rate-limit clients and cap concurrent GraphQL requests (see crm.admission).
+
+    Over-rate clients get 429 and saturated processes answer 503, both with
+    Retry-After, instead of letting queues grow until latency collapses.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.path not in ADMISSION_PATHS:
+            return self.get_response(request)
+
+        wait = admission.client_buckets.take(request.META.get(ADMISSION_CLIENT_KEY, ""))
+        if wait:
+            return self.reject(429, "Rate limit exceeded.", wait)
+
+        lane = self.get_lane(request)
+        try:
+            admission.controller.acquire(lane)
+        except admission.Rejected as e:
+            return self.reject(503, f"Server busy: {e.reason}.", e.retry_after)
+
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            admission.controller.release(lane)
+            raise
+        if response.streaming:
+            # Keep the slot until the last chunk is sent or the server closes the response
+            content = AsyncReleasingContent if response.is_async else ReleasingContent
+            response.streaming_content = content(response.streaming_content, partial(admission.controller.release, lane))
+        else:
+            admission.controller.release(lane)
+        return response
+
+    def get_lane(self, request):
+        operations = [(request.GET.get("query"), request.GET.get("extensions"))]
+        if request.method == "POST" and request.content_type == "application/json":
+            try:
+                body = json.loads(request.body or b"null")
+            except ValueError:
+                body = None
+            operations += [
+                (operation.get("query"), operation.get("extensions"))
+                for operation in (body if isinstance(body, list) else [body])
+                if isinstance(operation, dict)
+            ]
+        elif request.method == "POST":
+            operations.append((request.POST.get("query"), request.POST.get("extensions")))
+        queries = [self.get_query(query, extensions) for query, extensions in operations]
+        lanes = [admission.classify(query) for query in queries if isinstance(query, str)]
+        return min(lanes, key=admission.LANES.index, default=admission.QUERY)
+
+    def get_query(self, query, extensions):
+        """The query text, looked up by hash for persisted queries sent without it."""
+        if query or not extensions:
+            return query
+        try:
+            return httpcache.resolve_persisted_query(None, extensions)
+        except (httpcache.PersistedQueryNotFound, ValueError):
+            # The view answers these; the request itself is cheap
+            return None
+
+    def reject(self, status, message, retry_after):
+        response = JsonResponse({"errors": [{"message": message}]}, status=status)
+        response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+        return response
+
+
+class TracingMiddleware:
+    """Open a SERVER span per request, continuing the caller's traceparent (see crm.tracing)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not tracing.TRACING_ENABLED:
+            return self.get_response(request)
+        attributes = {"http.method": request.method, "http.target": request.path}
+        parent = tracing.extract(request.META.get("HTTP_TRACEPARENT"))
+        with tracing.span(f"{request.method} {request.path}", tracing.SERVER, attributes, parent=parent) as span:
+            response = self.get_response(request)
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                span.status = tracing.STATUS_ERROR
+        # Lets a client find the trace its request ended up in
+        response["traceresponse"] = tracing.format_traceparent(span.context)
+        return response
+
+
+# ----------------------
+# Graphene middleware
+# ----------------------
+class ReplicaRoutingMiddleware:
+    """Send mutations (and anything after them in the request) to the primary.
+
+    Queries are left to ``PrimaryReplicaRouter``, which reads from a replica
+    unless the request is pinned.
+    """
+
+    def resolve(self, next, root, info, **args):
+        if info.path.prev is None and info.operation.operation == OperationType.MUTATION:
+            pin_primary()
+        return next(root, info, **args)
+
+
+class ResolverTracingMiddleware:
+    """One span per resolver in sampled traces; scalar fields only with TRACE_SCALAR_RESOLVERS.
+
+    Introspection fields are never traced.
+    """
+
+    def resolve(self, next, root, info, **args):
+        parent = tracing.current_span()
+        # Introspection would bury the operation's own resolvers
+        if parent is None or not parent.sampled or info.parent_type.name.startswith("__") \
+                or info.field_name.startswith("__"):
+            return next(root, info, **args)
+        if info.path.prev is not None and not tracing.TRACE_SCALAR_RESOLVERS \
+                and is_leaf_type(get_named_type(info.return_type)):
+            return next(root, info, **args)
+        attributes = {"graphql.field.path": ".".join(str(key) for key in info.path.as_list())}
+        with tracing.span(f"resolve {info.parent_type.name}.{info.field_name}", attributes=attributes):
+            return next(root, info, **args)
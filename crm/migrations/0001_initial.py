@@ -0,0 +1,96 @@
+# Generated by Django 5.2.5 on 2026-10-19 09:50
+
+import django.core.validators
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Customer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('email', models.EmailField(max_length=254, unique=True)),
+                ('phone', models.CharField(blank=True, max_length=20, null=True, unique=True, validators=[django.core.validators.RegexValidator(message='Phone number must be in the format +1234567890 or 123-456-7890', regex='^(\\+\\d{1,15}|\\d{3}-\\d{3}-\\d{4})$')])),
+                ('phone_normalized', models.CharField(blank=True, db_index=True, editable=False, max_length=16, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))])),
+                ('stock', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RowCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=100, unique=True)),
+                ('rows', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CustomerSegment',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rfm', serialize=False, to='crm.customer')),
+                ('recency_days', models.PositiveIntegerField(null=True)),
+                ('frequency', models.PositiveIntegerField(default=0)),
+                ('monetary', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('recency_score', models.PositiveSmallIntegerField(default=0)),
+                ('frequency_score', models.PositiveSmallIntegerField(default=0)),
+                ('monetary_score', models.PositiveSmallIntegerField(default=0)),
+                ('segment', models.CharField(choices=[('champion', 'Champion'), ('loyal', 'Loyal'), ('promising', 'Promising'), ('at_risk', 'At risk'), ('needs_attention', 'Needs attention'), ('hibernating', 'Hibernating'), ('prospect', 'Prospect')], db_index=True, max_length=20)),
+                ('computed_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('event_type', models.CharField(max_length=50)),
+                ('aggregate_type', models.CharField(max_length=30)),
+                ('aggregate_id', models.BigIntegerField()),
+                ('payload', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['aggregate_type', 'aggregate_id', 'id'], name='crm_outboxe_aggrega_e2d2fe_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_date', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='crm.customer')),
+                ('products', models.ManyToManyField(related_name='product_orders', to='crm.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('order_date', models.DateTimeField(db_index=True)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_orders', to='crm.customer')),
+                ('products', models.ManyToManyField(related_name='archived_product_orders', to='crm.product')),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-19 09:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rowcounter',
+            name='shard',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='rowcounter',
+            name='table',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='rowcounter',
+            constraint=models.UniqueConstraint(fields=('table', 'shard'), name='crm_rowcounter_table_shard'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-19 09:58
+
+from django.db import migrations, models
+
+from crm.models import normalize_phone
+
+BATCH_SIZE = 1000
+
+
+def backfill_phone_normalized(apps, schema_editor):
+    # Historical models have no custom save(), so fill the column in primary-key batches
+    Customer = apps.get_model('crm', 'Customer')
+    db_alias = schema_editor.connection.alias
+    queryset = Customer.objects.using(db_alias).exclude(phone__isnull=True).exclude(phone='')
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).order_by('pk').only('pk', 'phone')[:BATCH_SIZE])
+        if not batch:
+            break
+        for customer in batch:
+            customer.phone_normalized = normalize_phone(customer.phone)
+        Customer.objects.using(db_alias).bulk_update(batch, ['phone_normalized'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0002_rowcounter_shards'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='phone_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=24, null=True),
+        ),
+        migrations.RunPython(backfill_phone_normalized, migrations.RunPython.noop),
+    ]
@@ -3,6 +3,21 @@ from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, RegexValidator
 from django.utils import timezone
 from decimal import Decimal
+from django.conf import settings
+
+# Country code assumed for local-format numbers such as 123-456-7890
+PHONE_DEFAULT_COUNTRY_CODE = getattr(settings, "PHONE_DEFAULT_COUNTRY_CODE", "1")
+
+
+def normalize_phone(phone):
+    """Return a phone number (or prefix of one) in E.164 form, e.g. +11234567890."""
+    if not phone:
+        return None
+    digits = "".join(ch for ch in phone if ch.isdigit())
+    if phone.strip().startswith("+"):
+        return "+" + digits
+    return "+" + PHONE_DEFAULT_COUNTRY_CODE + digits
+
 
 class Customer(models.Model):
     name = models.CharField(max_length=255)
@@ -17,6 +32,22 @@ class Customer(models.Model):
             message="Phone number must be in the format +1234567890 or 123-456-7890"
         )]
     )
+    # E.164 copy of phone for indexed prefix lookups (CustomerFilter.phone_pattern);
+    # "+", a country code of up to 3 digits and the 20 characters phone can hold
+    phone_normalized = models.CharField(
+        max_length=24,
+        blank=True,
+        null=True,
+        editable=False,
+        db_index=True
+    )
+
+    def save(self, *args, **kwargs):
+        self.phone_normalized = normalize_phone(self.phone)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'phone_normalized'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -51,7 +82,7 @@ class Order(models.Model):
         Product,
         related_name='product_orders'
     )
-    order_date = models.DateTimeField(default=timezone.now)
+    order_date = models.DateTimeField(default=timezone.now, db_index=True)
     total_amount = models.DecimalField(
         max_digits=12,
         decimal_places=2,
@@ -62,10 +93,110 @@ class Order(models.Model):
         self.total_amount = sum(product.price for product in self.products.all())
         self.save(update_fields=['total_amount'])
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.update_total_amount()
-
     def __str__(self):
         product_names = ", ".join(self.products.values_list('name', flat=True))
-        return f"Order {self.pk} by {self.customer.name} | Cart: [{product_names}] | Total: GH₵{self.total_amount}"
\ No newline at end of file
+        return f"Order {self.pk} by {self.customer.name} | Cart: [{product_names}] | Total: GH₵{self.total_amount}"
+
+
+class ArchivedOrder(models.Model):
+    """An order moved out of the hot Order table by crm.tasks.archive_old_orders.
+
+    Keeps the original primary key, so global IDs stay valid, and mirrors the
+    Order fields so OrderNode and OrderFilter work on it unchanged.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.PROTECT,
+        related_name='archived_orders'
+    )
+    products = models.ManyToManyField(
+        Product,
+        related_name='archived_product_orders'
+    )
+    order_date = models.DateTimeField(db_index=True)
+    total_amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+    )
+
+    def __str__(self):
+        return f"Archived order {self.pk} | Total: GH₵{self.total_amount}"
+
+
+class RowCounter(models.Model):
+    """One shard of a model's row count, kept current by signals (see crm.counting).
+
+    A table's count is the sum of its shards; writers update a random shard,
+    so concurrent inserts do not all wait on one row lock. Lets unfiltered
+    connections answer totalCount without a COUNT(*).
+    """
+    table = models.CharField(max_length=100)
+    shard = models.PositiveSmallIntegerField(default=0)
+    rows = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['table', 'shard'], name='crm_rowcounter_table_shard')]
+
+    def __str__(self):
+        return f"{self.table}[{self.shard}]: {self.rows} rows"
+
+
+class CustomerSegment(models.Model):
+    """RFM scores of a customer, rebuilt in bulk by crm.tasks.refresh_customer_segments.
+
+    Scores run from 1 (worst) to 5 (best) and are quintiles over all
+    customers with orders; customers without orders are "prospect".
+    """
+    SEGMENTS = [
+        ('champion', 'Champion'),
+        ('loyal', 'Loyal'),
+        ('promising', 'Promising'),
+        ('at_risk', 'At risk'),
+        ('needs_attention', 'Needs attention'),
+        ('hibernating', 'Hibernating'),
+        ('prospect', 'Prospect'),
+    ]
+
+    customer = models.OneToOneField(
+        Customer,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='rfm'
+    )
+    recency_days = models.PositiveIntegerField(null=True)
+    frequency = models.PositiveIntegerField(default=0)
+    monetary = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    recency_score = models.PositiveSmallIntegerField(default=0)
+    frequency_score = models.PositiveSmallIntegerField(default=0)
+    monetary_score = models.PositiveSmallIntegerField(default=0)
+    segment = models.CharField(max_length=20, choices=SEGMENTS, db_index=True)
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.customer_id}: {self.segment}"
+
+
+class OutboxEvent(models.Model):
+    """A side effect of a write, recorded in the writer's transaction (see crm.outbox).
+
+    Events are handled in id order by the outbox drainer; ``processed_at``
+    is set once every handler for the event has run, ``failed_at`` once it
+    has failed too often to retry.
+    """
+    id = models.BigAutoField(primary_key=True)
+    event_type = models.CharField(max_length=50)
+    aggregate_type = models.CharField(max_length=30)
+    aggregate_id = models.BigIntegerField()
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['aggregate_type', 'aggregate_id', 'id'])]
+
+    def __str__(self):
+        return f"{self.event_type} {self.aggregate_type}:{self.aggregate_id}"
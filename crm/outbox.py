@@ -0,0 +1,184 @@
+"""Transactional outbox for order, customer and stock events.
+
+Mutations call ``record``/``record_many`` inside their own transaction, so an
+event exists exactly when its write committed. ``drain`` (run by the
+``drain_outbox`` task in crm/celery.py) hands unprocessed events to the
+handlers in ``OUTBOX_HANDLERS``, in id order and in batches. Delivery is
+at-least-once: handlers must tolerate seeing an event twice.
+
+Ordering holds per aggregate: an event is only picked up once every earlier
+event of its aggregate has been processed, so a failing event holds back the
+rest of its aggregate and nothing else. Batches are claimed with
+``SELECT ... FOR UPDATE SKIP LOCKED``, so several drainers can run at once.
+An event that fails ``OUTBOX_MAX_ATTEMPTS`` times is dead-lettered
+(``failed_at`` is set) and no longer blocks its aggregate. ``compact`` drops
+superseded and long-processed events.
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, Max, OuterRef
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .joblog import get_job_logger
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+ORDER_CREATED = "order.created"
+CUSTOMER_CREATED = "customer.created"
+PRODUCT_STOCK_CHANGED = "product.stock_changed"
+
+OUTBOX_BATCH_SIZE = getattr(settings, "OUTBOX_BATCH_SIZE", 500)
+OUTBOX_RETENTION_HOURS = getattr(settings, "OUTBOX_RETENTION_HOURS", 24)
+OUTBOX_HANDLERS = getattr(settings, "OUTBOX_HANDLERS", {})
+OUTBOX_MAX_ATTEMPTS = getattr(settings, "OUTBOX_MAX_ATTEMPTS", 10)
+# Event types where only the newest pending event per aggregate matters
+OUTBOX_COMPACTABLE = getattr(settings, "OUTBOX_COMPACTABLE", (PRODUCT_STOCK_CHANGED,))
+
+ORDER_REMINDERS_LOG_FILE = "/tmp/order_reminders_log.txt"
+LOW_STOCK_LOG_FILE = "/tmp/low_stock_updates_log.txt"
+
+
+def record(event_type, aggregate, payload=None):
+    """Add an event for a model instance; call inside the writing transaction."""
+    return OutboxEvent.objects.create(**_event_fields(event_type, aggregate, payload))
+
+
+def record_many(event_type, aggregates, payload=None):
+    """Add one event per instance; ``payload`` maps an instance to its payload."""
+    return OutboxEvent.objects.bulk_create([
+        OutboxEvent(**_event_fields(event_type, aggregate, payload(aggregate) if payload else None))
+        for aggregate in aggregates
+    ])
+
+
+def order_event_payload(order, customer_email, products):
+    """Payload of an ``order.created`` event."""
+    return {
+        "customer_email": customer_email,
+        "total_amount": str(order.total_amount),
+        "product_ids": [p.id for p in products],
+    }
+
+
+def _event_fields(event_type, aggregate, payload):
+    return {
+        "event_type": event_type,
+        "aggregate_type": aggregate._meta.model_name,
+        "aggregate_id": aggregate.pk,
+        "payload": payload or {},
+    }
+
+
+_handlers = None
+
+
+def get_handlers():
+    global _handlers
+    if _handlers is None:
+        _handlers = {
+            event_type: [import_string(path) for path in paths]
+            for event_type, paths in OUTBOX_HANDLERS.items()
+        }
+    return _handlers
+
+
+# ----------------------
+# Draining
+# ----------------------
+def pending_events():
+    """Events that are due, oldest first: not processed, not dead, and first of their aggregate."""
+    pending = OutboxEvent.objects.filter(processed_at__isnull=True, failed_at__isnull=True)
+    earlier = pending.filter(
+        aggregate_type=OuterRef("aggregate_type"), aggregate_id=OuterRef("aggregate_id"), id__lt=OuterRef("id"),
+    )
+    return pending.filter(~Exists(earlier)).order_by("id")
+
+
+def drain_batch(batch_size=OUTBOX_BATCH_SIZE, exclude=()):
+    """Handle a batch of due events; return ``(handled, failed_ids)``.
+
+    ``exclude`` holds ids to leave alone, e.g. events that already failed
+    during the current drain.
+    """
+    handlers = get_handlers()
+    done, failed = [], []
+    with transaction.atomic():
+        events = list(pending_events().exclude(pk__in=exclude).select_for_update(skip_locked=True)[:batch_size])
+        for event in events:
+            try:
+                # A handler's failed writes roll back to here, not the whole batch
+                with transaction.atomic():
+                    for handler in handlers.get(event.event_type, ()):
+                        handler(event)
+            except Exception as e:
+                logger.exception("Outbox handler failed for event %s", event.pk)
+                failed.append(event.pk)
+                dead = event.attempts + 1 >= OUTBOX_MAX_ATTEMPTS
+                OutboxEvent.objects.filter(pk=event.pk).update(
+                    attempts=F("attempts") + 1, last_error=repr(e), failed_at=timezone.now() if dead else None,
+                )
+            else:
+                done.append(event.pk)
+        OutboxEvent.objects.filter(pk__in=done).update(processed_at=timezone.now(), attempts=F("attempts") + 1)
+    return len(done), failed
+
+
+def drain(batch_size=OUTBOX_BATCH_SIZE, max_batches=20):
+    """Drain batches until no event is due or ``max_batches`` ran; return the handled count.
+
+    Events that fail are retried by the next drain, not within this one.
+    """
+    handled, failed = 0, set()
+    for _ in range(max_batches):
+        done, batch_failed = drain_batch(batch_size, exclude=failed)
+        handled += done
+        failed.update(batch_failed)
+        if done + len(batch_failed) < batch_size:
+            break
+    return handled
+
+
+def compact(retention_hours=OUTBOX_RETENTION_HOURS):
+    """Supersede stale pending events of compactable types and delete old processed ones."""
+    now = timezone.now()
+    latest = (
+        OutboxEvent.objects.filter(processed_at__isnull=True, failed_at__isnull=True, event_type__in=OUTBOX_COMPACTABLE)
+        .values("event_type", "aggregate_type", "aggregate_id")
+        .annotate(latest=Max("id"))
+    )
+    superseded = 0
+    # One UPDATE per aggregate with pending duplicates; the set is small between drains
+    for row in latest:
+        superseded += OutboxEvent.objects.filter(
+            processed_at__isnull=True,
+            failed_at__isnull=True,
+            event_type=row["event_type"],
+            aggregate_type=row["aggregate_type"],
+            aggregate_id=row["aggregate_id"],
+            id__lt=row["latest"],
+        ).update(processed_at=now, last_error="superseded")
+
+    cutoff = now - datetime.timedelta(hours=retention_hours)
+    deleted, _ = OutboxEvent.objects.filter(processed_at__lt=cutoff).delete()
+    return superseded, deleted
+
+
+# ----------------------
+# Handlers
+# ----------------------
+def log_order_reminder(event):
+    """Append new orders to the reminders log, instead of rescanning a week of orders."""
+    get_job_logger(ORDER_REMINDERS_LOG_FILE).info("Order reminder", extra={
+        "order_id": event.aggregate_id, "customer_email": event.payload.get("customer_email"), "event_id": event.pk,
+    })
+
+
+def log_stock_change(event):
+    get_job_logger(LOW_STOCK_LOG_FILE).info("Product restocked", extra={
+        "product": event.payload.get("name"), "stock": event.payload.get("stock"), "event_id": event.pk,
+    })
@@ -0,0 +1,187 @@
+"""On-demand profiling of GraphQL requests and Celery tasks.
+
+Off unless ``CRM_PROFILING_ENABLED`` is set. Even then, a request or task is
+only profiled when asked:
+
+* HTTP: send ``X-CRM-Profile: <token>``. The token comes from
+  ``make_profile_token()`` or ``manage.py profile_token`` and is signed with
+  SECRET_KEY. It is valid for ``PROFILE_TOKEN_MAX_AGE`` seconds.
+* Celery: ``task.apply_async(..., headers={"crm_profile": "sample"})``, or list
+  the task in ``CRM_PROFILE_TASKS``.
+
+There are two modes. ``sample`` reads the profiled thread's stack every
+``PROFILE_SAMPLE_INTERVAL`` seconds from a side thread, so overhead stays
+low. It writes Brendan Gregg's folded-stack format (``.folded``), which
+flamegraph.pl and speedscope read directly. ``cprofile`` records every call
+and writes a ``.pstats`` file. Output goes to ``PROFILE_DIR``, which is a
+ring: only the newest ``PROFILE_RING_SIZE`` files are kept.
+"""
+import cProfile
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+
+PROFILING_ENABLED = getattr(settings, "CRM_PROFILING_ENABLED", False)
+PROFILE_DIR = Path(getattr(settings, "PROFILE_DIR", Path(tempfile.gettempdir()) / "crm_profiles"))
+PROFILE_RING_SIZE = getattr(settings, "PROFILE_RING_SIZE", 50)
+PROFILE_SAMPLE_INTERVAL = getattr(settings, "PROFILE_SAMPLE_INTERVAL", 0.005)
+PROFILE_TOKEN_MAX_AGE = getattr(settings, "PROFILE_TOKEN_MAX_AGE", 300)
+PROFILE_TASKS = getattr(settings, "CRM_PROFILE_TASKS", {})
+
+PROFILE_HEADER = "HTTP_X_CRM_PROFILE"
+SAMPLE = "sample"
+CPROFILE = "cprofile"
+MODES = (SAMPLE, CPROFILE)
+
+_signer = signing.TimestampSigner(salt="crm.profiling")
+
+
+def make_profile_token(mode=SAMPLE):
+    """Return a header value that profiles requests in ``mode`` for PROFILE_TOKEN_MAX_AGE seconds."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown profiling mode {mode!r}.")
+    return _signer.sign(mode)
+
+
+def requested_mode(request):
+    """The mode asked for by a valid X-CRM-Profile header, or None."""
+    token = request.META.get(PROFILE_HEADER)
+    if not PROFILING_ENABLED or not token:
+        return None
+    try:
+        mode = _signer.unsign(token, max_age=PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return mode if mode in MODES else None
+
+
+# ----------------------
+# Profilers
+# ----------------------
+class StackSampler:
+    """Counts a thread's stacks, sampled from a daemon thread."""
+
+    def __init__(self, thread_id=None, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="crm-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class CallProfiler:
+    """cProfile over the current thread."""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+
+def _trim_ring():
+    profiles = sorted(path for path in PROFILE_DIR.iterdir() if not path.name.startswith("."))
+    for path in profiles[:-PROFILE_RING_SIZE]:
+        path.unlink(missing_ok=True)
+
+
+def _save(profiler, label, mode, duration):
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    safe_label = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in label)[:80]
+    name = f"{time.time_ns()}-{safe_label}-{duration * 1000:.0f}ms.{'folded' if mode == SAMPLE else 'pstats'}"
+    # Written under a dot-name first, so readers and _trim_ring never see a partial file
+    partial = PROFILE_DIR / f".{name}"
+    profiler.write(partial)
+    os.replace(partial, PROFILE_DIR / name)
+    _trim_ring()
+    return PROFILE_DIR / name
+
+
+class Profile:
+    """Handle yielded by ``profile()``; ``path`` is set once the profile is saved."""
+
+    def __init__(self, label, mode):
+        self.label = label
+        self.mode = mode
+        self.path = None
+        self.profiler = StackSampler() if mode == SAMPLE else CallProfiler()
+
+    def start(self):
+        self.started = time.monotonic()
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
+        self.path = _save(self.profiler, self.label, self.mode, time.monotonic() - self.started)
+        return self.path
+
+
+@contextmanager
+def profile(label, mode=SAMPLE):
+    """Profile the enclosed block in ``mode``; a falsy mode runs it unprofiled."""
+    if not mode:
+        yield None
+        return
+    handle = Profile(label, mode)
+    handle.start()
+    try:
+        yield handle
+    finally:
+        handle.stop()
+
+
+# ----------------------
+# Celery hooks (connected in crm/celery.py)
+# ----------------------
+_task_profiles = {}
+
+
+def start_task_profile(task_id=None, task=None, **kwargs):
+    mode = task.request.get("crm_profile") or PROFILE_TASKS.get(task.name)
+    if PROFILING_ENABLED and mode in MODES:
+        handle = Profile(task.name, mode)
+        handle.start()
+        _task_profiles[task_id] = handle
+
+
+def stop_task_profile(task_id=None, **kwargs):
+    handle = _task_profiles.pop(task_id, None)
+    if handle is not None:
+        handle.stop()
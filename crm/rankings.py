@@ -0,0 +1,103 @@
+"""Top products by revenue or units sold, aggregated in SQL and cached.
+
+Each (metric, limit, date window) result is cached under the current orders
+version. Order creation, deletion and changes to an order's products bump
+the version on commit (see ``crm.signals``), so stale rankings are never
+read back; product price changes bump the catalog version, which is part of
+the key too.
+
+The through table has no quantity or unit price, so "units" counts order
+lines and "revenue" values each line at the product's current price.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .archive import reaches_archive
+from .catalog import get_catalog_version, initial_version
+from .models import ArchivedOrder, Order
+
+ORDERS_VERSION_KEY = "crm:orders:version"
+TOP_PRODUCTS_CACHE_TIMEOUT = getattr(settings, "TOP_PRODUCTS_CACHE_TIMEOUT", 300)
+TOP_PRODUCTS_MAX = 100
+
+REVENUE = "revenue"
+UNITS = "units"
+
+
+def get_orders_version():
+    version = cache.get(ORDERS_VERSION_KEY)
+    if version is None:
+        cache.add(ORDERS_VERSION_KEY, initial_version(), timeout=None)
+        version = cache.get(ORDERS_VERSION_KEY, 0)
+    return version
+
+
+def bump_orders_version():
+    """Invalidate cached rankings once the current transaction commits."""
+    def bump():
+        try:
+            cache.incr(ORDERS_VERSION_KEY)
+        except ValueError:
+            cache.set(ORDERS_VERSION_KEY, initial_version(), timeout=None)
+    transaction.on_commit(bump)
+
+
+def _window(date_gte=None, date_lte=None):
+    """Turn inclusive calendar dates into an aware ``[start, end)`` datetime range."""
+    bounds = {}
+    if date_gte is not None:
+        bounds["order__order_date__gte"] = timezone.make_aware(
+            datetime.datetime.combine(date_gte, datetime.time.min)
+        )
+    if date_lte is not None:
+        bounds["order__order_date__lt"] = timezone.make_aware(
+            datetime.datetime.combine(date_lte + datetime.timedelta(days=1), datetime.time.min)
+        )
+    return bounds
+
+
+def _line_totals(model, bounds):
+    through = model.products.through
+    order_field = model.products.field.m2m_field_name()
+    bounds = {key.replace("order__", f"{order_field}__", 1): value for key, value in bounds.items()}
+    return (
+        through.objects.filter(**bounds)
+        .values("product_id")
+        .annotate(units=Count("pk"), revenue=Sum("product__price"))
+    )
+
+
+def compute_top_products(by=REVENUE, first=10, date_gte=None, date_lte=None):
+    """Return ``[(product_id, units, revenue)]`` ranked by ``by``, best first."""
+    bounds = _window(date_gte, date_lte)
+    ordering = ("-revenue", "-units", "product_id") if by == REVENUE else ("-units", "-revenue", "product_id")
+    hot = _line_totals(Order, bounds).order_by(*ordering)
+    if not reaches_archive(date_gte, date_lte):
+        return [(row["product_id"], row["units"], row["revenue"]) for row in hot[:first]]
+
+    # Both tables are grouped in SQL; only the per-product totals are merged here
+    totals = {}
+    for row in list(hot) + list(_line_totals(ArchivedOrder, bounds)):
+        units, revenue = totals.get(row["product_id"], (0, 0))
+        totals[row["product_id"]] = (units + row["units"], revenue + row["revenue"])
+    index = 1 if by == REVENUE else 0
+    ranked = sorted(totals.items(), key=lambda item: (-item[1][index], -item[1][1 - index], item[0]))
+    return [(product_id, units, revenue) for product_id, (units, revenue) in ranked[:first]]
+
+
+def top_products(by=REVENUE, first=10, date_gte=None, date_lte=None):
+    """Cached ``compute_top_products``; ``first`` is clamped to 1..TOP_PRODUCTS_MAX."""
+    first = max(1, min(first, TOP_PRODUCTS_MAX))
+    key = "crm:top-products:{}:{}:{}:{}:{}:{}".format(
+        get_orders_version(), get_catalog_version(), by, first, date_gte or "", date_lte or "",
+    )
+    result = cache.get(key)
+    if result is None:
+        result = compute_top_products(by, first, date_gte, date_lte)
+        cache.set(key, result, TOP_PRODUCTS_CACHE_TIMEOUT)
+    return result
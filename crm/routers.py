@@ -0,0 +1,99 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+PRIMARY_DB = "default"
+
+# Per-request routing state, installed by crm.middleware.ReadYourWritesMiddleware
+_routing_state = ContextVar("crm_routing_state", default=None)
+
+
+class RoutingState:
+    """Whether the current request must read from the primary, and whether it wrote.
+
+    ``replica`` is the replica the request reads from, picked on its first
+    read so every query of a request sees the same snapshot.
+    """
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = None
+
+
+def begin_request(pinned=False):
+    state = RoutingState(pinned)
+    return state, _routing_state.set(state)
+
+
+def resume_request(state):
+    """Make ``state`` current again, e.g. while a streaming response is produced."""
+    return _routing_state.set(state)
+
+
+def end_request(token):
+    _routing_state.reset(token)
+
+
+def pin_primary():
+    """Send every remaining read of the current request to the primary."""
+    state = _routing_state.get()
+    if state is not None:
+        state.pinned = True
+
+
+@contextmanager
+def read_from_primary():
+    """Read from the primary inside the block, e.g. for jobs that read then write."""
+    state, token = begin_request(pinned=True)
+    try:
+        yield state
+    finally:
+        end_request(token)
+
+
+def get_replicas():
+    return [alias for alias in getattr(settings, "DATABASE_REPLICAS", ()) if alias in settings.DATABASES]
+
+
+class PrimaryReplicaRouter:
+    """Route reads to a replica, one per request, and writes to the primary.
+
+    Reads stay on the primary while the current request is pinned: after a
+    mutation, and for a short window after the client's last write (see
+    ``ReadYourWritesMiddleware``). Reads through an instance (related
+    managers, ``refresh_from_db``) go to the database the instance came from,
+    inside a request or not. With no ``DATABASE_REPLICAS`` configured
+    everything goes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        state = _routing_state.get()
+        if state is not None and (state.pinned or state.wrote):
+            return PRIMARY_DB
+        replicas = get_replicas()
+        if not replicas:
+            return PRIMARY_DB
+        if state is None:
+            return random.choice(replicas)
+        if state.replica not in replicas:
+            state.replica = random.choice(replicas)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in get_replicas()
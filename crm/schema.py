@@ -1,11 +1,119 @@
+import re
+from functools import partial
+
 import graphene
+from django.db import transaction
+from django.utils import timezone
+from graphene.relay.connection import connection_adapter, page_info_adapter
 from graphene_django import DjangoObjectType
 from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.utils import maybe_queryset
+from graphql import GraphQLError
+from graphql_relay import connection_from_array_slice, from_global_id, get_offset_with_default
 from crm.models import Product
 
-from .models import Customer, Product, Order
+from .archive import OrderHistory, reaches_archive
+from .broadcast import LOW_STOCK_ALERT, ORDER_CREATED, PRODUCT_STOCK_CHANGED, get_broadcast
+from .catalog import bump_catalog_version, get_catalog
+from .counting import adjust_row_count, count_rows
+from .importing import bulk_create_sets_pks
+from .models import ArchivedOrder, Customer, Product, Order
+from .outbox import (
+    CUSTOMER_CREATED,
+    ORDER_CREATED as ORDER_CREATED_EVENT,
+    PRODUCT_STOCK_CHANGED as PRODUCT_STOCK_CHANGED_EVENT,
+    order_event_payload,
+    record,
+    record_many,
+)
+from .rankings import REVENUE, UNITS, bump_orders_version, top_products
+from .signals import publish_on_commit, publish_stock_change
+from .streaming import get_row_stream
 from .filters import CustomerFilter, ProductFilter, OrderFilter
 
+# ----------------------
+# Connections with cheap totalCount
+# ----------------------
+class CountedConnection(graphene.relay.Connection):
+    """Connection exposing totalCount through the strategies in crm.counting."""
+
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int(exact=graphene.Boolean(default_value=False))
+    total_count_is_exact = graphene.Boolean()
+
+    def get_count(self, exact=False):
+        counts = self.__dict__.setdefault("_counts", {})
+        if exact not in counts:
+            counts[exact] = count_rows(self.iterable, exact=exact)
+        return counts[exact]
+
+    def resolve_total_count(self, info, exact=False):
+        return self.get_count(exact)[0]
+
+    def resolve_total_count_is_exact(self, info):
+        return self.get_count()[1]
+
+
+class CRMConnectionField(DjangoFilterConnectionField):
+    """Filter connection that pages forward without counting the queryset.
+
+    Forward pages fetch ``first + 1`` rows to learn whether a next page exists;
+    only backward or offset pagination falls back to the stock COUNT(*).
+    """
+
+    def __init__(self, type_, *args, order_by=None, **kwargs):
+        # DjangoFilterConnectionField claims ``order_by`` for itself; pass it on as an argument
+        if order_by is not None:
+            kwargs["args"] = {**kwargs.get("args", {}), "order_by": order_by}
+        super().__init__(type_, *args, **kwargs)
+
+    @classmethod
+    def connection_resolver(cls, resolver, connection, default_manager, queryset_resolver, max_limit,
+                            enforce_first_or_last, root, info, **args):
+        # Streamed NDJSON responses (crm.streaming) read every chunk after the
+        # first from one iterator over the queryset the first chunk resolved
+        stream = get_row_stream(info)
+        if stream is not None and stream.started:
+            return stream.resolve_connection(connection, args)
+        resolved = super().connection_resolver(
+            resolver, connection, default_manager, queryset_resolver, max_limit,
+            enforce_first_or_last, root, info, **args,
+        )
+        if stream is not None:
+            stream.start(resolved.iterable, get_offset_with_default(args.get("after"), -1) + 1 + len(resolved.edges))
+        return resolved
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        iterable = maybe_queryset(iterable)
+        first = args.get("first") or max_limit
+        if first is None or args.get("last") or args.get("before") or args.get("offset"):
+            if hasattr(iterable, "counted"):
+                # e.g. crm.archive.OrderHistory, which only counts when asked to
+                iterable = iterable.counted()
+            return super().resolve_connection(connection, args, iterable, max_limit)
+
+        args["first"] = first
+        slice_start = get_offset_with_default(args.get("after"), -1) + 1
+        rows = list(iterable[slice_start:slice_start + first + 1])
+
+        resolved = connection_from_array_slice(
+            rows,
+            args,
+            slice_start=slice_start,
+            array_length=slice_start + len(rows),
+            array_slice_length=len(rows),
+            connection_type=partial(connection_adapter, connection),
+            edge_type=connection.Edge,
+            page_info_type=page_info_adapter,
+        )
+        resolved.iterable = iterable
+        resolved.length = slice_start + len(rows)
+        return resolved
+
+
 # ----------------------
 # GraphQL Types with Relay Nodes
 # ----------------------
@@ -15,6 +123,15 @@ class CustomerNode(DjangoObjectType):
         fields = ("id", "name", "email", "phone", "created_at")
         filterset_class = CustomerFilter
         interfaces = (graphene.relay.Node,)
+        connection_class = CountedConnection
+
+    segment = graphene.String(description="RFM segment from the last refresh, if any.")
+
+    def resolve_segment(self, info):
+        try:
+            return self.rfm.segment
+        except Customer.rfm.RelatedObjectDoesNotExist:
+            return None
 
 
 class ProductNode(DjangoObjectType):
@@ -23,6 +140,17 @@ class ProductNode(DjangoObjectType):
         fields = ("id", "name", "price", "stock")
         filterset_class = ProductFilter
         interfaces = (graphene.relay.Node,)
+        connection_class = CountedConnection
+
+    @classmethod
+    def get_node(cls, info, id):
+        # Served from the per-process catalog snapshot instead of the DB
+        return get_catalog().get_product(id)
+
+    @classmethod
+    def get_nodes(cls, info, ids):
+        catalog = get_catalog()
+        return {pk: catalog.get_product(pk) for pk in ids}
 
 
 class OrderNode(DjangoObjectType):
@@ -31,6 +159,86 @@ class OrderNode(DjangoObjectType):
         fields = ("id", "customer", "products", "order_date", "total_amount")
         filterset_class = OrderFilter
         interfaces = (graphene.relay.Node,)
+        connection_class = CountedConnection
+
+    # Archived orders keep their id and fields, so they resolve as OrderNode too
+    @classmethod
+    def is_type_of(cls, root, info):
+        return isinstance(root, ArchivedOrder) or super().is_type_of(root, info)
+
+    @classmethod
+    def get_node(cls, info, id):
+        return super().get_node(info, id) or ArchivedOrder.objects.filter(pk=id).first()
+
+    @classmethod
+    def get_nodes(cls, info, ids):
+        found = {order.pk: order for order in cls.get_queryset(Order.objects, info).filter(pk__in=ids)}
+        missing = [pk for pk in ids if pk not in found]
+        if missing:
+            found.update((order.pk, order) for order in ArchivedOrder.objects.filter(pk__in=missing))
+        return found
+
+
+def resolve_nodes_by_ids(info, global_ids):
+    """Fetch many global IDs with one IN query per type, in input order.
+
+    Node types can provide ``get_nodes(info, pks) -> {pk: instance}``;
+    otherwise their default queryset is filtered on ``pk__in``. Unknown or
+    malformed IDs resolve to None.
+    """
+    decoded = []
+    pks_by_type = {}
+    for global_id in global_ids:
+        try:
+            type_name, pk = from_global_id(global_id)
+            pk = int(pk)
+        except Exception:
+            decoded.append(None)
+            continue
+        graphql_type = info.schema.get_type(type_name)
+        node_type = getattr(graphql_type, "graphene_type", None)
+        if node_type is None or graphene.relay.Node not in getattr(node_type._meta, "interfaces", ()):
+            decoded.append(None)
+            continue
+        decoded.append((node_type, pk))
+        pks_by_type.setdefault(node_type, []).append(pk)
+
+    found = {}
+    for node_type, pks in pks_by_type.items():
+        pks = list(dict.fromkeys(pks))
+        if hasattr(node_type, "get_nodes"):
+            instances = node_type.get_nodes(info, pks)
+        else:
+            queryset = node_type.get_queryset(node_type._meta.model.objects, info)
+            instances = {obj.pk: obj for obj in queryset.filter(pk__in=pks)}
+        found[node_type] = instances
+
+    return [found[key[0]].get(key[1]) if key else None for key in decoded]
+
+
+class OrderConnectionField(CRMConnectionField):
+    """Filter connection that also filters the archived half of an OrderHistory."""
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, filtering_args, filterset_class):
+        parent = super(OrderConnectionField, cls).resolve_queryset
+        if isinstance(iterable, OrderHistory):
+            return iterable.map(lambda qs: parent(connection, qs, info, args, filtering_args, filterset_class))
+        return parent(connection, iterable, info, args, filtering_args, filterset_class)
+
+
+# ----------------------
+# Product rankings
+# ----------------------
+class TopProductsBy(graphene.Enum):
+    REVENUE = REVENUE
+    UNITS = UNITS
+
+
+class TopProduct(graphene.ObjectType):
+    product = graphene.Field(ProductNode)
+    units = graphene.Int()
+    revenue = graphene.Decimal()
 
 
 # ----------------------
@@ -43,15 +251,36 @@ class Query(graphene.ObjectType):
     customer = graphene.relay.Node.Field(CustomerNode)
     product = graphene.relay.Node.Field(ProductNode)
     order = graphene.relay.Node.Field(OrderNode)
+    nodes = graphene.List(graphene.relay.Node, ids=graphene.List(graphene.NonNull(graphene.ID), required=True))
 
     # Filtered list queries
-    all_customers = DjangoFilterConnectionField(CustomerNode, order_by=graphene.List(of_type=graphene.String))
-    all_products = DjangoFilterConnectionField(ProductNode, order_by=graphene.List(of_type=graphene.String))
-    all_orders = DjangoFilterConnectionField(OrderNode, order_by=graphene.List(of_type=graphene.String))
+    all_customers = CRMConnectionField(CustomerNode, order_by=graphene.List(of_type=graphene.String))
+    all_products = CRMConnectionField(ProductNode, order_by=graphene.List(of_type=graphene.String))
+    all_orders = OrderConnectionField(OrderNode, order_by=graphene.List(of_type=graphene.String))
+
+    top_products = graphene.List(
+        graphene.NonNull(TopProduct),
+        by=TopProductsBy(default_value=REVENUE),
+        first=graphene.Int(default_value=10),
+        order_date_gte=graphene.Date(),
+        order_date_lte=graphene.Date(),
+    )
+
+    def resolve_nodes(self, info, ids):
+        return resolve_nodes_by_ids(info, ids)
+
+    def resolve_top_products(self, info, by=REVENUE, first=10, order_date_gte=None, order_date_lte=None):
+        # Graphene passes enum members for explicit arguments and the raw default otherwise
+        by = getattr(by, "value", by)
+        catalog = get_catalog()
+        return [
+            TopProduct(product=catalog.get_product(product_id), units=units, revenue=revenue)
+            for product_id, units, revenue in top_products(by, first, order_date_gte, order_date_lte)
+        ]
 
     # Custom ordering resolver
     def resolve_all_customers(self, info, **kwargs):
-        qs = Customer.objects.all()
+        qs = Customer.objects.select_related("rfm")
         order_by = kwargs.get("order_by")
         if order_by:
             qs = qs.order_by(*order_by)
@@ -67,9 +296,10 @@ class Query(graphene.ObjectType):
     def resolve_all_orders(self, info, **kwargs):
         qs = Order.objects.all()
         order_by = kwargs.get("order_by")
-        if order_by:
-            qs = qs.order_by(*order_by)
-        return qs
+        # Only windows reaching past the archive cutoff pay for the archive tables
+        if not reaches_archive(kwargs.get("order_date__gte"), kwargs.get("order_date__lte")):
+            return qs.order_by(*order_by) if order_by else qs
+        return OrderHistory(qs, ArchivedOrder.objects.all(), order_by or ())
 
 
 # ----------------------
@@ -84,14 +314,22 @@ class UpdateLowStockProducts(graphene.Mutation):
     message = graphene.String()
 
     def mutate(root, info):
-        # Query products with stock < 10
-        low_stock_products = Product.objects.filter(stock__lt=10)
-
-        updated_list = []
-        for product in low_stock_products:
-            product.stock += 10
-            product.save()
-            updated_list.append(product)
+        with transaction.atomic():
+            # Query products with stock < 10
+            updated_list = list(Product.objects.select_for_update().filter(stock__lt=10))
+            for product in updated_list:
+                product.stock += 10
+            # One UPDATE for the lot; bulk_update sends no post_save, so the
+            # catalog and the stock subscriptions are told here
+            Product.objects.bulk_update(updated_list, ["stock"])
+            if updated_list:
+                bump_catalog_version()
+            for product in updated_list:
+                publish_stock_change(product, product.stock - 10)
+            record_many(
+                PRODUCT_STOCK_CHANGED_EVENT, updated_list,
+                lambda product: {"name": product.name, "stock": product.stock, "previous_stock": product.stock - 10},
+            )
 
         return UpdateLowStockProducts(
             success=True,
@@ -100,6 +338,202 @@ class UpdateLowStockProducts(graphene.Mutation):
         )
 
 
+def to_pk(value, node_type):
+    """Primary key from a global ID of ``node_type`` or a plain id; None if it is neither."""
+    try:
+        type_name, pk = from_global_id(value)
+        if type_name == node_type._meta.name:
+            return int(pk)
+    except Exception:
+        pass
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Formats accepted on customer creation: +1234567890 or 123-456-7890
+PHONE_PATTERN = re.compile(r"^(\+?\d{7,15}|\d{3}-\d{3}-\d{4})$")
+
+
+class CustomerInput(graphene.InputObjectType):
+    name = graphene.String(required=True)
+    email = graphene.String(required=True)
+    phone = graphene.String()
+
+
+class BulkCreateCustomers(graphene.Mutation):
+    class Arguments:
+        customers = graphene.List(CustomerInput, required=True)
+
+    created_customers = graphene.List(CustomerNode)
+    errors = graphene.List(graphene.String)
+
+    def mutate(root, info, customers):
+        created = []
+        errors = []
+
+        with transaction.atomic():
+            for idx, data in enumerate(customers):
+                if Customer.objects.filter(email=data.email).exists():
+                    errors.append(f"Row {idx+1}: Email already exists ({data.email})")
+                    continue
+                if data.phone and not PHONE_PATTERN.match(data.phone):
+                    errors.append(f"Row {idx+1}: Invalid phone format ({data.phone})")
+                    continue
+
+                created.append(Customer.objects.create(name=data.name, email=data.email, phone=data.phone))
+
+            # Same transaction as the rows, so consumers never see a customer that was rolled back
+            record_many(CUSTOMER_CREATED, created, lambda customer: {"email": customer.email})
+
+        return BulkCreateCustomers(created_customers=created, errors=errors)
+
+
+class CreateOrder(graphene.Mutation):
+    class Arguments:
+        customer_id = graphene.ID(required=True)
+        product_ids = graphene.List(graphene.ID, required=True)
+        order_date = graphene.DateTime(required=False)
+
+    order = graphene.Field(OrderNode)
+    message = graphene.String()
+
+    def mutate(root, info, customer_id, product_ids, order_date=None):
+        try:
+            customer = Customer.objects.get(pk=to_pk(customer_id, CustomerNode))
+        except Customer.DoesNotExist:
+            raise GraphQLError("Invalid customer ID")
+
+        if not product_ids:
+            raise GraphQLError("At least one product must be selected")
+
+        # Prices come from the per-process catalog snapshot, not a Product query
+        catalog = get_catalog()
+        product_pks = [to_pk(pid, ProductNode) for pid in product_ids]
+        if any(catalog.get(pk) is None for pk in product_pks):
+            raise GraphQLError("One or more product IDs are invalid")
+        products = catalog.get_many(product_pks)
+
+        with transaction.atomic():
+            order = Order.objects.create(
+                customer=customer,
+                order_date=order_date or timezone.now(),
+                total_amount=sum(p.price for p in products),
+            )
+            order.products.add(*[p.id for p in products])
+            record(ORDER_CREATED_EVENT, order, order_event_payload(order, customer.email, products))
+
+        return CreateOrder(order=order, message="Order created successfully")
+
+
+class OrderInput(graphene.InputObjectType):
+    customer_id = graphene.ID(required=True)
+    product_ids = graphene.List(graphene.ID, required=True)
+    order_date = graphene.DateTime()
+
+
+class BulkCreateOrders(graphene.Mutation):
+    class Arguments:
+        orders = graphene.List(OrderInput, required=True)
+
+    created_orders = graphene.List(OrderNode)
+    errors = graphene.List(graphene.String)
+
+    def mutate(root, info, orders):
+        errors = []
+
+        # One customer query for the whole batch; prices come from the catalog snapshot
+        customer_ids = [to_pk(data.customer_id, CustomerNode) for data in orders]
+        known_customers = dict(Customer.objects.filter(pk__in=set(customer_ids) - {None}).values_list("pk", "email"))
+        catalog = get_catalog()
+
+        valid = []
+        for idx, (data, customer_id) in enumerate(zip(orders, customer_ids)):
+            if customer_id not in known_customers:
+                errors.append(f"Row {idx+1}: Invalid customer ID ({data.customer_id})")
+                continue
+            if not data.product_ids:
+                errors.append(f"Row {idx+1}: At least one product must be selected")
+                continue
+            product_ids = [to_pk(pid, ProductNode) for pid in data.product_ids]
+            invalid = [raw for raw, pid in zip(data.product_ids, product_ids) if catalog.get(pid) is None]
+            if invalid:
+                errors.append(f"Row {idx+1}: Invalid product IDs ({', '.join(map(str, invalid))})")
+                continue
+
+            products = catalog.get_many(product_ids)
+            order = Order(
+                customer_id=customer_id,
+                order_date=data.order_date or timezone.now(),
+                total_amount=sum(p.price for p in products),
+            )
+            valid.append((order, products))
+
+        created = [order for order, _ in valid]
+        with transaction.atomic():
+            if bulk_create_sets_pks(Order):
+                Order.objects.bulk_create(created)
+                # bulk_create skips the post_save receivers in crm.signals
+                adjust_row_count(Order, len(created))
+                for order in created:
+                    publish_on_commit(ORDER_CREATED, {"id": order.pk})
+            else:
+                # The through rows need the new ids; save() sets them and sends post_save
+                for order in created:
+                    order.save(force_insert=True)
+            # Every order's products in a single through-table insert, which sends no m2m_changed
+            OrderProducts = Order.products.through
+            OrderProducts.objects.bulk_create([
+                OrderProducts(order_id=order.pk, product_id=product.id)
+                for order, products in valid
+                for product in products
+            ])
+            if created:
+                bump_orders_version()
+            payloads = {
+                order.pk: order_event_payload(order, known_customers[order.customer_id], products)
+                for order, products in valid
+            }
+            record_many(ORDER_CREATED_EVENT, created, lambda order: payloads[order.pk])
+
+        return BulkCreateOrders(created_orders=created, errors=errors)
+
+
 class Mutation(graphene.ObjectType):
     update_low_stock_products = UpdateLowStockProducts.Field()
+    bulk_create_customers = BulkCreateCustomers.Field()
+    create_order = CreateOrder.Field()
+    bulk_create_orders = BulkCreateOrders.Field()
     # add other mutations here if any
+
+
+# ----------------------
+# Subscriptions (served over WebSockets, see crm.websocket)
+# ----------------------
+class Subscription(graphene.ObjectType):
+    order_created = graphene.Field(OrderNode)
+    product_stock_changed = graphene.Field(ProductNode)
+    low_stock_alert = graphene.Field(ProductNode)
+
+    # subscribe_* yield broadcast events; resolve_* turn an event into its model
+    # instance, loaded once per event and shared by every subscriber
+    def subscribe_order_created(root, info):
+        return get_broadcast().subscribe(ORDER_CREATED)
+
+    def subscribe_product_stock_changed(root, info):
+        return get_broadcast().subscribe(PRODUCT_STOCK_CHANGED)
+
+    def subscribe_low_stock_alert(root, info):
+        return get_broadcast().subscribe(LOW_STOCK_ALERT)
+
+    def resolve_order_created(event, info):
+        return event.load("instance", lambda: (
+            Order.objects.select_related("customer").filter(pk=event.payload["id"]).first()
+        ))
+
+    def resolve_product_stock_changed(event, info):
+        return event.load("instance", lambda: Product.objects.filter(pk=event.payload["id"]).first())
+
+    def resolve_low_stock_alert(event, info):
+        return event.load("instance", lambda: Product.objects.filter(pk=event.payload["id"]).first())
@@ -0,0 +1,134 @@
+"""Recency/frequency/monetary (RFM) segmentation of customers.
+
+Every hot and archived order is read once with ``values_list``, in chunks
+whose columns are converted to NumPy arrays in bulk; grouping per customer and quintile scoring are vectorised, so the
+refresh stays in the seconds range on millions of orders. Results replace
+the ``CustomerSegment`` table in one transaction.
+"""
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedOrder, Customer, CustomerSegment, Order
+
+SEGMENT_BATCH_SIZE = getattr(settings, "CUSTOMER_SEGMENT_BATCH_SIZE", 5000)
+SCORE_BINS = 5
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("Customer segmentation requires numpy (pip install numpy).")
+    return numpy
+
+
+def _epoch():
+    epoch = datetime(1970, 1, 1)
+    return epoch.replace(tzinfo=dt_timezone.utc) if settings.USE_TZ else epoch
+
+
+def load_orders(np):
+    """Return ``(customer_ids, seconds_since_epoch, amounts_in_cents)`` for every order."""
+    epoch = _epoch()
+    customers = [np.zeros(0, dtype=np.int64)]
+    seconds = [np.zeros(0, dtype=np.float64)]
+    cents = [np.zeros(0, dtype=np.int64)]
+    for model in (Order, ArchivedOrder):
+        rows = model.objects.values_list("customer_id", "order_date", "total_amount").iterator(
+            chunk_size=SEGMENT_BATCH_SIZE
+        )
+        while chunk := list(islice(rows, SEGMENT_BATCH_SIZE)):
+            customer_ids, dates, amounts = zip(*chunk)
+            customers.append(np.array(customer_ids, dtype=np.int64))
+            # numpy has no aware datetimes, but the differences to the epoch are plain timedeltas
+            elapsed = (np.array(dates, dtype=object) - epoch).astype("timedelta64[us]")
+            seconds.append(elapsed.astype(np.int64) / 1e6)
+            cents.append(np.rint(np.array(amounts, dtype=np.float64) * 100).astype(np.int64))
+    return np.concatenate(customers), np.concatenate(seconds), np.concatenate(cents)
+
+
+def quintile_scores(np, values):
+    """Score 1-5 by percentile rank; tied values share their mid rank, so share a score."""
+    if not len(values):
+        return np.zeros(0, dtype=np.int64)
+    ordered = np.sort(values)
+    mid_rank = np.searchsorted(ordered, values, side="left") + np.searchsorted(ordered, values, side="right")
+    return np.minimum(mid_rank * SCORE_BINS // (2 * len(values)) + 1, SCORE_BINS)
+
+
+def classify(np, recency, frequency, monetary):
+    return np.select(
+        [
+            (recency >= 4) & (frequency >= 4) & (monetary >= 4),
+            (recency >= 3) & (frequency >= 3),
+            recency >= 4,
+            frequency >= 3,
+            recency == 3,
+        ],
+        ["champion", "loyal", "promising", "at_risk", "needs_attention"],
+        default="hibernating",
+    )
+
+
+def compute_segments(now=None):
+    """Return a dict of column arrays, one row per customer with orders."""
+    np = _numpy()
+    now = ((now or timezone.now()) - _epoch()).total_seconds()
+    customers, timestamps, cents = load_orders(np)
+
+    ids, inverse = np.unique(customers, return_inverse=True)
+    frequency = np.bincount(inverse, minlength=len(ids))
+    monetary = np.bincount(inverse, weights=cents, minlength=len(ids)).astype(np.int64)
+    last_order = np.full(len(ids), -np.inf)
+    np.maximum.at(last_order, inverse, timestamps)
+    recency_days = np.maximum((now - last_order) // 86400, 0).astype(np.int64)
+
+    # Fewer days since the last order is better, so recency is scored on its negation
+    r_score = quintile_scores(np, -recency_days)
+    f_score = quintile_scores(np, frequency)
+    m_score = quintile_scores(np, monetary)
+    return {
+        "customer_id": ids,
+        "recency_days": recency_days,
+        "frequency": frequency,
+        "monetary_cents": monetary,
+        "recency_score": r_score,
+        "frequency_score": f_score,
+        "monetary_score": m_score,
+        "segment": classify(np, r_score, f_score, m_score),
+    }
+
+
+def _segment_rows(columns, prospects, computed_at):
+    names = list(columns)
+    for row in zip(*(columns[name].tolist() for name in names)):
+        values = dict(zip(names, row))
+        values["monetary"] = Decimal(values.pop("monetary_cents")) / 100
+        yield CustomerSegment(computed_at=computed_at, **values)
+    for customer_id in prospects.tolist():
+        yield CustomerSegment(customer_id=customer_id, segment="prospect", computed_at=computed_at)
+
+
+def refresh_segments(now=None):
+    """Recompute every customer's segment and swap the table contents; returns the row count."""
+    np = _numpy()
+    computed_at = now or timezone.now()
+    columns = compute_segments(computed_at)
+    customer_ids = np.fromiter(Customer.objects.values_list("pk", flat=True).iterator(), dtype=np.int64)
+    prospects = np.setdiff1d(customer_ids, columns["customer_id"], assume_unique=True)
+    # Orders of customers deleted since the read above would break the FK
+    known = np.isin(columns["customer_id"], customer_ids)
+    columns = {name: column[known] for name, column in columns.items()}
+
+    rows = _segment_rows(columns, prospects, computed_at)
+    with transaction.atomic():
+        # Nothing references segments and no signals listen to them, so this is one DELETE
+        CustomerSegment.objects.all().delete()
+        while batch := list(islice(rows, SEGMENT_BATCH_SIZE)):
+            CustomerSegment.objects.bulk_create(batch)
+    return len(columns["customer_id"]) + len(prospects)
@@ -47,13 +47,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'crm.middleware.TracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'crm.middleware.AdmissionControlMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'crm.middleware.ReadYourWritesMiddleware',
 ]
 
 ROOT_URLCONF = 'alx_backend_graphql_crm.urls'
@@ -83,6 +86,32 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    # A second SQLite file standing in for a read replica; unused unless listed
+    # in DATABASE_REPLICAS. The tests route to it to check replica routing.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_replica.sqlite3',
+    },
+}
+
+# Query operations read from one of these aliases, mutations use 'default'
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['crm.routers.PrimaryReplicaRouter']
+
+# Seconds a client keeps reading from the primary after a write
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# Shared by every process: catalog and orders versions, persisted queries,
+# idempotency keys and health probes all assume one cache for the deployment
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
     }
 }
 
@@ -129,8 +158,12 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 GRAPHENE = {
-    "SCHEMA": "alx_backend_graphql.schema.schema",
+    "SCHEMA": "graphql_crm.schema.schema",
     "ATOMIC_MUTATIONS": True,
+    "MIDDLEWARE": [
+        "crm.middleware.ReplicaRoutingMiddleware",
+        "crm.middleware.ResolverTracingMiddleware",
+    ],
 }
 
 CRONJOBS = [
@@ -150,4 +183,151 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'crm.tasks.generate_crm_report',
         'schedule': crontab(day_of_week='mon', hour=6, minute=0),
     },
-}
\ No newline at end of file
+    'archive-old-orders': {
+        'task': 'crm.tasks.archive_old_orders',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'refresh-total-counts': {
+        'task': 'crm.tasks.refresh_total_counts',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'export-analytics-snapshot': {
+        'task': 'crm.tasks.export_analytics_snapshot',
+        'schedule': crontab(hour=5, minute=0),
+    },
+    'refresh-customer-segments': {
+        'task': 'crm.tasks.refresh_customer_segments',
+        'schedule': crontab(minute=30),
+    },
+    'drain-outbox': {
+        'task': 'crm.celery.drain_outbox',
+        'schedule': 10.0,
+    },
+    'compact-outbox': {
+        'task': 'crm.celery.compact_outbox',
+        'schedule': crontab(minute=15),
+    },
+}
+
+# Maximum number of operations accepted in one batched /graphql POST
+GRAPHQL_MAX_BATCH_SIZE = 20
+
+# Edges per chunk when streaming allOrders/allCustomers as NDJSON
+GRAPHQL_STREAM_CHUNK_SIZE = 100
+
+# Broadcast backend feeding GraphQL subscriptions (see crm.broadcast)
+CRM_BROADCAST_BACKEND = "crm.broadcast.InMemoryBroadcast"
+CRM_BROADCAST_QUEUE_SIZE = 100
+
+# Orders older than this are moved to the archive tables, in batches
+ORDER_ARCHIVE_AFTER_DAYS = 365
+ORDER_ARCHIVE_BATCH_SIZE = 1000
+
+# totalCount: filtered connections count up to the cap ("capped") or use
+# planner estimates where available ("estimate"); totalCount(exact: true) opts out
+TOTAL_COUNT_STRATEGY = "capped"
+TOTAL_COUNT_CAP = 10000
+
+# Rows each table's counter is split over, so concurrent writers rarely share one
+ROW_COUNTER_SHARDS = 8
+
+# Country code assumed when normalizing local phone numbers (123-456-7890)
+PHONE_DEFAULT_COUNTRY_CODE = "1"
+
+# GraphQL endpoint used by the cron jobs and Celery tasks
+GRAPHQL_ENDPOINT = "http://localhost:8000/graphql"
+
+# SDL written by `manage.py build_schema_artifact`; when present, job clients
+# validate against it instead of introspecting the server on every run
+GRAPHQL_SCHEMA_ARTIFACT = BASE_DIR / 'schema.graphql'
+
+# Parsed and validated documents cached per process by the /graphql view
+GRAPHQL_DOCUMENT_CACHE_SIZE = 256
+
+# Columnar order snapshots written by `manage.py export_analytics_snapshot`
+# (Parquet when pyarrow is installed, memory-mappable .npy otherwise)
+ANALYTICS_EXPORT_DIR = BASE_DIR / 'analytics'
+
+# Rows per bulk insert when rebuilding the RFM customer segments
+CUSTOMER_SEGMENT_BATCH_SIZE = 5000
+
+# Seconds a topProducts ranking stays cached (new orders invalidate it sooner)
+TOP_PRODUCTS_CACHE_TIMEOUT = 300
+
+# Admission control for /graphql, per process (see crm.admission)
+ADMISSION_MAX_CONCURRENT = 16
+ADMISSION_RESERVED_FOR_MUTATIONS = 4
+ADMISSION_QUEUE_SIZE = 64
+ADMISSION_MAX_WAIT = 2.0
+ADMISSION_CLIENT_RATE = 20.0
+ADMISSION_CLIENT_BURST = 40
+ADMISSION_REPORT_FIELDS = ("topProducts", "allOrders")
+# Besides staff users, only these addresses may read /graphql/admission
+ADMISSION_STATE_ALLOWED_IPS = ("127.0.0.1", "::1")
+
+# Seconds a mutation response is replayed for retries carrying the same Idempotency-Key
+IDEMPOTENCY_TTL = 24 * 60 * 60
+# Cache alias holding the keys; it must be shared by every process
+IDEMPOTENCY_CACHE = "default"
+
+# Transactional outbox (see crm.outbox): handlers per event type, run by the
+# drain-outbox beat task; processed events are kept this many hours
+OUTBOX_HANDLERS = {
+    "order.created": ["crm.outbox.log_order_reminder"],
+    "product.stock_changed": ["crm.outbox.log_stock_change"],
+}
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_RETENTION_HOURS = 24
+# Failures after which an event is dead-lettered (failed_at set) instead of retried
+OUTBOX_MAX_ATTEMPTS = 10
+
+# Cron/Celery job logs (see crm.joblog): JSON lines, written in batches and
+# rotated at JOB_LOG_MAX_BYTES
+JOB_LOG_MAX_BYTES = 10 * 1024 * 1024
+JOB_LOG_BACKUP_COUNT = 5
+JOB_LOG_BATCH_SIZE = 200
+JOB_LOG_FLUSH_INTERVAL = 1.0
+
+# On-demand profiling (see crm.profiling); requests opt in with a signed
+# X-CRM-Profile header, tasks with a crm_profile message header
+CRM_PROFILING_ENABLED = False
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILE_RING_SIZE = 50
+CRM_PROFILE_TASKS = {}
+
+# GraphQL response encoder (see crm.encoding): "auto" uses orjson when it is
+# installed, otherwise "stdlib"
+GRAPHQL_JSON_ENCODER = "auto"
+
+# HTTP caching of GET queries (see crm.httpcache): root fields that may be
+# cached, with the models whose data version goes into their ETag
+HTTP_CACHE_FIELDS = {
+    "allProducts": ("crm.Product",),
+    "product": ("crm.Product",),
+    "hello": (),
+}
+HTTP_CACHE_CONTROL = "public, max-age=0, must-revalidate"
+HTTP_COMPRESS_MIN_BYTES = 1024
+PERSISTED_QUERY_TTL = 7 * 24 * 60 * 60
+# Cache alias holding persisted query hashes; it must be shared by every process
+PERSISTED_QUERY_CACHE = "default"
+
+# Tracing (see crm.tracing): spans for requests, GraphQL, SQL, tasks and cron
+# jobs, written as OTLP/JSON to TRACE_FILE and optionally sent to a collector
+TRACING_ENABLED = False
+TRACE_SAMPLE_RATIO = 0.1
+TRACE_FILE = "/tmp/crm_traces.jsonl"
+TRACE_OTLP_ENDPOINT = None
+TRACE_SERVICE_NAME = "crm"
+TRACE_SQL = True
+TRACE_SCALAR_RESOLVERS = False
+# Finished spans waiting for the exporter thread; more than this are dropped
+TRACE_QUEUE_SIZE = 8192
+
+# Health endpoints (see crm.health): /readyz results are reused for
+# HEALTH_CACHE_TTL seconds; the heartbeat cron job polls READINESS_URL
+READINESS_CHECKS = ("database", "cache", "broker", "replica_lag")
+HEALTH_CACHE_TTL = 5
+HEALTH_CHECK_TIMEOUT = 2
+HEALTH_MAX_REPLICA_LAG = 30
+READINESS_URL = "http://localhost:8000/readyz"
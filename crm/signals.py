@@ -0,0 +1,86 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .broadcast import LOW_STOCK_ALERT, ORDER_CREATED, PRODUCT_STOCK_CHANGED, get_broadcast
+from .catalog import bump_catalog_version
+from .counting import adjust_row_count
+from .models import ArchivedOrder, Customer, Order, Product
+from .rankings import bump_orders_version
+
+# Models whose RowCounter backs unfiltered totalCount
+COUNTED_MODELS = (Customer, Product, Order, ArchivedOrder)
+
+# Same threshold as ProductFilter.low_stock and UpdateLowStockProducts
+LOW_STOCK_THRESHOLD = 10
+
+
+def publish_on_commit(channel, payload):
+    broadcast = get_broadcast()
+    transaction.on_commit(lambda: broadcast.publish(channel, payload))
+
+
+@receiver(post_init, sender=Product)
+def remember_product_stock(sender, instance, **kwargs):
+    # Lets post_save tell whether stock actually changed without another query
+    instance._loaded_stock = instance.stock
+
+
+def publish_stock_change(product, previous):
+    """Publish a product's stock change on commit; for writes that skip post_save too."""
+    payload = {"id": product.pk, "stock": product.stock, "previous_stock": previous}
+    publish_on_commit(PRODUCT_STOCK_CHANGED, payload)
+    if product.stock < LOW_STOCK_THRESHOLD:
+        publish_on_commit(LOW_STOCK_ALERT, payload)
+
+
+@receiver(post_save, sender=Product)
+def publish_product_stock(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_loaded_stock", None)
+    instance._loaded_stock = instance.stock
+    if not created and previous != instance.stock:
+        publish_stock_change(instance, previous)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog(sender, instance, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Order)
+def publish_order_created(sender, instance, created, **kwargs):
+    # Published on commit, so the M2M products are in place when subscribers load it
+    if created:
+        publish_on_commit(ORDER_CREATED, {"id": instance.pk})
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_rankings(sender, instance, **kwargs):
+    if kwargs.get("created", True):
+        bump_orders_version()
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def invalidate_rankings_on_products(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        bump_orders_version()
+
+
+def count_created_row(sender, instance, created, **kwargs):
+    if created:
+        adjust_row_count(sender, 1)
+
+
+def count_deleted_row(sender, instance, **kwargs):
+    adjust_row_count(sender, -1)
+
+
+# Connected per model: a receiver without a sender listens to every model,
+# which stops QuerySet.delete() from fast-deleting any of them. Bulk deletes
+# of counted models (see crm.archive.archive_orders) skip these receivers and
+# adjust the counter once.
+for model in COUNTED_MODELS:
+    post_save.connect(count_created_row, sender=model)
+    post_delete.connect(count_deleted_row, sender=model)
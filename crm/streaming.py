@@ -0,0 +1,243 @@
+"""Incremental (NDJSON) delivery of large connection results.
+
+graphql-core 3.2 has no ``@stream``/``@defer`` support, so streaming is done
+one level up: every streamable root connection in a query is delivered in
+chunks of ``GRAPHQL_STREAM_CHUNK_SIZE`` edges, and each chunk is serialised and
+flushed as soon as it has been resolved. Payloads follow the shape of the
+incremental delivery proposal::
+
+    {"data": {...first chunk...}, "hasNext": true}
+    {"incremental": [{"items": [...edges...], "path": ["allOrders", "edges"]}], "hasNext": true}
+    ...
+    {"incremental": [...], "hasNext": false}
+
+The first chunk is an ordinary page. After it, each connection reads its rows
+from a single ``.iterator()`` over the resolved queryset (a ``RowStream``),
+so later chunks only run the edge selections on rows already being fetched,
+instead of re-running the query with a growing OFFSET.
+"""
+from collections import deque
+from functools import partial
+
+from django.conf import settings
+from graphene.relay.connection import connection_adapter, page_info_adapter
+from graphql import OperationType, execute, value_from_ast_untyped
+from graphql.language import ast
+from graphql_relay import connection_from_array_slice
+
+from .encoding import encode
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+STREAM_CHUNK_SIZE = getattr(settings, "GRAPHQL_STREAM_CHUNK_SIZE", 100)
+STREAMABLE_FIELDS = ("allOrders", "allCustomers")
+
+# Alias used to fetch paging state alongside the client's own selection
+PAGE_INFO_ALIAS = "_streamPageInfo"
+
+
+def _argument(name, value_node):
+    return ast.ArgumentNode(name=ast.NameNode(value=name), value=value_node)
+
+
+def _field(name, alias=None, selections=None):
+    return ast.FieldNode(
+        alias=ast.NameNode(value=alias) if alias else None,
+        name=ast.NameNode(value=name),
+        arguments=(),
+        directives=(),
+        selection_set=ast.SelectionSetNode(selections=tuple(selections)) if selections else None,
+    )
+
+
+class RowStream:
+    """One pass over a streamed connection's rows, shared by all of its chunks."""
+
+    def __init__(self):
+        self.rows = None
+        self.position = 0
+        self.lookahead = deque()
+
+    @property
+    def started(self):
+        return self.rows is not None
+
+    def start(self, iterable, position):
+        """Continue from row ``position`` of the queryset the first chunk was read from."""
+        rest = iterable[position:]
+        self.rows = rest.iterator(chunk_size=STREAM_CHUNK_SIZE) if hasattr(rest, "iterator") else iter(rest)
+        self.position = position
+
+    def take(self, count):
+        """Return up to ``count`` rows, plus one lookahead row if more follow."""
+        while len(self.lookahead) <= count:
+            try:
+                self.lookahead.append(next(self.rows))
+            except StopIteration:
+                break
+        rows = list(self.lookahead)
+        for _ in range(min(count, len(rows))):
+            self.lookahead.popleft()
+        return rows
+
+    def resolve_connection(self, connection, args):
+        first = args["first"]
+        rows = self.take(first)
+        resolved = connection_from_array_slice(
+            rows,
+            args,
+            slice_start=self.position,
+            array_length=self.position + len(rows),
+            array_slice_length=len(rows),
+            connection_type=partial(connection_adapter, connection),
+            edge_type=connection.Edge,
+            page_info_type=page_info_adapter,
+        )
+        self.position += min(first, len(rows))
+        return resolved
+
+    def close(self):
+        close = getattr(self.rows, "close", None)
+        if close is not None:
+            close()
+
+
+def get_row_stream(info):
+    """The RowStream of the root connection being resolved, if it is streamed."""
+    streams = getattr(info.context, "crm_row_streams", None)
+    if not streams or info.path.prev is not None:
+        return None
+    return streams.get(info.path.key)
+
+
+class StreamedField:
+    """Paging state for one root connection field of the operation."""
+
+    def __init__(self, field_node, variables):
+        self.node = field_node
+        self.key = field_node.alias.value if field_node.alias else field_node.name.value
+        self.cursor = None
+        self.remaining = None
+        self.stream = RowStream()
+
+        for argument in field_node.arguments:
+            value = value_from_ast_untyped(argument.value, variables)
+            if argument.name.value == "first" and value is not None:
+                self.remaining = int(value)
+            elif argument.name.value == "after":
+                self.cursor = value
+
+    @property
+    def done(self):
+        return self.remaining is not None and self.remaining <= 0
+
+    def next_chunk(self):
+        """Return a copy of the field node limited to the next chunk of edges.
+
+        Chunks after the first only carry ``edges``, the part that is delivered;
+        totalCount and the like are resolved once.
+        """
+        size = STREAM_CHUNK_SIZE if self.remaining is None else min(STREAM_CHUNK_SIZE, self.remaining)
+        arguments = [a for a in self.node.arguments if a.name.value not in ("first", "after")]
+        arguments.append(_argument("first", ast.IntValueNode(value=str(size))))
+        if self.cursor:
+            arguments.append(_argument("after", ast.StringValueNode(value=self.cursor)))
+
+        page_info = _field("pageInfo", alias=PAGE_INFO_ALIAS, selections=[
+            _field("endCursor"), _field("hasNextPage"),
+        ])
+        selections = tuple(self.node.selection_set.selections)
+        if self.stream.started and all(isinstance(s, ast.FieldNode) for s in selections):
+            selections = tuple(s for s in selections if s.name.value == "edges")
+        return ast.FieldNode(
+            alias=self.node.alias,
+            name=self.node.name,
+            arguments=tuple(arguments),
+            directives=self.node.directives,
+            selection_set=ast.SelectionSetNode(selections=selections + (page_info,)),
+        )
+
+    def advance(self, connection):
+        """Consume the paging info of a resolved chunk; return True if more remain."""
+        page_info = connection.pop(PAGE_INFO_ALIAS, None) or {}
+        if self.remaining is not None:
+            self.remaining -= len(connection.get("edges") or [])
+        self.cursor = page_info.get("endCursor")
+        return bool(page_info.get("hasNextPage")) and bool(self.cursor) and not self.done
+
+
+def get_streamed_fields(operation_ast, variables):
+    """Return the root connection fields of a query that can be streamed."""
+    if operation_ast is None or operation_ast.operation != OperationType.QUERY:
+        return []
+
+    fields = []
+    for selection in operation_ast.selection_set.selections:
+        if not isinstance(selection, ast.FieldNode) or selection.name.value not in STREAMABLE_FIELDS:
+            continue
+        # Backward pagination cannot be streamed front to back, nor offsets from one cursor
+        if any(a.name.value in ("last", "before", "offset") for a in selection.arguments):
+            continue
+        fields.append(StreamedField(selection, variables))
+    return fields
+
+
+def _with_selections(document, operation_ast, selections):
+    operation = ast.OperationDefinitionNode(
+        operation=operation_ast.operation,
+        name=operation_ast.name,
+        variable_definitions=operation_ast.variable_definitions,
+        directives=operation_ast.directives,
+        selection_set=ast.SelectionSetNode(selections=tuple(selections)),
+    )
+    fragments = [d for d in document.definitions if isinstance(d, ast.FragmentDefinitionNode)]
+    return ast.DocumentNode(definitions=(operation, *fragments))
+
+
+def stream_payloads(schema, document, operation_ast, streamed, execute_options):
+    """Yield incremental payloads for an already validated query document."""
+    execute_options["context_value"].crm_row_streams = {field.key: field.stream for field in streamed}
+    try:
+        yield from _stream_payloads(schema, document, operation_ast, streamed, execute_options)
+    finally:
+        for field in streamed:
+            field.stream.close()
+
+
+def _stream_payloads(schema, document, operation_ast, streamed, execute_options):
+    streamed_by_node = {id(field.node): field for field in streamed}
+    selections = [
+        streamed_by_node[id(s)].next_chunk() if id(s) in streamed_by_node else s
+        for s in operation_ast.selection_set.selections
+    ]
+    result = execute(schema, _with_selections(document, operation_ast, selections), **execute_options)
+
+    pending = []
+    for field in streamed:
+        connection = (result.data or {}).get(field.key)
+        if connection is not None and field.advance(connection):
+            pending.append(field)
+
+    payload = {"data": result.data, "hasNext": bool(pending)}
+    if result.errors:
+        payload["errors"] = [error.formatted for error in result.errors]
+    yield payload
+
+    while pending:
+        field = pending[0]
+        chunk = execute(schema, _with_selections(document, operation_ast, [field.next_chunk()]), **execute_options)
+        connection = (chunk.data or {}).get(field.key) or {}
+        if not field.advance(connection) or chunk.errors:
+            pending.pop(0)
+
+        incremental = {"items": connection.get("edges") or [], "path": [field.key, "edges"]}
+        if chunk.errors:
+            incremental["errors"] = [error.formatted for error in chunk.errors]
+        yield {"incremental": [incremental], "hasNext": bool(pending)}
+
+
+def encode_ndjson(payloads):
+    try:
+        for payload in payloads:
+            yield encode(payload) + b"\n"
+    finally:
+        payloads.close()
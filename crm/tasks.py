@@ -1,61 +1,81 @@
-import datetime
+from decimal import Decimal
+
 from celery import shared_task
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
-from datetime import datetime
-import requests
 
-GRAPHQL_ENDPOINT = "http://localhost:8000/graphql"
+from .analytics import export_snapshot
+from .archive import archive_orders
+from .counting import refresh_row_counts
+from .graphql_client import get_client, gql
+from .joblog import get_job_logger, job_run
+from .segments import refresh_segments
+from .signals import COUNTED_MODELS
+
 LOG_FILE = "/tmp/crm_report_log.txt"
 
 @shared_task
 def generate_crm_report():
     """Fetch CRM stats via GraphQL and log them."""
-    # Setup GraphQL client
-    transport = RequestsHTTPTransport(
-        url=GRAPHQL_ENDPOINT,
-        verify=True,
-        retries=3,
-    )
-    client = Client(transport=transport, fetch_schema_from_transport=True)
-
-    # GraphQL query to fetch total customers, orders, and revenue
-    query = gql("""
-        query {
-            totalCustomers: allCustomers {
-                totalCount
-            }
-            totalOrders: allOrders {
-                totalCount
-                edges {
-                    node {
-                        totalAmount
+    with job_run(get_job_logger(LOG_FILE), "generate_crm_report") as log:
+        # Setup GraphQL client
+        client = get_client()
+
+        # GraphQL query to fetch total customers, orders, and revenue
+        query = gql("""
+            query {
+                totalCustomers: allCustomers {
+                    totalCount
+                }
+                totalOrders: allOrders {
+                    totalCount
+                    edges {
+                        node {
+                            totalAmount
+                        }
                     }
                 }
             }
-        }
-    """)
+        """)
 
-    try:
-        result = client.execute(query)
+        try:
+            result = client.execute(query)
 
-        # Total customers
-        total_customers = result.get("totalCustomers", {}).get("totalCount", 0)
+            # Total customers
+            total_customers = result.get("totalCustomers", {}).get("totalCount", 0)
 
-        # Total orders
-        total_orders = result.get("totalOrders", {}).get("totalCount", 0)
+            # Total orders
+            total_orders = result.get("totalOrders", {}).get("totalCount", 0)
 
-        # Total revenue
-        edges = result.get("totalOrders", {}).get("edges", [])
-        total_revenue = sum(edge["node"]["totalAmount"] for edge in edges)
+            # Total revenue
+            edges = result.get("totalOrders", {}).get("edges", [])
+            total_revenue = sum((Decimal(edge["node"]["totalAmount"]) for edge in edges), Decimal("0.00"))
 
-        # Log report
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"{timestamp} - Report: {total_customers} customers, {total_orders} orders, {total_revenue} revenue\n"
-        with open(LOG_FILE, "a") as f:
-            f.write(log_entry)
+            log.info("Report", extra={
+                "customers": total_customers, "orders": total_orders, "revenue": str(total_revenue),
+            })
+
+        except Exception as e:
+            log.error("Error generating report", extra={"error": str(e)})
+
+
+@shared_task
+def archive_old_orders():
+    """Move orders older than ORDER_ARCHIVE_AFTER_DAYS into the archive tables."""
+    return archive_orders()
 
-    except Exception as e:
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open(LOG_FILE, "a") as f:
-            f.write(f"{timestamp} - Error generating report: {e}\n")
+
+@shared_task
+def refresh_total_counts():
+    """Recount the tables behind unfiltered totalCount, correcting any drift."""
+    refresh_row_counts(COUNTED_MODELS)
+
+
+@shared_task
+def export_analytics_snapshot():
+    """Write order months changed since the last run to ANALYTICS_EXPORT_DIR."""
+    return export_snapshot()
+
+
+@shared_task
+def refresh_customer_segments():
+    """Rebuild the RFM segment of every customer."""
+    return refresh_segments()
@@ -1,3 +1,1471 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import hashlib
+import importlib
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock, skipIf
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from graphql_relay import to_global_id
+
+from graphql_crm.schema import schema
+
+from .analytics import export_snapshot, load_table
+from .archive import OrderHistory, archive_cutoff, archive_orders, reaches_archive
+from .broadcast import ORDER_CREATED, Event, InMemoryBroadcast, get_broadcast
+from .catalog import VERSION_KEY, get_catalog, get_catalog_version
+from .counting import ROW_COUNTER_SHARDS, get_row_count, refresh_row_counts
+from .importing import UPDATE, import_rows, read_rows
+from .models import ArchivedOrder, Customer, CustomerSegment, Order, OutboxEvent, Product, RowCounter, normalize_phone
+from .rankings import UNITS, compute_top_products, top_products
+from .segments import load_orders, refresh_segments
+from .routers import PrimaryReplicaRouter, begin_request, end_request
+from . import admission, encoding, graphql_client, health, httpcache, idempotency, loadtest, outbox, profiling, tasks, tracing, views
+from .middleware import AdmissionControlMiddleware, ReadYourWritesMiddleware
+from .views import MAX_BATCH_SIZE, FastJSONGraphQLView, admission_state, readyz
+from .websocket import PROTOCOL, GraphQLWebSocketApp
+
+
+def execute(query, variables=None, request=None):
+    result = schema.execute(query, variables=variables, context_value=request or RequestFactory().get("/graphql"))
+    if result.errors:
+        raise result.errors[0]
+    return result.data
+
+
+def post_graphql(body, **headers):
+    request = RequestFactory().post("/graphql", json.dumps(body), content_type="application/json", **headers)
+    return FastJSONGraphQLView.as_view(schema=schema)(request)
+
+
+# The tests run without Redis; every process-shared value lives in one LocMem cache
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CRMTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(name="Alice", email="alice@example.com", phone="+233241234567")
+        cls.product = Product.objects.create(name="Laptop", price=Decimal("999.99"), stock=5)
+
+    def create_order(self, total, days_ago=0, **kwargs):
+        order = Order.objects.create(
+            customer=self.customer, total_amount=Decimal(total),
+            order_date=timezone.now() - datetime.timedelta(days=days_ago), **kwargs,
+        )
+        order.products.add(self.product)
+        return order
+
+    def create_archived_order(self, pk, total, days_ago):
+        order = ArchivedOrder.objects.create(
+            pk=pk, customer=self.customer, total_amount=Decimal(total),
+            order_date=timezone.now() - datetime.timedelta(days=days_ago),
+        )
+        order.products.add(self.product)
+        return order
+
+
+# ----------------------
+# Batched operations
+# ----------------------
+class BatchTests(CRMTestCase):
+    def test_batch_runs_every_operation_in_order(self):
+        response = post_graphql([
+            {"query": "{ hello }"},
+            {"query": "query Stock($id: ID!) { product(id: $id) { name } }",
+             "variables": {"id": to_global_id("ProductNode", self.product.pk)}},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result["data"] for result in json.loads(response.content)], [
+            {"hello": "Hello, GraphQL!"},
+            {"product": {"name": "Laptop"}},
+        ])
+
+    def test_single_operation_is_not_wrapped(self):
+        response = post_graphql({"query": "{ hello }"})
+        self.assertEqual(json.loads(response.content), {"data": {"hello": "Hello, GraphQL!"}})
+
+    def test_bad_entries_fail_alone(self):
+        response = post_graphql([
+            {"query": "{ hello }"},
+            {"id": "no-query"},
+            {"query": "{ hello }", "variables": "{not json"},
+            {"query": "{ hello }"},
+        ])
+        results = json.loads(response.content)
+        self.assertEqual([result.get("data") for result in results], [{"hello": "Hello, GraphQL!"}, None, None, {"hello": "Hello, GraphQL!"}])
+        self.assertEqual(results[1]["errors"], [{"message": "Must provide query string."}])
+        self.assertEqual(results[1]["id"], "no-query")
+        self.assertEqual(results[2]["status"], 400)
+
+    def test_invalid_batches_are_rejected(self):
+        for body in ([], [{"query": "{ hello }"}] * (MAX_BATCH_SIZE + 1), [{"query": "{ hello }"}, "{ hello }"]):
+            with self.subTest(size=len(body)):
+                self.assertEqual(post_graphql(body).status_code, 400)
+
+
+# ----------------------
+# Document cache
+# ----------------------
+class DocumentCacheTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        views.parse_document.cache_clear()
+        views._validate_query.cache_clear()
+
+    def test_repeated_queries_are_parsed_and_validated_once(self):
+        with mock.patch("crm.views.parse", wraps=views.parse) as parse, \
+                mock.patch("crm.views.validate", wraps=views.validate) as validate:
+            for _ in range(3):
+                self.assertEqual(json.loads(post_graphql({"query": "{ hello }"}).content)["data"], {"hello": "Hello, GraphQL!"})
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(validate.call_count, 1)
+
+    def test_other_views_keep_the_stock_parser(self):
+        import graphene_django.views
+        import graphql
+
+        self.assertIs(graphene_django.views.parse, graphql.parse)
+        self.assertIs(graphene_django.views.validate, graphql.validate)
+
+    def test_get_cannot_run_mutations(self):
+        request = RequestFactory().get("/graphql", {"query": "mutation { updateLowStockProducts { message } }"})
+        response = FastJSONGraphQLView.as_view(schema=schema)(request)
+        self.assertEqual(response.status_code, 405)
+
+    def test_errors_match_the_stock_view(self):
+        response = post_graphql({"query": "{ hello"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Syntax Error", json.loads(response.content)["errors"][0]["message"])
+        response = post_graphql({"query": "{ nope }"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("nope", json.loads(response.content)["errors"][0]["message"])
+
+    def test_mutations_are_flagged_once_validated(self):
+        request = RequestFactory().post("/graphql")
+        view = FastJSONGraphQLView(schema=schema)
+        view.execute_graphql_request(request, {}, "mutation { nope }", None, None)
+        self.assertFalse(getattr(request, "executed_mutation", False))
+        result = view.execute_graphql_request(request, {}, "mutation { updateLowStockProducts { message } }", None, None)
+        self.assertIsNone(result.errors)
+        self.assertTrue(request.executed_mutation)
+        self.assertFalse(request.graphql_errors)
+
+
+# ----------------------
+# NDJSON streaming
+# ----------------------
+class StreamingTests(CRMTestCase):
+    query = "{ allCustomers(first: 6) { totalCount edges { cursor node { name } } } }"
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Customer.objects.bulk_create(
+            Customer(name=f"Customer {i}", email=f"customer{i}@example.com") for i in range(7)
+        )
+
+    def stream(self, query):
+        response = post_graphql({"query": query}, HTTP_ACCEPT="application/x-ndjson")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        body = b"".join(response.streaming_content)
+        self.assertTrue(body.endswith(b"\n"))
+        return [json.loads(line) for line in body.splitlines()]
+
+    @mock.patch("crm.streaming.STREAM_CHUNK_SIZE", 2)
+    def test_chunks_are_framed_as_ndjson(self):
+        payloads = self.stream(self.query)
+        self.assertEqual([payload["hasNext"] for payload in payloads], [True, True, False])
+        first = payloads[0]["data"]["allCustomers"]
+        self.assertEqual(first["totalCount"], 8)
+        self.assertNotIn("_streamPageInfo", first)
+        edges = first["edges"]
+        for payload in payloads[1:]:
+            (incremental,) = payload["incremental"]
+            self.assertEqual(incremental["path"], ["allCustomers", "edges"])
+            edges += incremental["items"]
+        self.assertEqual([edge["node"]["name"] for edge in edges], ["Alice"] + [f"Customer {i}" for i in range(5)])
+        expected_cursors = [
+            execute("{ allCustomers(first: 6) { edges { cursor } } }")["allCustomers"]["edges"][i]["cursor"]
+            for i in range(6)
+        ]
+        self.assertEqual([edge["cursor"] for edge in edges], expected_cursors)
+
+    @mock.patch("crm.streaming.STREAM_CHUNK_SIZE", 3)
+    def test_stream_reads_rows_once(self):
+        # One query for the first page, then a single iterator for the rest
+        with self.assertNumQueries(2):
+            payloads = self.stream("{ allCustomers { edges { node { email } } } }")
+        self.assertEqual(len(payloads), 3)
+        self.assertFalse(payloads[-1]["hasNext"])
+        self.assertEqual(len(payloads[-1]["incremental"][0]["items"]), 2)
+
+
+# ----------------------
+# Subscriptions
+# ----------------------
+class FakeSocket:
+    def __init__(self, *messages):
+        self.incoming = asyncio.Queue()
+        self.sent = asyncio.Queue()
+        for message in messages:
+            self.incoming.put_nowait(message)
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send(self, message):
+        await self.sent.put(message)
+
+    async def next_json(self):
+        message = await asyncio.wait_for(self.sent.get(), timeout=5)
+        return json.loads(message["text"])
+
+
+class SubscriptionTests(CRMTestCase):
+    query = "subscription { orderCreated { totalAmount customer { name } } }"
+
+    def test_asgi_application_serves_the_subscription_schema(self):
+        asgi = importlib.import_module("alx_backend_graphql_crm.asgi")
+        subscription_type = asgi.websocket_application.schema.subscription_type
+        self.assertIn("orderCreated", subscription_type.fields)
+
+    def test_broadcast_fans_out_to_every_subscriber(self):
+        async def run():
+            broadcast = InMemoryBroadcast(queue_size=2)
+            first, second = broadcast.subscribe("channel"), broadcast.subscribe("channel")
+            first_next, second_next = first.__anext__(), second.__anext__()
+            waiting = asyncio.gather(first_next, second_next)
+            await asyncio.sleep(0)
+            self.assertEqual(broadcast.subscriber_count("channel"), 2)
+            broadcast.publish("channel", {"id": 1})
+            events = await waiting
+            self.assertIs(events[0], events[1])
+            # A slow subscriber keeps the newest events only
+            for i in range(2, 5):
+                broadcast.publish("channel", {"id": i})
+            self.assertEqual([(await first.__anext__()).payload["id"] for _ in range(2)], [3, 4])
+            await first.aclose()
+            await second.aclose()
+            self.assertEqual(broadcast.subscriber_count(), 0)
+
+        async_to_sync(run)()
+
+    def test_event_loads_once(self):
+        event = Event(ORDER_CREATED, {"id": 1})
+        loads = []
+        for _ in range(3):
+            event.load("instance", lambda: loads.append(1) or "order")
+        self.assertEqual(loads, [1])
+
+    def test_subscribers_share_one_execution_per_event(self):
+        order = self.create_order("120.00")
+
+        async def run():
+            app = GraphQLWebSocketApp(schema)
+            sockets = [
+                FakeSocket(
+                    {"type": "websocket.connect"},
+                    {"type": "websocket.receive", "text": json.dumps({"type": "connection_init"})},
+                    {"type": "websocket.receive", "text": json.dumps(
+                        {"type": "subscribe", "id": "1", "payload": {"query": self.query}}
+                    )},
+                )
+                for _ in range(2)
+            ]
+            tasks = [
+                asyncio.ensure_future(app({"type": "websocket", "subprotocols": [PROTOCOL]}, s.receive, s.send))
+                for s in sockets
+            ]
+            for socket in sockets:
+                self.assertEqual((await socket.sent.get())["subprotocol"], PROTOCOL)
+                self.assertEqual(await socket.next_json(), {"type": "connection_ack"})
+            while get_broadcast().subscriber_count(ORDER_CREATED) < 2:
+                await asyncio.sleep(0.01)
+
+            get_broadcast().publish(ORDER_CREATED, {"id": order.pk})
+            messages = [await socket.next_json() for socket in sockets]
+
+            for socket in sockets:
+                socket.incoming.put_nowait({"type": "websocket.disconnect"})
+            await asyncio.gather(*tasks)
+            while get_broadcast().subscriber_count(ORDER_CREATED):
+                await asyncio.sleep(0.01)
+            return messages
+
+        # One query loads the order (with its customer) for both subscribers
+        with self.assertNumQueries(1):
+            messages = async_to_sync(run)()
+        for message in messages:
+            self.assertEqual(message, {"type": "next", "id": "1", "payload": {
+                "data": {"orderCreated": {"totalAmount": "120.00", "customer": {"name": "Alice"}}},
+            }})
+
+
+# ----------------------
+# Replica routing
+# ----------------------
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTests(CRMTestCase):
+    # "replica" is a second SQLite database that only holds what a test puts there
+    databases = {"default", "replica"}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Customer.objects.using("replica").create(name="Replica only", email="replica@example.com")
+
+    def names(self):
+        data = execute("{ allCustomers { edges { node { name } } } }")
+        return [edge["node"]["name"] for edge in data["allCustomers"]["edges"]]
+
+    def test_queries_read_from_the_replica(self):
+        state, token = begin_request()
+        try:
+            self.assertEqual(self.names(), ["Replica only"])
+        finally:
+            end_request(token)
+        self.assertEqual(state.replica, "replica")
+
+    def test_writes_pin_the_rest_of_the_request_to_the_primary(self):
+        state, token = begin_request()
+        try:
+            Customer.objects.create(name="Bob", email="bob@example.com")
+            self.assertEqual(self.names(), ["Alice", "Bob"])
+        finally:
+            end_request(token)
+
+    def test_one_replica_per_request(self):
+        router = PrimaryReplicaRouter()
+        with override_settings(DATABASE_REPLICAS=["replica", "default"]):
+            for _ in range(5):
+                state, token = begin_request()
+                try:
+                    self.assertEqual(len({router.db_for_read(Customer) for _ in range(20)}), 1)
+                finally:
+                    end_request(token)
+
+    def test_streamed_responses_keep_the_request_routing(self):
+        router = PrimaryReplicaRouter()
+
+        def view(request, write):
+            if write:
+                router.db_for_write(Customer)
+            return StreamingHttpResponse(router.db_for_read(Customer) for _ in range(20))
+
+        with override_settings(DATABASE_REPLICAS=["replica", "default"]):
+            for write in (False, True):
+                middleware = ReadYourWritesMiddleware(lambda request: view(request, write))
+                response = middleware(RequestFactory().get("/graphql"))
+                aliases = {chunk.decode() for chunk in response.streaming_content}
+                self.assertEqual(len(aliases), 1)
+                if write:
+                    self.assertEqual(aliases, {"default"})
+
+    def test_related_reads_follow_the_instance(self):
+        order = self.create_order("10.00")
+        # Outside any request too: the order was written to the primary
+        self.assertEqual([product.name for product in order.products.all()], ["Laptop"])
+        self.assertEqual(order.customer.name, "Alice")
+        replica_customer = Customer.objects.get(email="replica@example.com")
+        self.assertEqual(replica_customer._state.db, "replica")
+        self.assertEqual(list(replica_customer.orders.all()), [])
+
+
+# ----------------------
+# totalCount
+# ----------------------
+class CountingTests(CRMTestCase):
+    def test_counter_is_split_over_shards(self):
+        self.assertEqual(get_row_count(Customer), 1)
+        self.assertEqual(RowCounter.objects.filter(table="crm.Customer").count(), ROW_COUNTER_SHARDS)
+        for i in range(20):
+            Customer.objects.create(name=f"Customer {i}", email=f"customer{i}@example.com")
+        Customer.objects.filter(email="customer0@example.com").delete()
+        self.assertEqual(get_row_count(Customer), 20)
+        self.assertGreater(RowCounter.objects.filter(table="crm.Customer", rows__gt=0).count(), 1)
+
+    def test_refresh_corrects_drift(self):
+        get_row_count(Customer)
+        Customer.objects.bulk_create(Customer(name="Bulk", email=f"bulk{i}@example.com") for i in range(3))
+        self.assertEqual(get_row_count(Customer), 1)
+        refresh_row_counts([Customer])
+        self.assertEqual(get_row_count(Customer), 4)
+
+    def test_total_count(self):
+        Customer.objects.create(name="Bob", email="bob@example.com")
+        data = execute("""{
+            all: allCustomers { totalCount totalCountIsExact }
+            filtered: allCustomers(name: "bo") { totalCount totalCountIsExact }
+            exact: allCustomers(name: "bo") { totalCount(exact: true) }
+        }""")
+        self.assertEqual(data["all"], {"totalCount": 2, "totalCountIsExact": True})
+        self.assertEqual(data["filtered"], {"totalCount": 1, "totalCountIsExact": True})
+        self.assertEqual(data["exact"], {"totalCount": 1})
+
+
+# ----------------------
+# Product catalog
+# ----------------------
+class CatalogTests(CRMTestCase):
+    def test_snapshot_follows_product_saves(self):
+        self.assertEqual(get_catalog().get(self.product.pk).stock, 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(stock=7)
+        # update() sends no signals, so writers that use it must bump the version
+        self.assertEqual(get_catalog().get(self.product.pk).stock, 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.stock = 9
+            self.product.save()
+        self.assertEqual(get_catalog().get(self.product.pk).stock, 9)
+
+    def test_bulk_import_bumps_the_version(self):
+        get_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            list(import_rows("products", [(2, {"name": "Mouse", "price": "25.00", "stock": "3"})]))
+        self.assertEqual([entry.name for entry in get_catalog().entries.values()], ["Laptop", "Mouse"])
+
+    def test_update_low_stock_products_bumps_the_version(self):
+        get_catalog()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            data = execute("mutation { updateLowStockProducts { success updatedProducts { stock } } }")
+        self.assertEqual(data["updateLowStockProducts"]["updatedProducts"], [{"stock": 15}])
+        self.assertEqual(get_catalog().get(self.product.pk).stock, 15)
+        # One version bump and the stock broadcast, not one bump per product
+        self.assertEqual(len(callbacks), 2)
+
+    def test_create_order_prices_from_the_snapshot(self):
+        mutation = """mutation($customer: ID!, $products: [ID]!) {
+            createOrder(customerId: $customer, productIds: $products) { order { totalAmount } message }
+        }"""
+        variables = {"customer": to_global_id("CustomerNode", self.customer.pk), "products": [str(self.product.pk)]}
+        get_catalog()
+        with CaptureQueriesContext(connection) as queries:
+            data = execute(mutation, variables)["createOrder"]
+        self.assertEqual(data, {"order": {"totalAmount": "999.99"}, "message": "Order created successfully"})
+        self.assertFalse([q for q in queries.captured_queries if q["sql"].startswith('SELECT "crm_product"')])
+        self.assertEqual(list(Order.objects.get().products.all()), [self.product])
+
+        event = OutboxEvent.objects.get(event_type="order.created")
+        self.assertEqual(event.aggregate_id, Order.objects.get().pk)
+
+        variables["products"] = [str(self.product.pk), "424242"]
+        with self.assertRaisesMessage(Exception, "One or more product IDs are invalid"):
+            execute(mutation, variables)
+
+    def test_version_survives_eviction(self):
+        version = get_catalog_version()
+        self.assertGreater(version, 1)
+        cache.delete(VERSION_KEY)
+        self.assertNotEqual(get_catalog_version(), version)
+
+
+# ----------------------
+# Multi-node fetch
+# ----------------------
+class NodesTests(CRMTestCase):
+    query = "query($ids: [ID!]!) { nodes(ids: $ids) { id ... on CustomerNode { name } ... on OrderNode { totalAmount } } }"
+
+    def test_nodes_come_back_in_input_order(self):
+        orders = [self.create_order("10.00"), self.create_order("20.00")]
+        archived = self.create_archived_order(900001, "5.00", days_ago=400)
+        ids = [
+            to_global_id("OrderNode", orders[1].pk),
+            to_global_id("CustomerNode", self.customer.pk),
+            "not-an-id",
+            to_global_id("OrderNode", archived.pk),
+            to_global_id("OrderNode", 424242),
+            to_global_id("OrderNode", orders[0].pk),
+        ]
+        # One query per type, plus one for the orders missing from the hot table
+        with self.assertNumQueries(3):
+            nodes = execute(self.query, {"ids": ids})["nodes"]
+        self.assertEqual(nodes, [
+            {"id": ids[0], "totalAmount": "20.00"},
+            {"id": ids[1], "name": "Alice"},
+            None,
+            {"id": ids[3], "totalAmount": "5.00"},
+            None,
+            {"id": ids[5], "totalAmount": "10.00"},
+        ])
+
+    def test_products_come_from_the_catalog(self):
+        get_catalog()
+        with self.assertNumQueries(0):
+            nodes = execute("query($ids: [ID!]!) { nodes(ids: $ids) { ... on ProductNode { name } } }", {
+                "ids": [to_global_id("ProductNode", self.product.pk), to_global_id("ProductNode", 0)],
+            })["nodes"]
+        self.assertEqual(nodes, [{"name": "Laptop"}, None])
+
+
+# ----------------------
+# Order archive
+# ----------------------
+class OrderArchiveTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_order("50.00", days_ago=1)
+        self.create_order("300.00", days_ago=2)
+        self.create_archived_order(900001, "200.00", days_ago=400)
+        self.create_archived_order(900002, "10.00", days_ago=500)
+
+    def history(self, *ordering):
+        return OrderHistory(Order.objects.all(), ArchivedOrder.objects.all(), ordering)
+
+    def test_reaches_archive(self):
+        cutoff = archive_cutoff().date()
+        self.assertTrue(reaches_archive())
+        self.assertTrue(reaches_archive(cutoff - datetime.timedelta(days=1)))
+        self.assertFalse(reaches_archive(cutoff + datetime.timedelta(days=1)))
+        self.assertTrue(reaches_archive(None, cutoff - datetime.timedelta(days=30)))
+        self.assertFalse(reaches_archive(cutoff - datetime.timedelta(days=1), cutoff - datetime.timedelta(days=2)))
+
+    def test_history_is_in_global_order_across_partitions(self):
+        totals = [order.total_amount for order in self.history("-total_amount")]
+        self.assertEqual(totals, [Decimal("300.00"), Decimal("200.00"), Decimal("50.00"), Decimal("10.00")])
+        dates = [order.order_date for order in self.history("order_date")]
+        self.assertEqual(dates, sorted(dates))
+
+    def test_history_slices_without_counting(self):
+        history = self.history("-total_amount")
+        with self.assertNumQueries(2):
+            page = list(history[1:3])
+        self.assertEqual([order.total_amount for order in page], [Decimal("200.00"), Decimal("50.00")])
+        self.assertEqual([order.total_amount for order in history[3:]], [Decimal("10.00")])
+
+    def test_history_orders_on_related_fields(self):
+        history = self.history("customer__name", "-order_date")
+        with self.assertNumQueries(2):
+            dates = [order.order_date for order in history[:4] if order.customer.name]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_history_rejects_many_valued_orderings(self):
+        with self.assertRaises(ValueError):
+            self.history("products__name")
+
+    def test_all_orders_merges_partitions(self):
+        data = execute('{ allOrders(orderBy: ["-total_amount"], first: 3) { edges { node { totalAmount } } } }')
+        totals = [edge["node"]["totalAmount"] for edge in data["allOrders"]["edges"]]
+        self.assertEqual(totals, ["300.00", "200.00", "50.00"])
+
+    def test_all_orders_pages_backward_across_partitions(self):
+        data = execute('{ allOrders(orderBy: ["-total_amount"], last: 2) { edges { node { totalAmount } } } }')
+        totals = [edge["node"]["totalAmount"] for edge in data["allOrders"]["edges"]]
+        self.assertEqual(totals, ["50.00", "10.00"])
+
+    @mock.patch("crm.streaming.STREAM_CHUNK_SIZE", 1)
+    def test_all_orders_streams_across_partitions(self):
+        response = post_graphql(
+            {"query": '{ allOrders(orderBy: ["-total_amount"]) { edges { node { totalAmount } } } }'},
+            HTTP_ACCEPT="application/x-ndjson",
+        )
+        payloads = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        edges = payloads[0]["data"]["allOrders"]["edges"]
+        edges += [item for payload in payloads[1:] for item in payload["incremental"][0]["items"]]
+        self.assertEqual([edge["node"]["totalAmount"] for edge in edges], ["300.00", "200.00", "50.00", "10.00"])
+
+    def test_archive_orders_moves_old_orders(self):
+        old = self.create_order("75.00", days_ago=500)
+        self.assertEqual(get_row_count(Order), 3)
+        self.assertEqual(archive_orders(), 1)
+        self.assertFalse(Order.objects.filter(pk=old.pk).exists())
+        self.assertFalse(Order.products.through.objects.filter(order_id=old.pk).exists())
+        archived = ArchivedOrder.objects.get(pk=old.pk)
+        self.assertEqual([product.pk for product in archived.products.all()], [self.product.pk])
+        self.assertEqual(get_row_count(Order), 2)
+        self.assertEqual(get_row_count(ArchivedOrder), 3)
+
+    def test_archive_orders_deletes_in_bulk(self):
+        for _ in range(5):
+            self.create_order("75.00", days_ago=500)
+        refresh_row_counts([Order, ArchivedOrder])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(archive_orders(), 5)
+        statements = [query["sql"] for query in queries.captured_queries]
+        self.assertEqual(len([sql for sql in statements if sql.startswith('DELETE FROM "crm_order"')]), 1)
+        self.assertEqual(len([sql for sql in statements if sql.startswith('UPDATE "crm_rowcounter"')]), 2)
+        self.assertEqual(get_row_count(Order), 2)
+
+    def test_all_orders_skips_archive_for_recent_windows(self):
+        since = (archive_cutoff() + datetime.timedelta(days=1)).date().isoformat()
+        data = execute(
+            'query($since: Date) { allOrders(orderDate_Gte: $since) { edges { node { totalAmount } } } }',
+            {"since": since},
+        )
+        self.assertEqual(len(data["allOrders"]["edges"]), 2)
+
+
+# ----------------------
+# Normalized phones
+# ----------------------
+class PhoneTests(CRMTestCase):
+    def phone_matches(self, pattern):
+        data = execute(
+            'query($p: String) { allCustomers(phonePattern: $p) { edges { node { name } } } }', {"p": pattern},
+        )
+        return [edge["node"]["name"] for edge in data["allCustomers"]["edges"]]
+
+    def test_longest_phones_fit(self):
+        # 20 digits without "+" gain the default country code
+        phone = "1" * 20
+        customer = Customer.objects.create(name="Bob", email="bob@example.com", phone=phone)
+        customer.refresh_from_db()
+        self.assertEqual(customer.phone_normalized, normalize_phone(phone))
+        self.assertEqual(len(customer.phone_normalized), 22)
+
+    def test_phone_pattern_matches_prefixes(self):
+        Customer.objects.create(name="Bob", email="bob@example.com", phone="123-456-7890")
+        self.assertEqual(self.phone_matches("+233"), ["Alice"])
+        self.assertEqual(self.phone_matches("123-456"), ["Bob"])
+        self.assertEqual(self.phone_matches("+44"), [])
+
+    def test_migration_backfills_missing_values(self):
+        Customer.objects.filter(pk=self.customer.pk).update(phone_normalized=None)
+        migration = importlib.import_module("crm.migrations.0003_phone_normalized_backfill")
+        migration.backfill_phone_normalized(apps, mock.Mock(connection=connection))
+        self.assertEqual(
+            Customer.objects.values_list("phone_normalized", flat=True).get(pk=self.customer.pk), "+233241234567",
+        )
+
+
+# ----------------------
+# Analytics snapshots
+# ----------------------
+class AnalyticsExportTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        old = self.create_order("7.25", days_ago=400)
+        archive_orders()
+        self.archived = ArchivedOrder.objects.get(pk=old.pk)
+        self.order = self.create_order("12.50")
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+
+    def month(self, order):
+        return f"month={timezone.localtime(order.order_date, datetime.timezone.utc):%Y-%m}"
+
+    def test_exports_hot_and_archived_orders_as_columns(self):
+        exported = export_snapshot(self.root, fmt="npy")
+        self.assertEqual(sum(exported.values()), 2)
+
+        orders = load_table(self.root / "orders" / self.month(self.archived))
+        self.assertEqual(orders["id"].tolist(), [self.archived.pk])
+        self.assertEqual(orders["total_cents"].tolist(), [725])
+        self.assertEqual(str(orders["order_date"].dtype), "datetime64[us]")
+        lines = load_table(self.root / "order_lines" / self.month(self.order))
+        self.assertEqual(lines["order_id"].tolist(), [self.order.pk])
+        self.assertEqual(lines["product_id"].tolist(), [self.product.pk])
+        products = load_table(self.root / "products")
+        self.assertEqual(products["price_cents"].tolist(), [99999])
+        self.assertEqual(products["name"].tolist(), ["Laptop"])
+
+    def test_runs_are_incremental(self):
+        export_snapshot(self.root, fmt="npy")
+        self.assertEqual(export_snapshot(self.root, fmt="npy"), {})
+
+        backdated = self.create_order("1.00", days_ago=400)
+        exported = export_snapshot(self.root, fmt="npy")
+        self.assertEqual(list(exported), [self.month(backdated)[len("month="):]])
+        orders = load_table(self.root / "orders" / self.month(backdated))
+        self.assertEqual(sorted(orders["id"].tolist()), sorted([self.archived.pk, backdated.pk]))
+
+        manifest = json.loads((self.root / "manifest.json").read_text())
+        self.assertEqual(manifest["max_order_id"], backdated.pk)
+        self.assertEqual(len(manifest["partitions"]), 2)
+
+    def test_format_cannot_change_incrementally(self):
+        export_snapshot(self.root, fmt="npy")
+        with self.assertRaises(RuntimeError):
+            export_snapshot(self.root, fmt="parquet")
+
+
+# ----------------------
+# RFM segments
+# ----------------------
+class SegmentTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_order("10.50", days_ago=3)
+        self.create_order("20.00", days_ago=1)
+        self.create_archived_order(900001, "5.25", days_ago=400)
+        self.prospect = Customer.objects.create(name="Bob", email="bob@example.com")
+        self.now = timezone.now()
+
+    def test_orders_load_as_columns(self):
+        import numpy as np
+
+        customers, seconds, cents = load_orders(np)
+        self.assertEqual(customers.tolist(), [self.customer.pk] * 3)
+        self.assertEqual(sorted(cents.tolist()), [525, 1050, 2000])
+        self.assertEqual(seconds.dtype, np.float64)
+        self.assertAlmostEqual(seconds.max(), (self.now - datetime.timedelta(days=1)).timestamp(), delta=5)
+
+    def test_refresh_scores_every_customer(self):
+        self.assertEqual(refresh_segments(self.now), 2)
+        alice = CustomerSegment.objects.get(customer=self.customer)
+        self.assertEqual((alice.frequency, alice.monetary, alice.recency_days), (3, Decimal("35.75"), 1))
+        self.assertEqual(CustomerSegment.objects.get(customer=self.prospect).segment, "prospect")
+        data = execute('{ allCustomers(segment: "prospect") { edges { node { name segment } } } }')
+        self.assertEqual(data["allCustomers"]["edges"], [{"node": {"name": "Bob", "segment": "prospect"}}])
+
+    def test_refresh_replaces_the_table_with_one_delete(self):
+        refresh_segments(self.now)
+        with CaptureQueriesContext(connection) as queries:
+            refresh_segments(self.now)
+        deletes = [q["sql"] for q in queries.captured_queries if q["sql"].startswith("DELETE")]
+        self.assertEqual(len(deletes), 1)
+        self.assertEqual(CustomerSegment.objects.count(), 2)
+
+
+# ----------------------
+# Product rankings
+# ----------------------
+class RankingTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mouse = Product.objects.create(name="Mouse", price=Decimal("20.00"), stock=50)
+        for days_ago in (1, 2, 3):
+            self.create_order("20.00", days_ago=days_ago).products.set([self.mouse])
+        self.create_order("999.99", days_ago=1)
+        self.create_archived_order(900001, "999.99", days_ago=400)
+
+    def test_ranks_by_revenue_or_units(self):
+        self.assertEqual(compute_top_products(), [
+            (self.product.pk, 2, Decimal("1999.98")), (self.mouse.pk, 3, Decimal("60.00")),
+        ])
+        self.assertEqual([row[0] for row in compute_top_products(UNITS)], [self.mouse.pk, self.product.pk])
+        self.assertEqual(len(compute_top_products(first=1)), 1)
+
+    def test_windows_inside_the_hot_table_skip_the_archive(self):
+        since = timezone.localdate() - datetime.timedelta(days=2)
+        with self.assertNumQueries(1):
+            ranked = compute_top_products(UNITS, date_gte=since)
+        self.assertEqual(ranked, [(self.mouse.pk, 2, Decimal("40.00")), (self.product.pk, 1, Decimal("999.99"))])
+
+    def test_cache_follows_new_orders(self):
+        self.assertEqual(top_products()[0][1], 2)
+        with self.assertNumQueries(0):
+            top_products()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_order("999.99")
+        self.assertEqual(top_products()[0][1], 3)
+
+    def test_top_products_query(self):
+        data = execute("{ topProducts(by: UNITS, first: 1) { product { name } units revenue } }")
+        (top,) = data["topProducts"]
+        # SQLite drops the scale of summed decimals, so compare values rather than text
+        self.assertEqual((top["product"], top["units"], Decimal(top["revenue"])), ({"name": "Mouse"}, 3, Decimal("60")))
+
+
+# ----------------------
+# Admission control
+# ----------------------
+class AdmissionTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        self.controller = admission.AdmissionController(max_concurrent=2, queue_size=0, reserved_for_mutations=1)
+        patches = [
+            mock.patch.object(admission, "controller", self.controller),
+            mock.patch.object(admission, "client_buckets", admission.ClientBuckets(rate=1, burst=2)),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def middleware(self, response):
+        return AdmissionControlMiddleware(lambda request: response)
+
+    def post(self, query):
+        return RequestFactory().post("/graphql", json.dumps({"query": query}), content_type="application/json")
+
+    def test_classify(self):
+        self.assertEqual(admission.classify("mutation { updateLowStockProducts { message } }"), admission.MUTATION)
+        self.assertEqual(admission.classify("{ topProducts { units } }"), admission.REPORT)
+        self.assertEqual(admission.classify("{ hello }"), admission.QUERY)
+        self.assertEqual(admission.classify("{ hello"), admission.QUERY)
+
+    def test_mutations_keep_reserved_slots(self):
+        self.controller.acquire(admission.QUERY)
+        with self.assertRaises(admission.Rejected):
+            self.controller.acquire(admission.REPORT)
+        self.controller.acquire(admission.MUTATION)
+        self.assertEqual(self.controller.snapshot()["in_flight"], {"mutation": 1, "query": 1, "report": 0})
+
+    def test_over_rate_clients_get_429(self):
+        middleware = self.middleware(HttpResponse())
+        statuses = [middleware(self.post("{ hello }")).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_streaming_responses_hold_their_slot_until_closed(self):
+        response = self.middleware(StreamingHttpResponse(iter([b"a", b"b"])))(self.post("{ hello }"))
+        self.assertEqual(self.controller.in_flight[admission.QUERY], 1)
+        self.assertEqual(b"".join(response.streaming_content), b"ab")
+        self.assertEqual(self.controller.in_flight[admission.QUERY], 0)
+        response.close()
+        self.assertEqual(self.controller.in_flight[admission.QUERY], 0)
+
+        # Clients that disconnect before the first chunk still free the slot
+        response = self.middleware(StreamingHttpResponse(iter([b"a"])))(self.post("{ hello }"))
+        response.close()
+        self.assertEqual(self.controller.in_flight[admission.QUERY], 0)
+
+    def test_persisted_queries_are_classified_by_their_text(self):
+        query = "{ topProducts { units } }"
+        extensions = {"persistedQuery": {"version": 1, "sha256Hash": hashlib.sha256(query.encode()).hexdigest()}}
+        middleware = AdmissionControlMiddleware(lambda request: HttpResponse())
+        factory = RequestFactory()
+        get = factory.get("/graphql", {"extensions": json.dumps(extensions)})
+        post = factory.post("/graphql", json.dumps({"extensions": extensions}), content_type="application/json")
+        # Unknown hashes are left for the view to reject
+        self.assertEqual(middleware.get_lane(get), admission.QUERY)
+
+        httpcache.resolve_persisted_query(query, extensions)
+        self.assertEqual(middleware.get_lane(get), admission.REPORT)
+        self.assertEqual(middleware.get_lane(post), admission.REPORT)
+
+    def test_state_is_for_staff_and_internal_addresses(self):
+        factory = RequestFactory()
+        self.assertEqual(admission_state(factory.get("/graphql/admission")).status_code, 200)
+        outside = factory.get("/graphql/admission", REMOTE_ADDR="203.0.113.9")
+        outside.user = mock.Mock(is_staff=False)
+        self.assertEqual(admission_state(outside).status_code, 403)
+        outside.user = mock.Mock(is_staff=True)
+        self.assertEqual(json.loads(admission_state(outside).content)["max_concurrent"], 2)
+
+
+# ----------------------
+# Idempotency keys
+# ----------------------
+class IdempotencyTests(CRMTestCase):
+    mutation = {"query": "mutation { updateLowStockProducts { message } }"}
+
+    def test_mutations_are_replayed(self):
+        first = post_graphql(self.mutation, HTTP_IDEMPOTENCY_KEY="k1")
+        with self.assertNumQueries(0):
+            replay = post_graphql(self.mutation, HTTP_IDEMPOTENCY_KEY="k1")
+        self.assertEqual(replay.content, first.content)
+        self.assertEqual(replay["Idempotent-Replayed"], "true")
+        self.assertEqual(post_graphql({"query": "mutation { nope }"}, HTTP_IDEMPOTENCY_KEY="k1").status_code, 422)
+
+    def test_queries_are_not_stored(self):
+        post_graphql({"query": "{ hello }"}, HTTP_IDEMPOTENCY_KEY="k2")
+        self.assertIsNone(cache.get(idempotency._cache_key("k2")))
+
+    def test_pending_claims_block_retries_and_are_renewed(self):
+        fingerprint = idempotency.fingerprint(b"body")
+        self.assertIsNone(idempotency.claim("k3", fingerprint))
+        self.addCleanup(idempotency.release, "k3")
+        with self.assertRaises(idempotency.IdempotencyError) as raised:
+            idempotency.claim("k3", fingerprint)
+        self.assertEqual(raised.exception.status, 409)
+
+        with mock.patch("django.core.cache.backends.locmem.LocMemCache.touch") as touch:
+            idempotency.renew_claims()
+        touch.assert_called_once_with(idempotency._cache_key("k3"), idempotency.IDEMPOTENCY_PENDING_TTL)
+
+        idempotency.complete("k3", fingerprint, 200, "application/json", b"{}")
+        with mock.patch("django.core.cache.backends.locmem.LocMemCache.touch") as touch:
+            idempotency.renew_claims()
+        touch.assert_not_called()
+        self.assertEqual(idempotency.claim("k3", fingerprint), (200, "application/json", b"{}"))
+
+    def test_renewal_touches_outside_the_lock(self):
+        fingerprint = idempotency.fingerprint(b"body")
+        idempotency.claim("k4", fingerprint)
+        cache_key = idempotency._cache_key("k4")
+        calls = []
+
+        def touch(key, timeout):
+            calls.append((key, timeout))
+            self.assertFalse(idempotency._held_lock.locked())
+            if len(calls) == 1:
+                # Completed while the renewal pass is running
+                idempotency.complete("k4", fingerprint, 200, "application/json", b"{}")
+
+        with mock.patch("django.core.cache.backends.locmem.LocMemCache.touch", side_effect=touch):
+            idempotency.renew_claims()
+        # The pending touch may have landed after the set; the full TTL is put back
+        self.assertEqual(calls, [
+            (cache_key, idempotency.IDEMPOTENCY_PENDING_TTL), (cache_key, idempotency.IDEMPOTENCY_TTL),
+        ])
+        self.assertEqual(idempotency._completed, set())
+
+
+# ----------------------
+# bulkCreateOrders
+# ----------------------
+class BulkCreateOrdersTests(CRMTestCase):
+    mutation = """mutation($orders: [OrderInput]!) {
+        bulkCreateOrders(orders: $orders) { createdOrders { totalAmount products { edges { node { name } } } } errors }
+    }"""
+
+    def create_orders(self):
+        mouse = Product.objects.create(name="Mouse", price=Decimal("20.00"), stock=50)
+        get_row_count(Order)
+        with mock.patch("crm.schema.publish_on_commit") as publish, \
+                mock.patch("crm.signals.publish_on_commit") as signal_publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            data = execute(self.mutation, {"orders": [
+                {"customerId": to_global_id("CustomerNode", self.customer.pk),
+                 "productIds": [to_global_id("ProductNode", self.product.pk), str(mouse.pk)]},
+                {"customerId": "999999", "productIds": [str(mouse.pk)]},
+                {"customerId": str(self.customer.pk), "productIds": [str(mouse.pk)]},
+            ]})["bulkCreateOrders"]
+        self.assertEqual(data["errors"], ["Row 2: Invalid customer ID (999999)"])
+        self.assertEqual([order["totalAmount"] for order in data["createdOrders"]], ["1019.99", "20.00"])
+        products = data["createdOrders"][0]["products"]["edges"]
+        self.assertEqual(sorted(edge["node"]["name"] for edge in products), ["Laptop", "Mouse"])
+        self.assertEqual(get_row_count(Order), 2)
+        self.assertEqual(OutboxEvent.objects.filter(event_type="order.created").count(), 2)
+        return publish.call_count + signal_publish.call_count
+
+    def test_orders_are_bulk_inserted(self):
+        self.assertEqual(self.create_orders(), 2)
+
+    def test_backends_without_returned_pks_insert_row_by_row(self):
+        with mock.patch.object(type(connection.features), "can_return_rows_from_bulk_insert", False):
+            self.assertEqual(self.create_orders(), 2)
+
+    def test_invalid_products_are_reported(self):
+        data = execute(self.mutation, {"orders": [{"customerId": str(self.customer.pk), "productIds": ["424242"]}]})
+        self.assertEqual(data["bulkCreateOrders"], {"createdOrders": [], "errors": ["Row 1: Invalid product IDs (424242)"]})
+
+
+# ----------------------
+# Bulk import
+# ----------------------
+class ImportTests(CRMTestCase):
+    def run_import(self, kind, rows, **kwargs):
+        results = list(import_rows(kind, list(enumerate(rows, start=1)), **kwargs))
+        return (
+            sum(result[1] for result in results),
+            sum(result[2] for result in results),
+            [error for result in results for error in result[3]],
+        )
+
+    def test_customers_are_deduplicated(self):
+        written, skipped, errors = self.run_import("customers", [
+            {"name": "Alice B", "email": "alice@example.com"},
+            {"name": "Bob", "email": "bob@example.com", "phone": "+233241234567"},
+            {"name": "Carol", "email": "carol@example.com", "phone": "123-456-7890"},
+            {"name": "Dan", "email": "not-an-email"},
+        ], chunk_size=2)
+        self.assertEqual((written, skipped), (1, 1))
+        self.assertEqual(errors, [(2, "phone: +233241234567 belongs to another customer."), (4, "email: Enter a valid email address.")])
+        self.assertEqual(Customer.objects.get(email="carol@example.com").phone_normalized, "+11234567890")
+        self.assertEqual(get_row_count(Customer), 2)
+
+        self.run_import("customers", [{"name": "Alice B", "email": "alice@example.com"}], on_conflict=UPDATE)
+        self.assertEqual(Customer.objects.get(email="alice@example.com").name, "Alice B")
+
+    def test_orders_link_their_products(self):
+        written, skipped, errors = self.run_import("orders", [
+            '{"customer_email": "alice@example.com", "product_ids": [%d]}' % self.product.pk,
+            '{"id": 5000, "customer_id": %d, "product_ids": [%d], "total_amount": "12.00"}'
+            % (self.customer.pk, self.product.pk),
+            '{"id": 5000, "customer_id": %d, "product_ids": [%d]}' % (self.customer.pk, self.product.pk),
+            '{"customer_email": "nobody@example.com", "product_ids": [%d]}' % self.product.pk,
+            "not json",
+        ])
+        self.assertEqual((written, skipped), (2, 1))
+        self.assertEqual(errors, [(4, "customer: no such customer."), (5, "Invalid JSON.")])
+        self.assertEqual(sorted(Order.objects.values_list("total_amount", flat=True)), [Decimal("12.00"), Decimal("999.99")])
+        self.assertEqual(Order.products.through.objects.count(), 2)
+        self.assertEqual(get_row_count(Order), 2)
+
+    def test_archived_order_ids_already_exist(self):
+        archived = self.create_archived_order(900001, "200.00", days_ago=400)
+        written, skipped, errors = self.run_import("orders", [
+            '{"id": %d, "customer_id": %d, "product_ids": [%d]}' % (archived.pk, self.customer.pk, self.product.pk),
+        ])
+        self.assertEqual((written, skipped, errors), (0, 1, []))
+        self.assertFalse(Order.objects.filter(pk=archived.pk).exists())
+
+    def test_orders_without_ids_on_backends_without_returned_pks(self):
+        with mock.patch.object(type(connection.features), "can_return_rows_from_bulk_insert", False):
+            written, _, _ = self.run_import("orders", [
+                {"customer_id": str(self.customer.pk), "product_ids": str(self.product.pk)},
+                {"id": "5000", "customer_id": str(self.customer.pk), "product_ids": str(self.product.pk)},
+            ])
+        self.assertEqual(written, 2)
+        self.assertEqual(
+            sorted(Order.products.through.objects.values_list("order_id", flat=True)),
+            sorted(Order.objects.values_list("pk", flat=True)),
+        )
+        self.assertEqual(get_row_count(Order), 2)
+
+    def test_csv_rows_carry_line_numbers(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as handle:
+            handle.write("name,price,stock\nMouse,25.00,3\nBad,-1,0\n")
+        self.addCleanup(Path(handle.name).unlink)
+        (result,) = import_rows("products", read_rows(handle.name, "csv"))
+        read, written, _, errors = result
+        self.assertEqual((read, written), (2, 1))
+        self.assertEqual([line for line, _ in errors], [3])
+
+
+# ----------------------
+# Outbox
+# ----------------------
+class OutboxTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        self.handled = []
+        handlers = {"test.event": [self.handle]}
+        patch = mock.patch.object(outbox, "get_handlers", return_value=handlers)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def handle(self, event):
+        if event.payload.get("fail"):
+            raise RuntimeError("boom")
+        self.handled.append(event.payload["n"])
+
+    def add(self, customer, n, fail=False):
+        return outbox.record("test.event", customer, {"n": n, "fail": fail})
+
+    def test_bulk_create_customers_records_events_with_the_rows(self):
+        mutation = """mutation($customers: [CustomerInput]!) {
+            bulkCreateCustomers(customers: $customers) { createdCustomers { email } errors }
+        }"""
+        data = execute(mutation, {"customers": [
+            {"name": "Bob", "email": "bob@example.com", "phone": "+1234567890"},
+            {"name": "Alice again", "email": "alice@example.com"},
+            {"name": "Carol", "email": "carol@example.com", "phone": "12"},
+        ]})["bulkCreateCustomers"]
+        self.assertEqual(data["createdCustomers"], [{"email": "bob@example.com"}])
+        self.assertEqual(data["errors"], [
+            "Row 2: Email already exists (alice@example.com)", "Row 3: Invalid phone format (12)",
+        ])
+        bob = Customer.objects.get(email="bob@example.com")
+        event = OutboxEvent.objects.get(event_type="customer.created")
+        self.assertEqual((event.aggregate_id, event.payload), (bob.pk, {"email": "bob@example.com"}))
+
+    def test_failures_only_block_their_aggregate(self):
+        bob = Customer.objects.create(name="Bob", email="bob@example.com")
+        self.add(self.customer, 1, fail=True)
+        self.add(self.customer, 2)
+        self.add(bob, 3)
+        self.add(bob, 4)
+
+        with mock.patch.object(outbox.logger, "exception"):
+            self.assertEqual(outbox.drain(batch_size=1), 2)
+        self.assertEqual(self.handled, [3, 4])
+        self.assertEqual(list(outbox.pending_events().values_list("payload__n", flat=True)), [1])
+
+    def test_events_are_dead_lettered_after_max_attempts(self):
+        failing = self.add(self.customer, 1, fail=True)
+        self.add(self.customer, 2)
+        with mock.patch.object(outbox, "OUTBOX_MAX_ATTEMPTS", 2), mock.patch.object(outbox.logger, "exception"):
+            self.assertEqual(outbox.drain(), 0)
+            self.assertEqual(outbox.drain(), 0)
+            self.assertEqual(outbox.drain(), 1)
+        failing.refresh_from_db()
+        self.assertEqual(failing.attempts, 2)
+        self.assertIsNotNone(failing.failed_at)
+        self.assertIn("boom", failing.last_error)
+        self.assertEqual(self.handled, [2])
+
+    def test_compact_supersedes_stale_stock_events(self):
+        for stock in (1, 2, 3):
+            outbox.record(outbox.PRODUCT_STOCK_CHANGED, self.product, {"stock": stock})
+        self.assertEqual(outbox.compact(), (2, 0))
+        self.assertEqual(
+            list(OutboxEvent.objects.filter(processed_at__isnull=True).values_list("payload__stock", flat=True)), [3],
+        )
+
+
+# ----------------------
+# Reporting jobs
+# ----------------------
+class ReportTaskTests(CRMTestCase):
+    def test_revenue_is_summed_exactly(self):
+        client = mock.Mock()
+        client.execute.return_value = {
+            "totalCustomers": {"totalCount": 1},
+            "totalOrders": {"totalCount": 3, "edges": [
+                {"node": {"totalAmount": amount}} for amount in ("0.10", "0.20", "1000000000000.01")
+            ]},
+        }
+        logger = logging.getLogger("crm.tests.report")
+        with mock.patch.object(tasks, "get_client", return_value=client), \
+                mock.patch.object(tasks, "get_job_logger", return_value=logger), \
+                self.assertLogs(logger) as logs:
+            tasks.generate_crm_report()
+        (report,) = [record for record in logs.records if record.getMessage() == "Report"]
+        self.assertEqual((report.customers, report.orders, report.revenue), (1, 3, "1000000000000.31"))
+
+    def test_order_reminders_query_matches_the_served_schema(self):
+        from graphql import parse, validate
+
+        from crm.cron_jobs.send_order_reminders import RECENT_ORDERS_QUERY
+
+        self.assertEqual(validate(schema.graphql_schema, parse(RECENT_ORDERS_QUERY)), [])
+
+
+# ----------------------
+# Profiling
+# ----------------------
+class ProfilingTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        for name, value in (("PROFILING_ENABLED", True), ("PROFILE_DIR", self.dir), ("PROFILE_RING_SIZE", 2)):
+            patch = mock.patch.object(profiling, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def request(self, token):
+        return RequestFactory().get("/graphql", HTTP_X_CRM_PROFILE=token)
+
+    def test_tokens_pick_the_mode(self):
+        self.assertEqual(profiling.requested_mode(self.request(profiling.make_profile_token(profiling.CPROFILE))), "cprofile")
+        self.assertIsNone(profiling.requested_mode(self.request("sample")))
+        with self.assertRaises(ValueError):
+            profiling.make_profile_token("perf")
+        with mock.patch.object(profiling, "PROFILING_ENABLED", False):
+            self.assertIsNone(profiling.requested_mode(self.request(profiling.make_profile_token())))
+
+    def test_profiles_are_kept_in_a_ring(self):
+        for label in ("one", "two", "three"):
+            with profiling.profile(label, profiling.CPROFILE) as handle:
+                sum(range(1000))
+        self.assertTrue(handle.path.name.endswith(".pstats"))
+        self.assertEqual([path.name.split("-")[1] for path in sorted(self.dir.iterdir())], ["two", "three"])
+
+    def test_sampled_requests_name_their_profile(self):
+        request = RequestFactory().post(
+            "/graphql", json.dumps({"query": "{ hello }", "operationName": None}),
+            content_type="application/json", HTTP_X_CRM_PROFILE=profiling.make_profile_token(),
+        )
+        with mock.patch.object(profiling, "PROFILE_SAMPLE_INTERVAL", 0.001):
+            response = FastJSONGraphQLView.as_view(schema=schema)(request)
+        self.assertEqual(response.status_code, 200)
+        path = self.dir / response["X-CRM-Profile-File"]
+        self.assertTrue(path.name.endswith(".folded"))
+        self.assertIn("graphql-anonymous", path.name)
+
+    def test_celery_tasks_are_profiled_on_request(self):
+        task = mock.Mock(request={"crm_profile": "cprofile"})
+        task.name = "crm.tasks.refresh_total_counts"
+        profiling.start_task_profile("t1", task)
+        profiling.stop_task_profile("t1")
+        (path,) = self.dir.iterdir()
+        self.assertIn("crm.tasks.refresh_total_counts", path.name)
+
+
+# ----------------------
+# Load generator
+# ----------------------
+class LoadTestTests(CRMTestCase):
+    def test_every_operation_runs_against_the_served_schema(self):
+        context = {"customer_ids": [str(self.customer.pk)], "product_ids": [str(self.product.pk)]}
+        rng = random.Random(0)
+        for name, operation in loadtest.OPERATIONS.items():
+            # Several draws, so each operation's variants are covered
+            for _ in range(8):
+                with self.subTest(name):
+                    query, variables = operation(rng, context)
+                    result = schema.execute(query, variable_values=variables, context_value=RequestFactory().post("/graphql"))
+                    self.assertIsNone(result.errors)
+
+    def test_outcomes_and_clients(self):
+        test = loadtest.LoadTest("http://testserver/graphql", {"heartbeat": 1}, seed=1, clients=3)
+        self.assertEqual(len({test.headers()[loadtest.CLIENT_HEADER] for _ in range(50)}), 3)
+        self.assertIsNone(loadtest.LoadTest("http://testserver/graphql").headers())
+
+        outcomes = []
+        for status, body in ((200, {"data": {}}), (200, {"errors": [{}]}), (429, {}), (503, {})):
+            with mock.patch.object(test, "post", return_value=(status, body)):
+                outcomes.append(test.run_one("heartbeat", time.monotonic())[1])
+        self.assertEqual(outcomes, ["ok", "error", "rate_limited", "shed"])
+
+        step = loadtest.Step(4, 1.0, [("heartbeat", outcome, 0.01) for outcome in outcomes])
+        summary = step.overall()
+        self.assertEqual((summary["ok"], summary["errors"], summary["rate_limited"], summary["shed"]), (1, 1, 1, 1))
+        self.assertTrue(step.saturated(slo_ms=500))
+
+
+# ----------------------
+# JSON encoding
+# ----------------------
+class EncodingTests(CRMTestCase):
+    payload = {"data": {
+        "name": "Zoë", "amount": Decimal("10.50"), "when": datetime.datetime(2025, 1, 2, 3, 4, 5),
+        "day": datetime.date(2025, 1, 2), "nested": [{"n": 1}, None, True],
+    }}
+
+    def test_stdlib_matches_compact_json(self):
+        expected = json.dumps(self.payload, separators=(",", ":"), ensure_ascii=False, default=encoding.default)
+        self.assertEqual(encoding.encode_stdlib(self.payload), expected.encode("utf-8"))
+        self.assertIn('"amount":"10.50"', expected)
+        self.assertIn('"when":"2025-01-02T03:04:05"', expected)
+
+    @skipIf(encoding.orjson is None, "orjson is not installed")
+    def test_orjson_decodes_to_the_same_document(self):
+        self.assertEqual(json.loads(encoding.encode_orjson(self.payload)), json.loads(encoding.encode_stdlib(self.payload)))
+
+    def test_get_encoder(self):
+        self.assertEqual(encoding.get_encoder(encoding.STDLIB)[0], encoding.STDLIB)
+        self.assertEqual(encoding.get_encoder(encoding.AUTO)[0], encoding.ORJSON if encoding.orjson else encoding.STDLIB)
+        with self.assertRaises(ValueError):
+            encoding.get_encoder("simplejson")
+        with mock.patch.object(encoding, "orjson", None), self.assertRaises(ImportError):
+            encoding.get_encoder(encoding.ORJSON)
+        with self.assertRaises(TypeError):
+            encoding.default(object())
+
+    def test_view_encodes_plain_and_pretty_responses(self):
+        self.assertEqual(post_graphql({"query": "{ hello }"}).content, b'{"data":{"hello":"Hello, GraphQL!"}}')
+        request = RequestFactory().post(
+            "/graphql?pretty=1", json.dumps({"query": "{ hello }"}), content_type="application/json",
+        )
+        pretty = FastJSONGraphQLView.as_view(schema=schema)(request)
+        self.assertIn(b"\n", pretty.content)
+        self.assertEqual(json.loads(pretty.content), {"data": {"hello": "Hello, GraphQL!"}})
+
+
+# ----------------------
+# HTTP caching
+# ----------------------
+class HTTPCacheTests(CRMTestCase):
+    # The replica stays empty, so reading from it would return no products
+    databases = {"default", "replica"}
+    query = "{ allProducts { edges { node { name } } } }"
+
+    def get(self, params, **headers):
+        request = RequestFactory().get("/graphql", params, **headers)
+        return FastJSONGraphQLView.as_view(schema=schema)(request)
+
+    def persisted(self, query=None):
+        digest = hashlib.sha256(self.query.encode()).hexdigest()
+        params = {"extensions": json.dumps({"persistedQuery": {"version": 1, "sha256Hash": digest}})}
+        if query:
+            params["query"] = query
+        return params
+
+    def test_persisted_queries_are_registered_in_the_shared_cache(self):
+        missing = self.get(self.persisted())
+        self.assertEqual(json.loads(missing.content)["errors"][0]["message"], "PersistedQueryNotFound")
+        self.assertEqual(self.get(self.persisted(self.query)).status_code, 200)
+
+        with mock.patch.object(httpcache, "PERSISTED_QUERY_CACHE", "other"), self.settings(CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "other": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "other"},
+        }):
+            # Hashes live in the configured alias, not in process memory
+            self.assertIn(b"PersistedQueryNotFound", self.get(self.persisted()).content)
+        response = self.get(self.persisted())
+        self.assertEqual(json.loads(response.content), {"data": {"allProducts": {"edges": [{"node": {"name": "Laptop"}}]}}})
+
+        with self.assertRaises(ValueError):
+            httpcache.resolve_persisted_query("{ hello }", json.loads(self.persisted()["extensions"]))
+
+    def test_etags_follow_the_catalog_version(self):
+        response = self.get({"query": self.query})
+        etag = response["ETag"]
+        self.assertTrue(etag)
+        self.assertEqual(self.get({"query": self.query}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Mouse", price=Decimal("25.00"), stock=100)
+        response = self.get({"query": self.query}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertFalse(self.get({"query": "{ allOrders { totalCount } }"}).has_header("ETag"))
+
+    def test_tagged_queries_read_from_the_primary(self):
+        with override_settings(DATABASE_REPLICAS=["replica"]):
+            response = self.get({"query": self.query})
+        self.assertTrue(response.has_header("ETag"))
+        self.assertEqual(json.loads(response.content)["data"]["allProducts"]["edges"], [{"node": {"name": "Laptop"}}])
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertNotIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+    def test_large_responses_are_gzipped(self):
+        Product.objects.bulk_create(Product(name=f"Laptop {i}", price=Decimal("1.00"), stock=1) for i in range(20))
+        with mock.patch.object(httpcache, "COMPRESS_MIN_BYTES", 10):
+            response = self.get({"query": self.query}, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertTrue(response["ETag"].endswith('-gzip"'))
+        self.assertIn(b"Laptop", gzip.decompress(response.content))
+
+
+# ----------------------
+# Tracing
+# ----------------------
+class TracingTests(CRMTestCase):
+    traceparent = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+    def setUp(self):
+        super().setUp()
+        self.exporter = tracing.SpanExporter(path=None, endpoint=None)
+        # No exporter thread: spans stay on the queue for the test to read
+        self.exporter._pid = os.getpid()
+        for patch in (mock.patch.object(tracing, "TRACING_ENABLED", True),
+                      mock.patch.object(tracing, "exporter", self.exporter)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def queued(self):
+        spans = []
+        while not self.exporter.spans.empty():
+            spans.append(self.exporter.spans.get_nowait())
+        return spans
+
+    def test_extract(self):
+        context = tracing.extract(self.traceparent.upper())
+        self.assertEqual(context, tracing.SpanContext("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7", True))
+        self.assertEqual(tracing.format_traceparent(context), self.traceparent)
+        self.assertFalse(tracing.extract(self.traceparent[:-2] + "00").sampled)
+        for header in (None, "", "garbage", "01-" + self.traceparent[3:], "00-" + "0" * 32 + self.traceparent[35:]):
+            self.assertIsNone(tracing.extract(header))
+
+    def test_inject_continues_the_incoming_trace(self):
+        self.assertEqual(tracing.inject(), {})
+        with tracing.span("request", tracing.SERVER, parent=tracing.extract(self.traceparent)) as server:
+            with tracing.span("query") as child:
+                headers = tracing.inject({"Accept": "application/json"})
+        self.assertEqual(headers["Accept"], "application/json")
+        sent = tracing.extract(headers[tracing.TRACEPARENT_HEADER])
+        self.assertEqual(sent, child.context)
+        self.assertEqual(sent.trace_id, "4bf92f3577b34da6a3ce929d0e0e4736")
+        self.assertEqual(child.parent_id, server.context.span_id)
+        self.assertEqual(server.parent_id, "00f067aa0ba902b7")
+        self.assertEqual(self.queued(), [child, server])
+
+    def test_otlp_output(self):
+        with self.assertRaises(ValueError):
+            with tracing.span("job", attributes={"rows": 3, "ok": True, "ratio": 0.5, "name": "x", "none": None},
+                              parent=tracing.extract(self.traceparent)):
+                raise ValueError("boom")
+        with tempfile.TemporaryDirectory() as directory:
+            self.exporter.path = Path(directory) / "traces.jsonl"
+            self.exporter.export(self.queued())
+            [line] = self.exporter.path.read_text().splitlines()
+
+        [resource_spans] = json.loads(line)["resourceSpans"]
+        self.assertIn({"key": "service.name", "value": {"stringValue": "crm"}}, resource_spans["resource"]["attributes"])
+        [span] = resource_spans["scopeSpans"][0]["spans"]
+        self.assertEqual(span["traceId"], "4bf92f3577b34da6a3ce929d0e0e4736")
+        self.assertEqual(span["parentSpanId"], "00f067aa0ba902b7")
+        self.assertEqual(span["kind"], tracing.INTERNAL)
+        self.assertEqual(span["status"], {"code": tracing.STATUS_ERROR, "message": "boom"})
+        self.assertLessEqual(int(span["startTimeUnixNano"]), int(span["endTimeUnixNano"]))
+        attributes = {attribute["key"]: attribute["value"] for attribute in span["attributes"]}
+        self.assertEqual(attributes["rows"], {"intValue": "3"})
+        self.assertEqual(attributes["ok"], {"boolValue": True})
+        self.assertEqual(attributes["ratio"], {"doubleValue": 0.5})
+        self.assertEqual(attributes["exception.type"], {"stringValue": "ValueError"})
+        self.assertNotIn("none", attributes)
+
+    def test_full_queue_drops_spans(self):
+        self.exporter = tracing.SpanExporter(path=None, endpoint=None, maxsize=2)
+        self.exporter._pid = os.getpid()
+        with mock.patch.object(tracing, "exporter", self.exporter):
+            for _ in range(5):
+                with tracing.span("work", parent=tracing.extract(self.traceparent)):
+                    pass
+        self.assertEqual(len(self.queued()), 2)
+        self.assertEqual(self.exporter.dropped, 3)
+
+    def test_unsampled_spans_are_not_exported(self):
+        with tracing.span("work", parent=tracing.extract(self.traceparent[:-2] + "00")):
+            self.assertEqual(tracing.inject()[tracing.TRACEPARENT_HEADER][-2:], "00")
+        self.assertEqual(self.queued(), [])
+
+    def test_order_reminders_use_the_shared_client(self):
+        from crm.cron_jobs import send_order_reminders
+
+        self.assertIs(send_order_reminders.get_client, graphql_client.get_client)
+
+
+# ----------------------
+# Health checks
+# ----------------------
+class HealthTests(CRMTestCase):
+    def setUp(self):
+        super().setUp()
+        for patch in (mock.patch.object(health, "_last", None), mock.patch.object(health, "_refreshing", False)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_cache_check_needs_a_shared_cache(self):
+        ready, results = health.run_checks(("cache",))
+        self.assertFalse(ready)
+        self.assertIn("LocMemCache", results["cache"]["error"])
+        with self.settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}):
+            self.assertFalse(health.run_checks(("cache",))[0])
+        with tempfile.TemporaryDirectory() as directory, self.settings(CACHES={"default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory,
+        }}):
+            self.assertEqual(health.run_checks(("cache",)), (True, {"cache": {"ok": True, "ms": mock.ANY}}))
+
+    def test_checks_run_on_pool_threads_and_close_their_connections(self):
+        threads = []
+        with mock.patch.object(health.connections, "close_all", wraps=health.connections.close_all) as close_all, \
+                mock.patch.dict(health.CHECKS, {"database": lambda: threads.append(threading.current_thread())}):
+            self.assertTrue(health.run_checks(("database",))[0])
+        self.assertNotEqual(threads, [threading.current_thread()])
+        close_all.assert_called_once()
+        self.assertTrue(health.run_checks(("database",))[0])
+
+    def test_hung_checks_time_out(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        with mock.patch.object(health, "HEALTH_CHECK_TIMEOUT", 0.05), \
+                mock.patch.dict(health.CHECKS, {"database": release.wait, "broker": lambda: None}):
+            started = time.monotonic()
+            ready, results = health.run_checks(("database", "broker"))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertFalse(ready)
+        self.assertEqual(results["database"]["error"], "timed out after 0.05s")
+        self.assertTrue(results["broker"]["ok"])
+
+    def test_one_probe_refreshes_while_the_others_get_the_last_result(self):
+        health._last = (time.monotonic() - health.HEALTH_CACHE_TTL - 1, True, {"database": {"ok": True}})
+        started, release = threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+
+        def run_checks():
+            started.set()
+            release.wait(5)
+            return False, {"database": {"ok": False, "error": "down"}}
+
+        with mock.patch.object(health, "run_checks", side_effect=run_checks) as checks:
+            refresher = threading.Thread(target=health.get_readiness)
+            refresher.start()
+            self.assertTrue(started.wait(5))
+            # Answered from the last result without waiting for the refresh
+            ready, results, age = health.get_readiness()
+            self.assertTrue(ready)
+            self.assertGreater(age, health.HEALTH_CACHE_TTL)
+            release.set()
+            refresher.join(5)
+            self.assertEqual(checks.call_count, 1)
+
+            response = readyz(RequestFactory().get("/readyz"))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.content)["checks"]["database"]["error"], "down")
@@ -0,0 +1,345 @@
+"""Distributed tracing for HTTP requests, GraphQL, SQL, Celery tasks and cron jobs.
+
+Off unless ``TRACING_ENABLED`` is set. When on, spans are created for:
+
+* every HTTP request (``crm.middleware.TracingMiddleware``) and the GraphQL
+  operation it runs (``CRMGraphQLView``);
+* resolvers (``crm.middleware.ResolverTracingMiddleware``). Fields returning
+  scalars or enums are left out unless ``TRACE_SCALAR_RESOLVERS`` is set;
+  they are nearly all plain attribute reads;
+* every SQL statement, through a database execute wrapper;
+* Celery tasks (hooked up in ``crm/celery.py``) and every ``job_run``, which
+  covers the cron jobs.
+
+Trace context travels in W3C ``traceparent`` headers. It goes on GraphQL
+requests made through ``crm.graphql_client`` and on published Celery
+messages, so a cron job, the task it queued and the server-side queries
+all land in one trace.
+
+Sampling is decided once, where a trace starts: a ``TRACE_SAMPLE_RATIO``
+share of new traces is recorded, and incoming context keeps the caller's
+decision. Unsampled traces still propagate, but SQL and resolver spans are
+skipped altogether. Finished spans are batched by a background thread. At
+most ``TRACE_QUEUE_SIZE`` spans wait for it; past that, new spans are dropped
+and counted in ``exporter.dropped`` rather than held in memory. Each
+batch is appended to ``TRACE_FILE`` as one line of OTLP/JSON
+(``ExportTraceServiceRequest``), which the OpenTelemetry Collector's
+``otlpjsonfile`` receiver reads. Set ``TRACE_OTLP_ENDPOINT`` (e.g.
+``http://localhost:4318/v1/traces``) to also POST each batch to a collector.
+"""
+import atexit
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+TRACING_ENABLED = getattr(settings, "TRACING_ENABLED", False)
+TRACE_SAMPLE_RATIO = getattr(settings, "TRACE_SAMPLE_RATIO", 0.1)
+TRACE_FILE = getattr(settings, "TRACE_FILE", "/tmp/crm_traces.jsonl")
+TRACE_OTLP_ENDPOINT = getattr(settings, "TRACE_OTLP_ENDPOINT", None)
+TRACE_SERVICE_NAME = getattr(settings, "TRACE_SERVICE_NAME", "crm")
+TRACE_SQL = getattr(settings, "TRACE_SQL", True)
+TRACE_SCALAR_RESOLVERS = getattr(settings, "TRACE_SCALAR_RESOLVERS", False)
+TRACE_BATCH_SIZE = getattr(settings, "TRACE_BATCH_SIZE", 512)
+TRACE_FLUSH_INTERVAL = getattr(settings, "TRACE_FLUSH_INTERVAL", 2.0)
+TRACE_QUEUE_SIZE = getattr(settings, "TRACE_QUEUE_SIZE", 8192)
+
+# OTLP SpanKind and StatusCode values
+INTERNAL, SERVER, CLIENT, PRODUCER, CONSUMER = 1, 2, 3, 4, 5
+STATUS_ERROR = 2
+
+TRACEPARENT_HEADER = "traceparent"
+_traceparent = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+SpanContext = namedtuple("SpanContext", ("trace_id", "span_id", "sampled"))
+
+_current = ContextVar("crm_current_span", default=None)
+
+
+# ----------------------
+# Spans
+# ----------------------
+class Span:
+    __slots__ = ("name", "context", "parent_id", "kind", "attributes", "start_ns", "end_ns", "status", "message")
+
+    def __init__(self, name, context, parent_id=None, kind=INTERNAL, attributes=None):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or ())
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = 0
+        self.message = ""
+
+    @property
+    def sampled(self):
+        return self.context.sampled
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, error):
+        self.status = STATUS_ERROR
+        self.message = str(error)
+        self.attributes["exception.type"] = type(error).__name__
+        self.attributes["exception.message"] = str(error)
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        if self.context.sampled:
+            exporter.submit(self)
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attribute(key, value) for key, value in self.attributes.items() if value is not None],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status:
+            span["status"] = {"code": self.status, "message": self.message}
+        return span
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def current_span():
+    return _current.get()
+
+
+def start_span(name, kind=INTERNAL, attributes=None, parent=None):
+    """Start a span under ``parent`` (a remote SpanContext) or else the current span."""
+    if parent is None and _current.get() is not None:
+        parent = _current.get().context
+    if parent is not None:
+        trace_id, sampled = parent.trace_id, parent.sampled
+    else:
+        trace_id, sampled = f"{random.getrandbits(128):032x}", random.random() < TRACE_SAMPLE_RATIO
+    context = SpanContext(trace_id, f"{random.getrandbits(64):016x}", sampled)
+    return Span(name, context, parent.span_id if parent else None, kind, attributes)
+
+
+def activate(span):
+    """Make ``span`` current; returns a token for ``deactivate``."""
+    return _current.set(span)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+@contextmanager
+def span(name, kind=INTERNAL, attributes=None, parent=None):
+    """Run the enclosed block in a new span; yields None when tracing is off."""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    new_span = start_span(name, kind, attributes, parent)
+    token = activate(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.record_exception(e)
+        raise
+    finally:
+        deactivate(token)
+        new_span.end()
+
+
+# ----------------------
+# Propagation
+# ----------------------
+def extract(header):
+    """SpanContext from a traceparent header, or None if missing or malformed."""
+    match = _traceparent.match((header or "").strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return SpanContext(match.group(1), match.group(2), bool(int(match.group(3), 16) & 1))
+
+
+def format_traceparent(context):
+    return f"00-{context.trace_id}-{context.span_id}-{'01' if context.sampled else '00'}"
+
+
+def inject(headers=None):
+    """Add the current span's traceparent to ``headers`` (a new dict if None) and return it."""
+    headers = {} if headers is None else headers
+    current = _current.get()
+    if current is not None:
+        headers[TRACEPARENT_HEADER] = format_traceparent(current.context)
+    return headers
+
+
+# ----------------------
+# Export
+# ----------------------
+class SpanExporter:
+    """Batches finished spans on a bounded queue and writes them from a daemon thread.
+
+    Spans arriving while the queue is full (the collector is slow or down)
+    are dropped and counted in ``dropped``.
+    """
+
+    def __init__(self, path=TRACE_FILE, endpoint=TRACE_OTLP_ENDPOINT, maxsize=TRACE_QUEUE_SIZE):
+        self.path = path
+        self.endpoint = endpoint
+        self.spans = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, span):
+        try:
+            self.spans.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+        # Started lazily, and again in forked children (e.g. Celery prefork workers)
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name="crm-trace-exporter", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + TRACE_FLUSH_INTERVAL
+            while len(batch) < TRACE_BATCH_SIZE:
+                try:
+                    span = self.spans.get(timeout=max(deadline - time.monotonic(), 0.01))
+                except queue.Empty:
+                    break
+                if span is None:
+                    stopping = True
+                    break
+                batch.append(span)
+            if batch:
+                self.export(batch)
+
+    def stop(self, timeout=5):
+        """Export everything queued, including the batch the thread is holding."""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            try:
+                self.spans.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        self._pid = self._thread = None
+
+    def export(self, spans):
+        payload = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [
+                _attribute("service.name", TRACE_SERVICE_NAME), _attribute("process.pid", os.getpid()),
+            ]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": [span.to_otlp() for span in spans]}],
+        }]}, separators=(",", ":"))
+        try:
+            if self.path:
+                # One append per batch, so processes sharing the file do not interleave lines
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(payload + "\n")
+            if self.endpoint:
+                import requests
+
+                requests.post(self.endpoint, data=payload, headers={"Content-Type": "application/json"}, timeout=2)
+        except Exception:
+            # Tracing must never take the traced work down with it
+            pass
+
+
+exporter = SpanExporter()
+
+
+@atexit.register
+def flush_traces():
+    """Export spans still queued; runs at interpreter exit."""
+    exporter.stop()
+
+
+# ----------------------
+# SQL
+# ----------------------
+def trace_sql(execute, sql, params, many, context):
+    """Database execute wrapper recording one CLIENT span per statement of a sampled trace."""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return execute(sql, params, many, context)
+    connection = context["connection"]
+    attributes = {
+        "db.system": connection.vendor,
+        "db.name": connection.alias,
+        "db.statement": sql,
+        "db.executemany": many or None,
+    }
+    with span(f"{sql.split(None, 1)[0].upper() if sql else 'SQL'} {connection.alias}", CLIENT, attributes):
+        return execute(sql, params, many, context)
+
+
+def install_sql_tracing(sender, connection, **kwargs):
+    if trace_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(trace_sql)
+
+
+if TRACING_ENABLED and TRACE_SQL:
+    connection_created.connect(install_sql_tracing, dispatch_uid="crm.tracing.sql")
+
+
+# ----------------------
+# Celery hooks (connected in crm/celery.py)
+# ----------------------
+_task_spans = {}
+
+
+def inject_task_headers(headers=None, **kwargs):
+    if TRACING_ENABLED and headers is not None:
+        inject(headers)
+
+
+def start_task_span(task_id=None, task=None, **kwargs):
+    if not TRACING_ENABLED:
+        return
+    new_span = start_span(
+        f"task {task.name}", CONSUMER,
+        {"celery.task_name": task.name, "celery.task_id": task_id, "celery.retries": task.request.retries},
+        parent=extract(task.request.get(TRACEPARENT_HEADER)),
+    )
+    _task_spans[task_id] = (new_span, activate(new_span))
+
+
+def stop_task_span(task_id=None, state=None, **kwargs):
+    started = _task_spans.pop(task_id, None)
+    if started is None:
+        return
+    task_span, token = started
+    deactivate(token)
+    task_span.set_attribute("celery.state", state)
+    if state == "FAILURE":
+        task_span.status = STATUS_ERROR
+    task_span.end()
@@ -1,7 +1,11 @@
 from django.urls import path
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
 
+from .views import FastJSONGraphQLView, admission_state, healthz, readyz
+
 urlpatterns = [
-    path("graphql", csrf_exempt(GraphQLView.as_view(graphiql=True))),
- ]
\ No newline at end of file
+    path("graphql", csrf_exempt(FastJSONGraphQLView.as_view(graphiql=True))),
+    path("graphql/admission", admission_state),
+    path("healthz", healthz),
+    path("readyz", readyz),
+ ]
@@ -1,3 +1,400 @@
-from django.shortcuts import render
+import json
+from functools import lru_cache
 
-# Create your views here.
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBadRequest, HttpResponseNotAllowed
+from django.utils.cache import cc_delim_re, patch_vary_headers
+from django.views.decorators.cache import never_cache
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView, HttpError
+from graphql import ExecutionResult, OperationType, execute, get_operation_ast, parse, validate, validate_schema
+
+from . import encoding, health, httpcache, idempotency, profiling, tracing
+from .admission import get_state as get_admission_state
+from .routers import read_from_primary
+from .streaming import NDJSON_CONTENT_TYPE, encode_ndjson, get_streamed_fields, stream_payloads
+
+# Upper bound on operations accepted in one batched POST
+MAX_BATCH_SIZE = getattr(settings, "GRAPHQL_MAX_BATCH_SIZE", 20)
+
+# Addresses that may read /graphql/admission without a staff session
+ADMISSION_STATE_ALLOWED_IPS = frozenset(getattr(settings, "ADMISSION_STATE_ALLOWED_IPS", ("127.0.0.1", "::1")))
+
+# Parsed and validated documents kept per process, keyed by query text
+DOCUMENT_CACHE_SIZE = getattr(settings, "GRAPHQL_DOCUMENT_CACHE_SIZE", 256)
+
+
+@lru_cache(maxsize=DOCUMENT_CACHE_SIZE)
+def parse_document(query):
+    """Parse ``query`` once per process; parse errors are raised, not cached.
+
+    Clients send the same few documents over and over, so repeated requests
+    get the same document object back.
+    """
+    return parse(query)
+
+
+@lru_cache(maxsize=DOCUMENT_CACHE_SIZE)
+def _validate_query(schema, query, rules, max_errors):
+    return tuple(validate(schema, parse_document(query), list(rules) if rules else None, max_errors))
+
+
+def validate_document(schema, document, rules=None, max_errors=None):
+    """``graphql.validate``, cached for documents that came from ``parse_document``."""
+    query = document.loc.source.body if document.loc else None
+    try:
+        cached = query is not None and parse_document(query) is document
+    except Exception:
+        cached = False
+    if not cached:
+        return validate(schema, document, rules, max_errors)
+    return list(_validate_query(schema, query, tuple(rules) if rules else None, max_errors))
+
+
+# ----------------------
+# GraphQL endpoint
+# ----------------------
+class CRMGraphQLView(GraphQLView):
+    """GraphQLView that also accepts a JSON array of operations.
+
+    A single object body behaves exactly like the stock view. An array body is
+    executed as a batch: every operation shares the same request context (and
+    therefore the same DB connection and ``request.dataloaders`` cache), runs
+    in the order it was sent, and the results come back as an array. Batches
+    run sequentially on purpose: Django's DB connection is per thread, so
+    concurrent operations would each need their own connection and could not
+    see earlier mutations of the same batch. An entry that cannot run (no
+    query, bad variables) gets an error of its own; the others still run.
+
+    Queries sent with ``Accept: application/x-ndjson`` that select
+    ``allOrders``/``allCustomers`` are delivered incrementally, see
+    ``crm.streaming``. POSTs with an ``Idempotency-Key`` header replay the
+    stored response of an earlier mutation, see ``crm.idempotency``. GET
+    queries can be persisted by hash and get ETags, see ``crm.httpcache``.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        mode = profiling.requested_mode(request)
+        if not mode:
+            return self.dispatch_unprofiled(request, *args, **kwargs)
+        with profiling.profile(self.get_profile_label(request), mode) as handle:
+            response = self.dispatch_unprofiled(request, *args, **kwargs)
+        response["X-CRM-Profile-File"] = handle.path.name
+        return response
+
+    def get_profile_label(self, request):
+        operation_name = request.GET.get("operationName")
+        if not operation_name and self.get_content_type(request) == "application/json":
+            try:
+                body = json.loads(request.body)
+            except ValueError:
+                body = None
+            if isinstance(body, dict):
+                operation_name = body.get("operationName")
+        return f"graphql-{operation_name or 'anonymous'}"
+
+    def dispatch_unprofiled(self, request, *args, **kwargs):
+        if NDJSON_CONTENT_TYPE in request.META.get("HTTP_ACCEPT", ""):
+            response = self.get_streaming_response(request)
+            if response is not None:
+                return response
+        key = request.META.get("HTTP_IDEMPOTENCY_KEY")
+        if key and request.method == "POST":
+            response = self.dispatch_idempotent(request, key, *args, **kwargs)
+        elif request.method == "GET":
+            response = self.dispatch_cacheable(request, *args, **kwargs)
+        else:
+            response = super().dispatch(request, *args, **kwargs)
+        return httpcache.compress(request, response)
+
+    def dispatch_cacheable(self, request, *args, **kwargs):
+        """Answer If-None-Match without executing, and tag cacheable results with an ETag."""
+        etag = self.get_etag(request)
+        if etag:
+            current = httpcache.matching_etag(request, etag)
+            if current:
+                return httpcache.not_modified(current)
+
+        if etag:
+            # The tag carries the primary's data versions, so the data must come
+            # from the primary too: a lagging replica would get a current tag
+            with read_from_primary():
+                response = super().dispatch(request, *args, **kwargs)
+        else:
+            response = super().dispatch(request, *args, **kwargs)
+        if (
+            etag
+            and response.status_code == 200
+            and response["Content-Type"] == "application/json"
+            and getattr(request, "graphql_errors", True) is False
+        ):
+            response["ETag"] = etag
+            response["Cache-Control"] = httpcache.HTTP_CACHE_CONTROL
+            # The body does not depend on cookies, and shared caches will not
+            # store a response setting one (GraphQLView.dispatch sets the CSRF cookie)
+            response.cookies.pop(settings.CSRF_COOKIE_NAME, None)
+            vary = [header for header in cc_delim_re.split(response.get("Vary", "")) if header and header.lower() != "cookie"]
+            if vary:
+                response["Vary"] = ", ".join(vary)
+            elif response.has_header("Vary"):
+                del response["Vary"]
+            patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+    def get_etag(self, request):
+        if self.graphiql and self.can_display_graphiql(request, {}):
+            return None
+        try:
+            query, variables, operation_name, _ = self.get_graphql_params(request, {})
+            document, validation_errors = self.get_document(self.schema.graphql_schema, query)
+        except Exception:
+            # The regular dispatch reports whatever went wrong
+            return None
+        if validation_errors:
+            return None
+        return httpcache.make_etag(document, query, variables, operation_name)
+
+    def dispatch_idempotent(self, request, key, *args, **kwargs):
+        body_fingerprint = idempotency.fingerprint(request.body)
+        try:
+            stored = idempotency.claim(key, body_fingerprint)
+        except idempotency.IdempotencyError as e:
+            return JsonResponse({"errors": [{"message": str(e)}]}, status=e.status)
+        if stored is not None:
+            status, content_type, content = stored
+            response = HttpResponse(content, status=status, content_type=content_type)
+            response["Idempotent-Replayed"] = "true"
+            return response
+
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except BaseException:
+            idempotency.release(key)
+            raise
+        # Only mutations are worth replaying; server errors may succeed on retry
+        if getattr(request, "executed_mutation", False) and response.status_code < 500:
+            idempotency.complete(key, body_fingerprint, response.status_code, response["Content-Type"], response.content)
+        else:
+            idempotency.release(key)
+        return response
+
+    def get_streaming_response(self, request):
+        """Return an NDJSON response, or None to fall back to a regular one."""
+        if request.method.lower() not in ("get", "post"):
+            return None
+        try:
+            data = self.parse_body(request)
+            if self.batch:
+                self.batch = False
+                return None
+            query, variables, operation_name, _ = self.get_graphql_params(request, data)
+        except HttpError:
+            return None
+        if not query:
+            return None
+
+        schema = self.schema.graphql_schema
+        try:
+            document, validation_errors = self.get_document(schema, query)
+        except Exception:
+            return None
+        operation_ast = get_operation_ast(document, operation_name)
+        streamed = get_streamed_fields(operation_ast, variables)
+        if not streamed or validation_errors:
+            return None
+
+        execute_options = {
+            "root_value": self.get_root_value(request),
+            "context_value": self.get_context(request),
+            "variable_values": variables,
+            "middleware": self.get_middleware(request),
+        }
+        if self.execution_context_class:
+            execute_options["execution_context_class"] = self.execution_context_class
+
+        payloads = stream_payloads(schema, document, operation_ast, streamed, execute_options)
+        return StreamingHttpResponse(encode_ndjson(payloads), content_type=NDJSON_CONTENT_TYPE)
+
+    def parse_body(self, request):
+        if self.get_content_type(request) != "application/json":
+            return super().parse_body(request)
+
+        try:
+            request_json = json.loads(request.body.decode("utf-8"))
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise HttpError(HttpResponseBadRequest("POST body sent invalid JSON."))
+
+        if isinstance(request_json, list):
+            if not request_json:
+                raise HttpError(HttpResponseBadRequest("Received an empty list in the batch request."))
+            if len(request_json) > MAX_BATCH_SIZE:
+                raise HttpError(HttpResponseBadRequest(
+                    f"Batch requests are limited to {MAX_BATCH_SIZE} operations."
+                ))
+            if not all(isinstance(entry, dict) for entry in request_json):
+                raise HttpError(HttpResponseBadRequest("Every batch entry must be a JSON query object."))
+            # Views are instantiated per request, so toggling batch mode here is safe
+            self.batch = True
+            return request_json
+
+        if not isinstance(request_json, dict):
+            raise HttpError(HttpResponseBadRequest("The received data is not a valid JSON query."))
+        return request_json
+
+    def get_response(self, request, data, show_graphiql=False):
+        try:
+            return super().get_response(request, data, show_graphiql)
+        except HttpError as e:
+            if not self.batch:
+                raise
+            status_code = e.response.status_code
+            response = {"errors": [self.format_error(e)], "id": data.get("id"), "status": status_code}
+            return self.json_encode(request, response), status_code
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        try:
+            query = httpcache.resolve_persisted_query(query, extensions)
+        except httpcache.PersistedQueryNotFound as e:
+            raise HttpError(HttpResponse(), str(e))
+        except ValueError as e:
+            raise HttpError(HttpResponseBadRequest(), str(e))
+        return query, variables, operation_name, id
+
+    def get_context(self, request):
+        # One loader cache per HTTP request, shared by every operation in a batch
+        if not hasattr(request, "dataloaders"):
+            request.dataloaders = {}
+        return request
+
+    def get_document(self, schema, query):
+        """Return ``(document, validation_errors)`` from the per-process caches."""
+        document = parse_document(query)
+        errors = validate_document(schema, document, self.validation_rules, graphene_settings.MAX_VALIDATION_ERRORS)
+        return document, errors
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        """GraphQLView.execute_graphql_request on cached documents, inside a tracing span."""
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema = self.schema.graphql_schema
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return ExecutionResult(data=None, errors=schema_validation_errors)
+        try:
+            document, validation_errors = self.get_document(schema, query)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseNotAllowed(
+                ["POST"], f"Can only perform a {operation_ast.operation.value} operation from a POST request.",
+            ))
+        if validation_errors:
+            return ExecutionResult(data=None, errors=validation_errors)
+
+        operation_type = operation_ast.operation.value if operation_ast is not None else "query"
+        if operation_ast is not None and operation_ast.operation == OperationType.MUTATION:
+            request.executed_mutation = True
+
+        operation_label = operation_name or (operation_ast.name.value if operation_ast and operation_ast.name else "")
+        with tracing.span(f"graphql.{operation_type} {operation_label}".rstrip(), attributes={
+            "graphql.operation.type": operation_type,
+            "graphql.operation.name": operation_label or None,
+            "graphql.document": query,
+        }) as operation_span:
+            result = self.execute_document(request, schema, document, operation_ast, variables, operation_name)
+            if operation_span is not None and result.errors:
+                operation_span.status = tracing.STATUS_ERROR
+                operation_span.message = str(result.errors[0])
+        # Partial results may be transient failures; dispatch_cacheable leaves them untagged
+        request.graphql_errors = bool(result.errors)
+        return result
+
+    def execute_document(self, request, schema, document, operation_ast, variables, operation_name):
+        """Execute a validated document, mutations atomically as GraphQLView does."""
+        try:
+            execute_options = {
+                "root_value": self.get_root_value(request),
+                "context_value": self.get_context(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "middleware": self.get_middleware(request),
+            }
+            if self.execution_context_class:
+                execute_options["execution_context_class"] = self.execution_context_class
+
+            if (
+                operation_ast is not None
+                and operation_ast.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                )
+            ):
+                with transaction.atomic():
+                    result = execute(schema, document, **execute_options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+            return execute(schema, document, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+
+class FastJSONGraphQLView(CRMGraphQLView):
+    """CRMGraphQLView that encodes responses with ``crm.encoding``.
+
+    Subclasses can swap ``encode`` for any callable returning UTF-8 bytes.
+    Pretty-printed responses still go through the stock encoder.
+    """
+
+    encode = staticmethod(encoding.encode)
+
+    def json_encode(self, request, d, pretty=False):
+        if self.pretty or pretty or request.GET.get("pretty"):
+            return super().json_encode(request, d, pretty)
+        content = self.encode(d)
+        # GraphQLView.dispatch joins batched responses as text
+        return content.decode("utf-8") if self.batch else content
+
+
+@never_cache
+def healthz(request):
+    """Liveness: the process is up and serving requests."""
+    return JsonResponse({"status": "ok"})
+
+
+@never_cache
+def readyz(request):
+    """Readiness: 200 when every dependency check passes, 503 otherwise (see crm.health)."""
+    ready, checks, age = health.get_readiness()
+    return JsonResponse(
+        {"status": "ok" if ready else "unavailable", "checks": checks, "age": age},
+        status=200 if ready else 503,
+    )
+
+
+@never_cache
+def admission_state(request):
+    """This process's admission-control counters, for staff and internal monitoring only."""
+    user = getattr(request, "user", None)
+    if not (user is not None and user.is_staff) and request.META.get("REMOTE_ADDR") not in ADMISSION_STATE_ALLOWED_IPS:
+        return JsonResponse({"errors": [{"message": "Forbidden."}]}, status=403)
+    return JsonResponse(get_admission_state())
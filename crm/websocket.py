@@ -0,0 +1,153 @@
+"""GraphQL over WebSockets (``graphql-transport-ws`` protocol) as a bare ASGI app.
+
+Subscriptions read events from ``crm.broadcast``; each event is executed
+against the subscription document in Django's sync thread (the ORM is not
+async-safe) and the result is memoised on the event, so subscribers sharing a
+query and variables cost one execution and one JSON encode per event.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from graphene_django.settings import graphene_settings
+from graphql import (
+    ExecutionResult,
+    GraphQLError,
+    OperationType,
+    execute,
+    get_operation_ast,
+    parse,
+    validate,
+)
+from graphql.execution.subscribe import create_source_event_stream
+
+PROTOCOL = "graphql-transport-ws"
+
+
+class WebSocketContext:
+    """``info.context`` for operations received over a socket."""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.dataloaders = {}
+
+
+class GraphQLWebSocketApp:
+    def __init__(self, schema=None):
+        self._schema = schema
+
+    @property
+    def schema(self):
+        return (self._schema or graphene_settings.SCHEMA).graphql_schema
+
+    async def __call__(self, scope, receive, send):
+        message = await receive()
+        if message["type"] != "websocket.connect":
+            return
+        if PROTOCOL not in scope.get("subprotocols", ()):
+            await send({"type": "websocket.close", "code": 4406})
+            return
+        await send({"type": "websocket.accept", "subprotocol": PROTOCOL})
+
+        lock = asyncio.Lock()
+
+        async def send_json(data):
+            text = data if isinstance(data, str) else json.dumps(data, separators=(",", ":"))
+            async with lock:
+                await send({"type": "websocket.send", "text": text})
+
+        context = WebSocketContext(scope)
+        operations = {}
+        acknowledged = False
+        try:
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message["type"] != "websocket.receive":
+                    continue
+
+                try:
+                    data = json.loads(message.get("text") or message.get("bytes") or "")
+                    message_type = data["type"]
+                except (ValueError, KeyError, TypeError):
+                    await send({"type": "websocket.close", "code": 4400})
+                    break
+
+                if message_type == "connection_init":
+                    acknowledged = True
+                    await send_json({"type": "connection_ack"})
+                elif message_type == "ping":
+                    await send_json({"type": "pong"})
+                elif message_type == "subscribe":
+                    if not acknowledged:
+                        await send({"type": "websocket.close", "code": 4401})
+                        break
+                    operation_id = data.get("id")
+                    if operation_id in operations:
+                        await send({"type": "websocket.close", "code": 4409})
+                        break
+                    task = asyncio.ensure_future(
+                        self.run_operation(send_json, context, operation_id, data.get("payload") or {})
+                    )
+                    operations[operation_id] = task
+                    task.add_done_callback(lambda _, key=operation_id: operations.pop(key, None))
+                elif message_type == "complete":
+                    task = operations.pop(data.get("id"), None)
+                    if task:
+                        task.cancel()
+        finally:
+            for task in list(operations.values()):
+                task.cancel()
+
+    async def run_operation(self, send_json, context, operation_id, payload):
+        query = payload.get("query") or ""
+        variables = payload.get("variables")
+        operation_name = payload.get("operationName")
+        schema = self.schema
+
+        try:
+            document = parse(query)
+        except GraphQLError as error:
+            await send_json({"type": "error", "id": operation_id, "payload": [error.formatted]})
+            return
+        errors = validate(schema, document)
+        if errors:
+            await send_json({"type": "error", "id": operation_id, "payload": [e.formatted for e in errors]})
+            return
+
+        options = {
+            "context_value": context,
+            "variable_values": variables,
+            "operation_name": operation_name,
+        }
+        operation_ast = get_operation_ast(document, operation_name)
+
+        if operation_ast is None or operation_ast.operation != OperationType.SUBSCRIPTION:
+            result = await sync_to_async(execute)(schema, document, **options)
+            await send_json({"type": "next", "id": operation_id, "payload": result.formatted})
+        else:
+            stream = await create_source_event_stream(schema, document, **options)
+            if isinstance(stream, ExecutionResult):
+                await send_json({"type": "error", "id": operation_id, "payload": stream.formatted["errors"]})
+                return
+
+            # Subscribers with the same document and variables share one result per event
+            cache_key = ("result", query, operation_name, json.dumps(variables, sort_keys=True))
+            try:
+                async for event in stream:
+                    future = event.cache.get(cache_key)
+                    if future is None:
+                        future = event.cache[cache_key] = asyncio.ensure_future(
+                            self.execute_event(schema, document, event, options)
+                        )
+                    payload_text = await asyncio.shield(future)
+                    await send_json(f'{{"type":"next","id":{json.dumps(operation_id)},"payload":{payload_text}}}')
+            finally:
+                await stream.aclose()
+
+        await send_json({"type": "complete", "id": operation_id})
+
+    async def execute_event(self, schema, document, event, options):
+        result = await sync_to_async(execute)(schema, document, root_value=event, **options)
+        return json.dumps(result.formatted, separators=(",", ":"))
@@ -1,5 +1,5 @@
 import graphene
-from crm.schema import Query as CRMQuery, Mutation as CRMMutation
+from crm.schema import Query as CRMQuery, Mutation as CRMMutation, Subscription as CRMSubscription
 
 
 class Query(CRMQuery, graphene.ObjectType):
@@ -12,5 +12,10 @@ class Mutation(CRMMutation, graphene.ObjectType):
     pass
 
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+class Subscription(CRMSubscription, graphene.ObjectType):
+    """Root Subscription – aggregates subscriptions from the CRM app (and others in future)."""
+    pass
+
+
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
 